@@ -1,5 +1,7 @@
 
 import json
+import csv
+import io
 import telebot
 import os
 from dotenv import load_dotenv
@@ -12,9 +14,27 @@ from google.oauth2 import service_account  # ✅ Correct import
 import logging
 import time
 import functools
+import contextlib
 import threading
-from collections import OrderedDict
+import heapq
+import mmap
+import struct
+import random
+import itertools
+import sqlite3
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from urllib.parse import quote
+from collections import deque
 import requests
+import httpx
+import google.auth.transport.requests
+try:
+    import fcntl  # POSIX only; without it the dedup window is per-process
+except ImportError:
+    fcntl = None
+import metrics
+import tracing
 
 # ─── LOGGING SETUP ────────────────────────────────────────────────────────────
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -26,36 +46,264 @@ BOT_TOKEN = os.getenv('TELE_TOKEN')
 
 bot = telebot.TeleBot(BOT_TOKEN, threaded=False)
 
+# ─── METRICS ──────────────────────────────────────────────────────────────────
+# Hot-path instrumentation, served by main.py at /metrics (see metrics.py).
+HANDLER_SECONDS   = metrics.histogram("busbot_handler_seconds",
+    "Time to handle one update, by callback, command or conversation state.", ("route",))
+SHEETS_CALLS      = metrics.counter("busbot_sheets_calls_total",
+    "Sheets operations by function and outcome (one per attempt).", ("function", "outcome"))
+SHEETS_SECONDS    = metrics.histogram("busbot_sheets_call_seconds",
+    "Sheets operation latency by function, excluding lane waits.", ("function",))
+SHEETS_RETRIES    = metrics.counter("busbot_sheets_retries_total",
+    "Sheets attempts that failed and were retried, by function.", ("function",))
+SHEETS_GIVEUPS    = metrics.counter("busbot_sheets_giveups_total",
+    "Sheets operations that failed after the last retry, by function.", ("function",))
+LOCK_WAIT_SECONDS = metrics.histogram("busbot_lock_wait_seconds",
+    "Time spent waiting to acquire a lock, by lock.", ("lock",),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+DUPLICATE_UPDATES = metrics.counter("busbot_duplicate_updates_total",
+    "Updates dropped as redeliveries of an update already processed.")
+
+_in_flight = 0
+_in_flight_lock = threading.Lock()
+
+@contextlib.contextmanager
+def _track_in_flight():
+    global _in_flight
+    with _in_flight_lock:
+        _in_flight += 1
+    try:
+        yield
+    finally:
+        with _in_flight_lock:
+            _in_flight -= 1
+
+metrics.gauge("busbot_updates_in_flight",
+    "Updates past parsing and not yet finished, including those waiting on a chat lock.",
+    lambda: _in_flight)
+metrics.gauge("busbot_dispatch_queue_depth",
+    "Updates queued for a dispatch worker (async webhook mode).",
+    lambda: _dispatch_executor._work_queue.qsize() if _dispatch_executor else 0)
+metrics.gauge("busbot_outbound_pending",
+    "Telegram sends queued or waiting to be retried.", lambda: outbound.pending())
+metrics.gauge("busbot_checkpoint_batch_pending",
+    "Checkpoint writes waiting for the next batch flush.",
+    lambda: len(checkpoint_batcher._pending))
+
+@contextlib.contextmanager
+def sheets_call(function, **attrs):
+    """Count, time and trace one Sheets operation under `function`."""
+    started = time.perf_counter()
+    try:
+        with tracing.span(f"sheets.{function}", **attrs):
+            yield
+    except Exception:
+        SHEETS_CALLS.labels(function, "error").inc()
+        raise
+    else:
+        SHEETS_CALLS.labels(function, "ok").inc()
+    finally:
+        SHEETS_SECONDS.labels(function).observe(time.perf_counter() - started)
+
+@contextlib.contextmanager
+def waited_lock(lock, name):
+    """Hold `lock`, recording the wait for it in metrics and the current trace."""
+    wall, started = time.time(), time.perf_counter()
+    with lock:
+        waited = time.perf_counter() - started
+        LOCK_WAIT_SECONDS.labels(name).observe(waited)
+        tracing.record(f"wait.{name}", tracing.current(), wall, waited)
+        yield
+
+def traced_handler(func):
+    """Give each call of a telebot handler its own span (see TRACE_PATH)."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with tracing.span("handler", handler=func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+# ─── KEYED LOCKS ──────────────────────────────────────────────────────────────
+# Per-chat and per-row locks live in a table entry only while some thread
+# holds or is waiting for them; the last one out removes the entry. The
+# table's size tracks concurrent activity, not every chat or row ever seen,
+# so memory stays flat over a multi-day event.
+LOCK_CONTENTIONS = metrics.counter("busbot_lock_contended_total",
+    "Keyed lock acquisitions that had to wait for another holder, by table.", ("table",))
+
+class _LockEntry:
+    __slots__ = ("lock", "refs")
+
+    def __init__(self, lock):
+        self.lock = lock
+        self.refs = 0
+
+class KeyedLocks:
+    """Reference-counted locks by key, evicted as soon as they are idle."""
+    def __init__(self, name, factory=threading.Lock):
+        self.name      = name
+        self.peak      = 0
+        self._factory  = factory
+        self._entries  = {}
+        self._guard    = threading.Lock()
+        self._contended = LOCK_CONTENTIONS.labels(name)
+        metrics.gauge(f"busbot_{name}_locks_active",
+            f"Entries in the {name} lock table (held or waited on).", lambda: len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {"active": len(self._entries), "peak": self.peak, "contended": int(self._contended.value)}
+
+    @contextlib.contextmanager
+    def hold(self, key):
+        with self._guard:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _LockEntry(self._factory())
+                self.peak = max(self.peak, len(self._entries))
+            entry.refs += 1
+        try:
+            if not entry.lock.acquire(blocking=False):
+                self._contended.inc()
+                entry.lock.acquire()
+            try:
+                yield
+            finally:
+                entry.lock.release()
+        finally:
+            with self._guard:
+                entry.refs -= 1
+                if entry.refs == 0:
+                    del self._entries[key]
+
+class AsyncKeyedLocks:
+    """KeyedLocks for the event loop thread (asyncio.Lock, no guard needed)."""
+    def __init__(self, name):
+        self.name      = name
+        self.peak      = 0
+        self._entries  = {}
+        self._contended = LOCK_CONTENTIONS.labels(name)
+        metrics.gauge(f"busbot_{name}_locks_active",
+            f"Entries in the {name} lock table (held or waited on).", lambda: len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        return {"active": len(self._entries), "peak": self.peak, "contended": int(self._contended.value)}
+
+    @contextlib.asynccontextmanager
+    async def hold(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _LockEntry(asyncio.Lock())
+            self.peak = max(self.peak, len(self._entries))
+        entry.refs += 1
+        try:
+            if entry.lock.locked():
+                self._contended.inc()
+            async with entry.lock:
+                yield
+        finally:
+            entry.refs -= 1
+            if entry.refs == 0:
+                del self._entries[key]
+
+def lock_stats():
+    """Size and contention of each keyed lock table (reported by /health)."""
+    return {t.name: t.stats() for t in (_chat_locks, _async_chat_locks, _sheet_lanes._rows)}
+
 # ─── DUPLICATE-UPDATE PROTECTION ──────────────────────────────────────────────
-_processed_updates = OrderedDict()
-_processed_lock = threading.Lock()
-_MAX_PROCESSED_IDS = 10000
+# Telegram update IDs only go up, so "seen before?" needs a high-water mark
+# plus one bit for each of the last DEDUP_WINDOW IDs (2 KB for 16384 IDs),
+# not a dict of every ID. With DEDUP_STATE_PATH set, the window lives in a
+# memory-mapped file guarded by flock, so every worker process on the host
+# shares one window and a redelivery is dropped whichever process gets it.
+DEDUP_WINDOW     = int(os.getenv("DEDUP_WINDOW", "16384"))
+DEDUP_STATE_PATH = os.getenv("DEDUP_STATE_PATH", "").strip()
+
+class UpdateWindow:
+    """Sliding window of recently seen update IDs: a high-water mark and a bitset."""
+    _HEADER = struct.Struct("<8sqqq")  # magic, high-water mark, window size, last update (epoch s)
+    _MAGIC  = b"BUSDEDUP"
+    # Telegram stops redelivering after a day, and may restart its ID
+    # sequence after a quiet week, so a window idle this long is discarded.
+    _IDLE_RESET = 24 * 3600
+
+    def __init__(self, window, path=None):
+        self.window = max(64, window - window % 8)
+        self._lock  = threading.Lock()
+        self._file  = None
+        size = self._HEADER.size + self.window // 8
+        if path:
+            self._file = open(path, "a+b")
+            with self._flock():
+                if os.fstat(self._file.fileno()).st_size < size:
+                    self._file.truncate(size)
+                self._buf = mmap.mmap(self._file.fileno(), size)
+                magic, _, stored_window, _ = self._HEADER.unpack_from(self._buf, 0)
+                if magic != self._MAGIC or stored_window != self.window:
+                    self._buf[:size] = bytes(size)
+                    self._HEADER.pack_into(self._buf, 0, self._MAGIC, -1, self.window, 0)
+        else:
+            self._buf = bytearray(size)
+            self._HEADER.pack_into(self._buf, 0, self._MAGIC, -1, self.window, 0)
+
+    @contextlib.contextmanager
+    def _flock(self):
+        if self._file is None or fcntl is None:
+            yield
+            return
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _bit(self, update_id):
+        slot = update_id % self.window
+        return self._HEADER.size + slot // 8, 1 << (slot % 8)
+
+    def seen(self, update_id):
+        """Record `update_id`; True if it was already in the window."""
+        now = int(time.time())
+        with self._lock, self._flock():
+            _, high, _, updated_at = self._HEADER.unpack_from(self._buf, 0)
+            if high < 0 or now - updated_at > self._IDLE_RESET or update_id - high >= self.window:
+                # First update, a long quiet spell, or a jump past the whole
+                # window: start a fresh window.
+                self._buf[self._HEADER.size:] = bytes(self.window // 8)
+                high = update_id
+            elif high - update_id >= self.window:
+                # Older than anything we still track: only a late redelivery
+                # can be that far behind.
+                return True
+            elif update_id > high:
+                # Clear the slots the window slides over.
+                for stale in range(high + 1, update_id + 1):
+                    index, mask = self._bit(stale)
+                    self._buf[index] &= ~mask & 0xFF
+                high = update_id
+            index, mask = self._bit(update_id)
+            if self._buf[index] & mask:
+                return True
+            self._buf[index] |= mask
+            self._HEADER.pack_into(self._buf, 0, self._MAGIC, high, self.window, now)
+            return False
+
+_update_window = UpdateWindow(DEDUP_WINDOW, DEDUP_STATE_PATH or None)
 
 def _is_duplicate_update(update_id):
     if update_id is None:
         return False
-    with _processed_lock:
-        if update_id in _processed_updates:
-            return True
-        _processed_updates[update_id] = True
-        while len(_processed_updates) > _MAX_PROCESSED_IDS:
-            _processed_updates.popitem(last=False)
-        return False
+    return _update_window.seen(update_id)
     
 # Serialise processing per chat so two near-simultaneous taps from the same user
 # can't interleave and both advance the checkpoint / both write to the sheet.
-_chat_locks = {}
-_chat_locks_guard = threading.Lock()
-_sheet_lock = threading.RLock() # RLock in case any sheet function calls another
-
-def _get_chat_lock(chat_id):
-    with _chat_locks_guard:
-        lock = _chat_locks.get(chat_id)
-        if lock is None:
-            lock = threading.Lock()
-            _chat_locks[chat_id] = lock
-        return lock
-    
+_chat_locks = KeyedLocks("chat")
+
 def _extract_chat_id(update):
     if getattr(update, "message", None):
         return update.message.chat.id
@@ -72,30 +320,410 @@ def process_update_from_webhook(update_json):
         return
     
     # Drop Telegram's redelivered duplicates so one tap = one action.
-    if _is_duplicate_update(update.update_id):
+    chat_id = _extract_chat_id(update)
+    tracing.set_attrs(update_id=update.update_id, chat_id=chat_id)
+    with tracing.span("dedup"):
+        duplicate = _is_duplicate_update(update.update_id)
+    if duplicate:
+        DUPLICATE_UPDATES.inc()
+        tracing.set_attrs(duplicate=True)
         logging.info(f"[DEDUP] Ignoring duplicate update {update.update_id}")
         return
     
     # Serialise per-user so concurrent taps don't race on user_sessions.
-    chat_id = _extract_chat_id(update)
-    lock = _get_chat_lock(chat_id) if chat_id is not None else None
-    if lock:
-        with lock:
-            bot.process_new_updates([update])
-    else:
+    with _track_in_flight():
+        if chat_id is not None:
+            with waited_lock(_chat_locks.hold(chat_id), "chat"):
+                _dispatch_update(update, chat_id)
+        else:
+            _dispatch_update(update, chat_id)
+    _drain_replies(chat_id)
+
+# Longest an update waits for its queued replies to go out before returning.
+SEND_DRAIN_TIMEOUT = float(os.getenv("SEND_DRAIN_TIMEOUT", "10"))
+
+def _drain_replies(chat_id):
+    """Don't return (and let Cloud Run throttle the CPU) while this chat's
+    replies are queued. Called after the chat lock is released, so the
+    chat's next update doesn't wait for these sends."""
+    if SEND_QUEUE_ENABLED and chat_id is not None:
+        with tracing.span("send_drain"):
+            outbound.wait_idle(chat_id, SEND_DRAIN_TIMEOUT)
+
+def _update_route(update, chat_id):
+    """Low-cardinality label for what an update is about to trigger."""
+    call = getattr(update, "callback_query", None)
+    if call is not None:
+        data = (call.data or "").partition("@")[0]
+        for prefix in ("yes_", "cb_"):
+            if data.startswith(prefix):
+                return f"callback:{prefix}"
+        return f"callback:{data}"
+    message = getattr(update, "message", None)
+    text = (getattr(message, "text", None) or "").strip()
+    if text.startswith("/"):
+        command = text.split()[0].split("@")[0]
+        return command if command in _COMMAND_ROUTES else "command:other"
+    state = user_sessions.get(chat_id, {}).get("state")
+    return f"state:{state}" if state else "message"
+
+_COMMAND_ROUTES = ("/start", "/end", "/list", "/edit_pax", "/edit_plate", "/dashboard", "/export")
+
+def _dispatch_update(update, chat_id):
+    route = _update_route(update, chat_id)
+    with tracing.span("dispatch", route=route), HANDLER_SECONDS.labels(route).time():
         bot.process_new_updates([update])
+    if chat_id is not None:
+        with tracing.span("persist_session"):
+            persist_session(chat_id)
+
+# ─── ASYNC WEBHOOK MODE ───────────────────────────────────────────────────────
+# Enabled from main.py with ASYNC_WEBHOOK=1. Parsing, dedup and per-chat
+# ordering happen on the event loop, so an update that is queued behind
+# another tap from the same chat waits on an asyncio.Lock instead of holding a
+# thread. Only the handler itself runs on a worker thread, from a pool sized
+# by ASYNC_DISPATCH_WORKERS rather than the loop's small default executor.
+# Whole-sheet reads for admin panels are fetched on the loop through an httpx
+# client so the largest Sheets download never occupies a worker either. The
+# same client sends checkpoint batches and outbox replays (batchUpdate): the
+# flushing thread hands the request to the loop, and hundreds of them share
+# its connection pool instead of each holding a blocking gspread call.
+ASYNC_DISPATCH_WORKERS = int(os.getenv("ASYNC_DISPATCH_WORKERS", "64"))
+
+_async_chat_locks = AsyncKeyedLocks("async_chat")
+_dispatch_executor = None
+_async_sheets = None
+_async_loop = None  # the loop updates are dispatched from; Sheets writes are sent on it
+
+# Callbacks that render from a whole-sheet snapshot.
+_SNAPSHOT_CALLBACKS = ("admin_list_refresh", "admin_back")
+
+def _get_dispatch_executor():
+    """Event loop thread only."""
+    global _dispatch_executor, _async_loop
+    if _dispatch_executor is None:
+        _dispatch_executor = ThreadPoolExecutor(
+            max_workers=ASYNC_DISPATCH_WORKERS, thread_name_prefix="dispatch")
+        _async_loop = asyncio.get_running_loop()
+    return _dispatch_executor
+
+class AsyncSheetsClient:
+    """Minimal Sheets v4 client on one shared httpx connection pool."""
+    BASE_URL = "https://sheets.googleapis.com/v4/spreadsheets"
+
+    def __init__(self, credentials, max_connections=20, transport=None):
+        self.credentials = credentials
+        self._client = httpx.AsyncClient(
+            timeout=httpx.Timeout(30.0), transport=transport,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections))
+        self._token_lock = asyncio.Lock()
+
+    async def _auth_headers(self):
+        async with self._token_lock:
+            if not self.credentials.valid:
+                # google-auth only ships a blocking refresh; it runs about once an hour.
+                await asyncio.to_thread(
+                    self.credentials.refresh, google.auth.transport.requests.Request())
+        return {"Authorization": f"Bearer {self.credentials.token}"}
+
+    async def get_values(self, spreadsheet_id, range_name):
+        response = await self._client.get(
+            f"{self.BASE_URL}/{spreadsheet_id}/values/{quote(range_name, safe='')}",
+            headers=await self._auth_headers())
+        response.raise_for_status()
+        return response.json().get("values", [])
+
+    async def batch_update(self, spreadsheet_id, body):
+        response = await self._client.post(
+            f"{self.BASE_URL}/{spreadsheet_id}:batchUpdate",
+            json=body, headers=await self._auth_headers())
+        response.raise_for_status()
+        return response.json()
+
+    async def aclose(self):
+        await self._client.aclose()
+
+def configure_async_sheets(client):
+    """Use `client` instead of one built from the gspread credentials (local stand-ins, tests)."""
+    global _async_sheets
+    _async_sheets = client
+
+def _get_async_sheets():
+    global _async_sheets
+    if _async_sheets is None:
+        _async_sheets = AsyncSheetsClient(get_sheets_client().http_client.auth)
+    return _async_sheets
+
+def _async_sheets_target():
+    """(AsyncSheetsClient, spreadsheet id); the first call authenticates and
+    fetches the spreadsheet's metadata, so the loop runs it in a thread."""
+    return _get_async_sheets(), get_spreadsheet().id
+
+def _as_gspread_error(exc):
+    """The requests/gspread equivalent of an httpx error, so retry_on_error
+    and the breaker classify it as they would a gspread call's."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        response = requests.Response()
+        response.status_code = exc.response.status_code
+        response._content    = exc.response.content
+        response.headers.update(exc.response.headers)
+        return gspread.exceptions.APIError(response)
+    return requests.exceptions.ConnectionError(str(exc))
+
+def sheets_batch_update(body):
+    """spreadsheets.batchUpdate from a worker thread: sent on the event loop's
+    httpx pool in async and queued mode, through gspread otherwise."""
+    loop = _async_loop
+    try:
+        on_loop = asyncio.get_running_loop() is loop
+    except RuntimeError:
+        on_loop = False
+    if loop is None or loop.is_closed() or on_loop:
+        return get_spreadsheet().batch_update(body)
+    client, spreadsheet_id = _async_sheets_target()
+    try:
+        return asyncio.run_coroutine_threadsafe(client.batch_update(spreadsheet_id, body), loop).result()
+    except (httpx.HTTPStatusError, httpx.TransportError) as e:
+        raise _as_gspread_error(e) from e
+
+async def _prefetch_admin_snapshot(update):
+    """Refresh a stale admin snapshot on the loop before the handler needs it."""
+    call = getattr(update, "callback_query", None)
+    data, _, tab = (getattr(call, "data", None) or "").partition("@")
+    if data not in _SNAPSHOT_CALLBACKS:
+        return
+    tab = tab or default_admin_tab()
+    with _snapshot_lock:
+        snapshot = _snapshots.get(tab)
+    if (snapshot and snapshot.is_fresh()) or sheets_breaker.is_open():
+        return
+    try:
+        if _async_sheets is None or _spreadsheet is None:
+            client, spreadsheet_id = await asyncio.to_thread(_async_sheets_target)
+        else:
+            client, spreadsheet_id = _async_sheets, _spreadsheet.id
+        with sheets_call("async_get_values"):
+            values = await client.get_values(spreadsheet_id, gspread.utils.absolute_range_name(tab))
+        store_sheet_snapshot(tab, gspread.utils.fill_gaps(values))
+    except Exception as e:
+        # The handler falls back to a blocking read through gspread.
+        logging.warning(f"[ASYNC] Snapshot prefetch failed: {e}")
 
-# Load environment variables from .env file
-# UNCOMMENT TO run locally to connect google sheets
-# JSON_TOKEN = os.getenv('JSON_PATHNAME')
-# gc = gspread.service_account(filename=JSON_TOKEN)
-if os.getenv("GOOGLE_CREDS"):
-    credentials = os.getenv("GOOGLE_CREDS")
-    gc = gspread.service_account_from_dict(json.loads(credentials))
-else:
-    # Local fallback
-    JSON_TOKEN = os.getenv('JSON_PATHNAME')
-    gc = gspread.service_account(filename=JSON_TOKEN)
+async def process_update_async(update_json):
+    """Async-mode entry point called by main.py."""
+    update = telebot.types.Update.de_json(json.loads(update_json))
+    if update is None:
+        return
+
+    chat_id = _extract_chat_id(update)
+    tracing.set_attrs(update_id=update.update_id, chat_id=chat_id)
+    with tracing.span("dedup"):
+        duplicate = _is_duplicate_update(update.update_id)
+    if duplicate:
+        DUPLICATE_UPDATES.inc()
+        tracing.set_attrs(duplicate=True)
+        logging.info(f"[DEDUP] Ignoring duplicate update {update.update_id}")
+        return
+
+    loop = asyncio.get_running_loop()
+    lock = _async_chat_locks.hold(chat_id) if chat_id is not None else contextlib.nullcontext()
+    with _track_in_flight():
+        wall, started = time.time(), time.perf_counter()
+        async with lock:
+            waited = time.perf_counter() - started
+            LOCK_WAIT_SECONDS.labels("async_chat").observe(waited)
+            tracing.record("wait.async_chat", tracing.current(), wall, waited)
+            await _prefetch_admin_snapshot(update)
+            await loop.run_in_executor(_get_dispatch_executor(),
+                                       tracing.bind(_dispatch_update), update, chat_id)
+        if SEND_QUEUE_ENABLED:
+            await asyncio.to_thread(_drain_replies, chat_id)
+
+async def shutdown_async_mode():
+    """Close the shared async pools (called from main.py on shutdown)."""
+    global _async_sheets, _dispatch_executor, _async_loop
+    _async_loop = None  # writes from here on go through gspread
+    if _async_sheets is not None:
+        await _async_sheets.aclose()
+        _async_sheets = None
+    if _dispatch_executor is not None:
+        # Waiting for running handlers blocks; keep the loop free meanwhile.
+        await asyncio.to_thread(_dispatch_executor.shutdown, True)
+        _dispatch_executor = None
+
+# ─── QUEUED WEBHOOK MODE ──────────────────────────────────────────────────────
+# Enabled from main.py with WEBHOOK_QUEUE=1. The webhook parses and dedups the
+# update, puts it on an in-process queue and answers 200 straight away, so
+# Telegram never waits on a Sheets write. Each chat with pending updates gets
+# one worker task that handles them in arrival order; different chats run in
+# parallel on the dispatch pool. At UPDATE_QUEUE_MAX pending updates new ones
+# are refused (main.py answers 503) and Telegram redelivers them later. On
+# shutdown the queue stops accepting and drains for UPDATE_QUEUE_DRAIN_TIMEOUT.
+# On Cloud Run this needs "CPU always allocated"; otherwise the CPU is
+# throttled as soon as the 200 goes out.
+UPDATE_QUEUE_MAX           = int(os.getenv("UPDATE_QUEUE_MAX", "2000"))
+UPDATE_QUEUE_DRAIN_TIMEOUT = float(os.getenv("UPDATE_QUEUE_DRAIN_TIMEOUT", "25"))
+
+class UpdateQueue:
+    """Bounded per-chat FIFOs, each served by its own worker task while non-empty."""
+    def __init__(self, limit):
+        self.limit    = limit
+        self.depth    = 0
+        self.closed   = False
+        self._chats   = {}  # chat key -> deque of (update, chat_id, trace parent, queued_at)
+        self._workers = set()
+
+    def full(self):
+        return self.closed or self.depth >= self.limit
+
+    def chats(self):
+        return len(self._chats)
+
+    def submit(self, update, chat_id):
+        """Queue `update` behind the chat's earlier ones. Event loop thread only."""
+        if self.full():
+            return False
+        # Updates without a chat have nothing to stay ordered with.
+        key = chat_id if chat_id is not None else object()
+        queue = self._chats.get(key)
+        if queue is None:
+            queue = self._chats[key] = deque()
+            worker = asyncio.get_running_loop().create_task(self._serve(key, queue))
+            self._workers.add(worker)
+            worker.add_done_callback(self._workers.discard)
+        queue.append((update, chat_id, tracing.current(), time.monotonic()))
+        self.depth += 1
+        return True
+
+    async def _serve(self, key, queue):
+        loop = asyncio.get_running_loop()
+        while queue:
+            update, chat_id, parent, queued_at = queue.popleft()
+            try:
+                with tracing.span("queued_update", parent=parent,
+                                  queued_ms=round((time.monotonic() - queued_at) * 1000, 1)), \
+                        _track_in_flight():
+                    await _prefetch_admin_snapshot(update)
+                    await loop.run_in_executor(_get_dispatch_executor(),
+                                               tracing.bind(_dispatch_update), update, chat_id)
+            except Exception as e:
+                logging.error(f"[QUEUE] Update {update.update_id} for {chat_id} failed: {e}")
+            finally:
+                self.depth -= 1
+        # No await since the last emptiness check, so nothing was added meanwhile.
+        del self._chats[key]
+
+    async def drain(self, timeout):
+        """Stop accepting updates and wait up to `timeout` s for the queued ones."""
+        self.closed = True
+        if self._workers:
+            logging.info(f"[QUEUE] Draining {self.depth} update(s) across {len(self._chats)} chat(s)...")
+            await asyncio.wait(set(self._workers), timeout=timeout)
+        if self.depth:
+            logging.error(f"[QUEUE] Shutdown with {self.depth} update(s) still queued.")
+
+update_queue = UpdateQueue(UPDATE_QUEUE_MAX)
+metrics.gauge("busbot_update_queue_depth",
+    "Updates accepted by the webhook and not yet handled (queued mode).", lambda: update_queue.depth)
+metrics.gauge("busbot_update_queue_chats",
+    "Chats with queued updates (queued mode).", lambda: update_queue.chats())
+
+async def enqueue_update(update_json):
+    """Queued-mode entry point: False means the queue is full (answer 503)."""
+    update = telebot.types.Update.de_json(json.loads(update_json))
+    if update is None:
+        return True
+    # Check capacity before dedup, so a refused update isn't marked as seen
+    # and Telegram's redelivery of it is processed.
+    if update_queue.full():
+        logging.warning(f"[QUEUE] Full ({update_queue.depth}); refusing update {update.update_id}")
+        return False
+
+    chat_id = _extract_chat_id(update)
+    tracing.set_attrs(update_id=update.update_id, chat_id=chat_id)
+    with tracing.span("dedup"):
+        duplicate = _is_duplicate_update(update.update_id)
+    if duplicate:
+        DUPLICATE_UPDATES.inc()
+        tracing.set_attrs(duplicate=True)
+        logging.info(f"[DEDUP] Ignoring duplicate update {update.update_id}")
+        return True
+    return update_queue.submit(update, chat_id)
+
+async def drain_update_queue():
+    await update_queue.drain(UPDATE_QUEUE_DRAIN_TIMEOUT)
+
+# ─── STARTUP TIMING ───────────────────────────────────────────────────────────
+# Milliseconds spent in each cold-start phase, logged as they finish and
+# reported by main.py once the instance is ready.
+STARTUP_TIMINGS = {}
+
+@contextlib.contextmanager
+def startup_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP_TIMINGS[name] = round((time.perf_counter() - started) * 1000, 1)
+        logging.info(f"[STARTUP] {name}: {STARTUP_TIMINGS[name]} ms")
+
+# ─── LAZY SHEETS INIT ─────────────────────────────────────────────────────────
+# Nothing here touches the network at import time. The client and spreadsheet
+# are created on first use (or by warm_up() during startup). Setting
+# GSHEET_KEY opens the spreadsheet by ID, which skips the Drive search that
+# opening by GSHEET_NAME needs.
+_sheets_client = None
+_spreadsheet   = None
+_sheets_init_lock = threading.RLock()
+
+def get_sheets_client():
+    global _sheets_client
+    with _sheets_init_lock:
+        if _sheets_client is None:
+            # Load environment variables from .env file
+            # UNCOMMENT TO run locally to connect google sheets
+            # JSON_TOKEN = os.getenv('JSON_PATHNAME')
+            # gc = gspread.service_account(filename=JSON_TOKEN)
+            if os.getenv("GOOGLE_CREDS"):
+                credentials = os.getenv("GOOGLE_CREDS")
+                _sheets_client = gspread.service_account_from_dict(json.loads(credentials))
+            else:
+                # Local fallback
+                JSON_TOKEN = os.getenv('JSON_PATHNAME')
+                _sheets_client = gspread.service_account(filename=JSON_TOKEN)
+        return _sheets_client
+
+def configure_sheets_client(client):
+    """Use `client` instead of building one from credentials (local stand-ins, tests)."""
+    global _sheets_client, _spreadsheet
+    with _sheets_init_lock:
+        _sheets_client = client
+        _spreadsheet   = None
+    forget_worksheets()
+
+def get_spreadsheet():
+    global _spreadsheet
+    with _sheets_init_lock:
+        if _spreadsheet is None:
+            with startup_phase("open_spreadsheet"):
+                client = get_sheets_client()
+                if GSHEET_KEY:
+                    _spreadsheet = client.open_by_key(GSHEET_KEY)
+                else:
+                    _spreadsheet = client.open(GSHEET_NAME)
+        return _spreadsheet
+
+def warm_up():
+    """Open the spreadsheet and load every event tab's headers ahead of the first tap."""
+    if outbox is not None:
+        outbox.start()  # replay anything journalled before the restart
+    with startup_phase("sheets_warm_up"):
+        with startup_phase("fleet_progress"):
+            tabs = rebuild_fleet_progress(event_tabs())
+        with startup_phase("load_headers"):
+            for tab in tabs:
+                get_schema(get_worksheet(tab))
 
 
 
@@ -118,18 +746,67 @@ else:
 ##DO NOT UNCOMMENT BEYOND THIS LINE HERE
 
 GSHEET_NAME = os.getenv("GSHEET_NAME", "AL26 Bus Ops Tracking")
+GSHEET_KEY = os.getenv("GSHEET_KEY", "")
 GSHEET_TAB = os.getenv("GSHEET_TAB", "D5")
+# How long (seconds) admin views may reuse a downloaded copy of the sheet.
+SNAPSHOT_TTL = float(os.getenv("SNAPSHOT_TTL", "15"))
+# How old (seconds) the bus -> row index may be before a recovery miss re-reads
+# the Bus # column (another instance may have registered the bus meanwhile).
+BUS_INDEX_MAX_AGE = float(os.getenv("BUS_INDEX_MAX_AGE", "30"))
+
+# ─── TAB ROUTING ──────────────────────────────────────────────────────────────
+# One tab per event day (or per group of waves) keeps every tab small, so
+# snapshots, index builds and admin scans stay cheap as the event grows.
+# SHEET_TAB_ROUTES picks the tab a bus registers on, by wave or by the
+# Singapore date of registration:
+#     SHEET_TAB_ROUTES="wave:1=D5,wave:2=D5,wave:3=D6"
+#     SHEET_TAB_ROUTES="2026-12-20=D5,2026-12-21=D6"
+# Anything unrouted goes to GSHEET_TAB. The tab is stored in the session, so a
+# bus keeps writing to the tab it registered on even after midnight.
+def _parse_tab_routes(raw):
+    by_wave, by_date = {}, {}
+    for part in raw.split(","):
+        key, sep, tab = (x.strip() for x in part.partition("="))
+        if not sep or not key or not tab:
+            if part.strip():
+                logging.warning(f"[TABS] Ignoring malformed route '{part.strip()}'")
+            continue
+        if key.lower().startswith("wave:"):
+            by_wave[key[5:].strip()] = tab
+        else:
+            by_date[key] = tab
+    return by_wave, by_date
+
+_TAB_BY_WAVE, _TAB_BY_DATE = _parse_tab_routes(os.getenv("SHEET_TAB_ROUTES", ""))
+
+def _event_date():
+    return datetime.now(ZoneInfo("Asia/Singapore")).strftime("%Y-%m-%d")
+
+def tab_for_registration(session):
+    """Tab a newly registering bus is routed to."""
+    wave = str(session.get('wave', '')).strip()
+    return _TAB_BY_WAVE.get(wave) or _TAB_BY_DATE.get(_event_date()) or GSHEET_TAB
+
+def session_tab(session):
+    # Sessions saved before tab routing have no 'tab' and live on GSHEET_TAB.
+    return session.get('tab') or GSHEET_TAB
 
-sh = gc.open(GSHEET_NAME)
+def event_tabs():
+    """Every tab a bus may be on: today's first, then GSHEET_TAB, then other routes."""
+    tabs = [_TAB_BY_DATE.get(_event_date()), GSHEET_TAB,
+            *_TAB_BY_WAVE.values(), *(_TAB_BY_DATE[d] for d in sorted(_TAB_BY_DATE))]
+    return list(dict.fromkeys(t for t in tabs if t))
+
+def default_admin_tab():
+    return event_tabs()[0]
 
 WEBHOOK_TOKEN = BOT_TOKEN  # use token in URL path
 WEBHOOK_PATH = f"/{WEBHOOK_TOKEN}"
 WEBHOOK_URL = os.getenv("WEBHOOK_URL") + WEBHOOK_PATH  # set this in your environment, e.g. https://your-app-name.onrender.com/<token>
 
-# Store user sessions in memory (for a live bot, consider a DB)
+# Store user sessions in memory, written through to SESSION_DB_PATH (see
+# SESSION STORE below) so they survive restarts.
 user_sessions = {}
-# Cache the headers for optimization
-HEADER_CACHE = {}
 
 # Define the sequential steps with button prompts
 steps = [
@@ -172,32 +849,1431 @@ step_to_column = {
     "reached_star": "Time bus reach Star"
 }
 # ─── IMPROVEMENT 1: Retry Decorator ──────────────────────────────────────────
+# Attempts hold their lane; the backoff between attempts holds nothing, so a
+# flaky call for one bus doesn't stall anyone else. Delays use "equal jitter"
+# (half fixed, half random) so buses that failed together don't retry in
+# lockstep, and a Retry-After from Google wins over our own schedule. Only the
+# outermost retry-wrapped call retries: a wrapped helper called from inside
+# another wrapped function makes one attempt and lets the caller retry the
+# whole operation, instead of sleeping inside the caller's lane.
+RETRY_MAX_DELAY = float(os.getenv("SHEETS_RETRY_MAX_DELAY", "20"))
+
+_RETRYABLE_ERRORS = (gspread.exceptions.APIError, gspread.exceptions.GSpreadException,
+                     requests.exceptions.RequestException)
+_retry_depth = threading.local()
+
+def _api_status(exc):
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+def _is_transient(exc):
+    """True for failures that mean Sheets is struggling, not that the call is wrong.
+
+    Only network errors and 408/429/5xx answers count. Errors without a status
+    (WorksheetNotFound and other GSpreadExceptions) are about the call, and
+    mustn't open the breaker for everyone.
+    """
+    if isinstance(exc, requests.exceptions.RequestException) and not isinstance(exc, gspread.exceptions.APIError):
+        return True
+    status = _api_status(exc)
+    return status is not None and (status in (408, 429) or status >= 500)
+
+def _retry_after(exc):
+    """Seconds the API told us to wait (Retry-After), if it did."""
+    response = getattr(exc, "response", None)
+    value = getattr(response, "headers", {}).get("Retry-After") if response is not None else None
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
 
-def retry_on_error(max_retries=3, delay=2):
-    """Retries GSheet operations on API rate limit errors with exponential backoff."""
+def _backoff_delay(exc, attempt, base):
+    hinted = _retry_after(exc)
+    if hinted is not None:
+        return min(hinted, RETRY_MAX_DELAY * 3)
+    # Quota errors reset per minute; start those from a longer base.
+    if _api_status(exc) == 429:
+        base = max(base, 5)
+    ceiling = min(RETRY_MAX_DELAY, base * 2 ** (attempt - 1))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+# ─── SHEETS CIRCUIT BREAKER ───────────────────────────────────────────────────
+# After SHEETS_BREAKER_THRESHOLD consecutive transient failures the breaker
+# opens and retry-wrapped calls raise SheetsUnavailable immediately for
+# SHEETS_BREAKER_COOLDOWN seconds (or longer if Google sent Retry-After), so
+# handlers can tell the user straight away instead of queueing threads behind
+# an outage. After the cooldown one call is let through as a probe; its result
+# closes the breaker or opens it again.
+SHEETS_BREAKER_THRESHOLD = int(os.getenv("SHEETS_BREAKER_THRESHOLD", "5"))
+SHEETS_BREAKER_COOLDOWN  = float(os.getenv("SHEETS_BREAKER_COOLDOWN", "30"))
+
+class SheetsUnavailable(Exception):
+    """Raised without calling Sheets while the circuit breaker is open."""
+    def __init__(self, retry_in):
+        self.retry_in = retry_in
+        super().__init__(
+            f"Google Sheets is not responding right now. Please try again in about {max(1, round(retry_in))}s.")
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+    def __init__(self, threshold, cooldown):
+        self.threshold   = threshold
+        self.cooldown    = cooldown
+        self.state       = self.CLOSED
+        self.failures    = 0
+        self.reopen_at   = 0.0
+        self._probing    = False
+        self._lock       = threading.Lock()
+
+    def before_call(self):
+        """Raise SheetsUnavailable unless a call may go out now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            now = time.monotonic()
+            if self.state == self.OPEN and now >= self.reopen_at:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            SHEETS_FAST_FAILS.inc()
+            raise SheetsUnavailable(max(self.reopen_at - now, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logging.info("[BREAKER] Sheets calls are succeeding again; closing the circuit.")
+            self.state, self.failures, self._probing = self.CLOSED, 0, False
+
+    def record_failure(self, exc):
+        with self._lock:
+            # A failed batch flush hands the same exception to every waiting
+            # writer; it is still one failed call to Sheets.
+            if not getattr(exc, "_breaker_counted", False):
+                exc._breaker_counted = True
+                self.failures += 1
+            elif self.state != self.HALF_OPEN:
+                return
+            if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+                wait = max(self.cooldown, _retry_after(exc) or 0)
+                if self.state != self.OPEN:
+                    logging.error(f"[BREAKER] Sheets failing ({exc}); failing fast for {wait:.0f}s.")
+                self.state, self.reopen_at, self._probing = self.OPEN, time.monotonic() + wait, False
+
+    def release_probe(self):
+        """Let another call probe if this one ended without a verdict."""
+        with self._lock:
+            self._probing = False
+
+    def is_open(self):
+        with self._lock:
+            return self.state == self.OPEN and time.monotonic() < self.reopen_at
+
+SHEETS_FAST_FAILS = metrics.counter("busbot_sheets_fast_fails_total",
+    "Sheets operations refused because the circuit breaker was open.")
+sheets_breaker = CircuitBreaker(SHEETS_BREAKER_THRESHOLD, SHEETS_BREAKER_COOLDOWN)
+metrics.gauge("busbot_sheets_breaker_state",
+    "Sheets circuit breaker: 0 closed, 1 open, 2 half-open.", lambda: sheets_breaker.state)
+
+def retry_on_error(max_retries=3, delay=2, lane=None):
+    """Retries GSheet operations on transient errors with jittered exponential backoff.
+
+    `lane` is called with the wrapped function's arguments and returns the
+    lock to hold for each attempt (see SHEET CONCURRENCY LANES). The lock is
+    released before sleeping between attempts. Client errors other than a
+    stale tab are raised at once; SheetsUnavailable is raised without calling
+    Sheets while the circuit breaker is open.
+    """
     def decorator(func):
+        name = func.__name__
+        lane_name = f"lane:{lane.__name__.strip('_').removesuffix('_lane')}" if lane else None
+
+        def attempt(args, kwargs, number):
+            lock = waited_lock(lane(*args, **kwargs), lane_name) if lane else contextlib.nullcontext()
+            with lock, sheets_call(name, attempt=number):
+                return func(*args, **kwargs)
+
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            last_exc = None
-            for i in range(max_retries):
-                try:
-                    with _sheet_lock:
-                        return func(*args, **kwargs)
-                except (gspread.exceptions.APIError, gspread.exceptions.GSpreadException, requests.exceptions.RequestException) as e:
-                    last_exc = e
-                    logging.error(f"GSheet Error: {e}. Retrying {i+1}/{max_retries}...")
-                    time.sleep(delay * (i + 1))
-                except Exception as e:
-                    logging.error(f"Unexpected error in GSheet op: {e}")
-                    raise e
-            logging.error("Max retries reached for GSheet operation.")
-            # return None
-            # Re-raise so callers can distinguish "operation failed" from a
-            # legitimate None result (e.g. recovery finding no matching bus).
-            raise last_exc
+            depth = getattr(_retry_depth, "value", 0)
+            if depth:
+                # Nested inside another wrapped call: one attempt, the outer call retries.
+                return attempt(args, kwargs, 1)
+
+            _retry_depth.value = 1
+            try:
+                for i in range(1, max_retries + 1):
+                    sheets_breaker.before_call()
+                    try:
+                        result = attempt(args, kwargs, i)
+                    except _RETRYABLE_ERRORS as e:
+                        if _is_transient(e):
+                            sheets_breaker.record_failure(e)
+                        else:
+                            sheets_breaker.record_success()  # Sheets answered; the call was wrong
+                        stale_tab = _is_stale_tab_error(e)
+                        if stale_tab:
+                            logging.warning(f"[SHEET] Tab renamed or deleted ({e}); re-resolving worksheet handles.")
+                            forget_worksheets()
+                            forget_schemas()
+                        if not (stale_tab or _is_transient(e)):
+                            logging.error(f"GSheet Error in {name}: {e}. Not retrying a client error.")
+                            raise
+                        if i == max_retries:
+                            logging.error(f"Max retries reached for GSheet operation {name}: {e}")
+                            SHEETS_GIVEUPS.labels(name).inc()
+                            # Re-raise so callers can distinguish "operation failed" from a
+                            # legitimate None result (e.g. recovery finding no matching bus).
+                            raise
+                        wait = _backoff_delay(e, i, delay)
+                        logging.error(f"GSheet Error: {e}. Retrying {i}/{max_retries} in {wait:.1f}s...")
+                        SHEETS_RETRIES.labels(name).inc()
+                        with tracing.span("retry_backoff", function=name, seconds=round(wait, 2)):
+                            time.sleep(wait)
+                    except Exception as e:
+                        sheets_breaker.release_probe()
+                        logging.error(f"Unexpected error in GSheet op: {e}")
+                        raise
+                    else:
+                        sheets_breaker.record_success()
+                        return result
+            finally:
+                _retry_depth.value = 0
         return wrapper
     return decorator
 
+# ─── WORKSHEET HANDLES ────────────────────────────────────────────────────────
+# In gspread, spreadsheet.worksheet(title) fetches the spreadsheet's metadata
+# every time. Tabs are resolved once here and the handle reused by every
+# caller. A handle is only dropped when a call fails in a way that means the
+# tab was renamed or deleted (see retry_on_error). Routed tabs that don't
+# exist yet (tomorrow's) are remembered as missing for BUS_INDEX_MAX_AGE, so
+# looking a bus up across tabs doesn't fetch the metadata every time.
+_worksheet_handles = {}
+_missing_tabs = {}  # title -> monotonic time it was found missing
+_worksheet_lock = threading.Lock()
+
+def get_worksheet(title=None):
+    title = title or GSHEET_TAB
+    with _worksheet_lock:
+        worksheet = _worksheet_handles.get(title)
+        missing   = _missing_tabs.get(title)
+    if worksheet is None:
+        if missing is not None and time.monotonic() - missing < BUS_INDEX_MAX_AGE:
+            raise gspread.exceptions.WorksheetNotFound(title)
+        try:
+            worksheet = get_spreadsheet().worksheet(title)
+        except gspread.exceptions.WorksheetNotFound:
+            with _worksheet_lock:
+                _missing_tabs[title] = time.monotonic()
+            raise
+        with _worksheet_lock:
+            _worksheet_handles[title] = worksheet
+            _missing_tabs.pop(title, None)
+    return worksheet
+
+def forget_worksheets():
+    with _worksheet_lock:
+        _worksheet_handles.clear()
+        _missing_tabs.clear()
+
+def _is_stale_tab_error(exc):
+    """True if `exc` means a cached tab handle no longer matches the sheet."""
+    if isinstance(exc, gspread.exceptions.WorksheetNotFound):
+        return True
+    text = str(exc).lower()
+    return isinstance(exc, gspread.exceptions.APIError) and (
+        "unable to parse range" in text or "no grid with id" in text)
+
+# ─── SHEET CONCURRENCY LANES ──────────────────────────────────────────────────
+# Sheets calls used to share one process-wide lock, so a checkpoint for bus A1
+# queued behind an admin's full-sheet read and behind every other bus's write.
+# Now each (tab, row) has its own lock: writes for different buses run in
+# parallel while two writes to the same row are still serialised. Whole-sheet
+# reads take a separate lane, and reserving a brand-new row takes another.
+# Row locks come from a KeyedLocks table, so idle rows don't accumulate.
+class SheetLanes:
+    def __init__(self):
+        # RLock in case any sheet function calls another
+        self._rows      = KeyedLocks("row", threading.RLock)
+        self.reads      = threading.Lock()
+        self.allocation = threading.Lock()
+
+    def row(self, tab, row):
+        """Context manager holding the lane for (tab, row)."""
+        return self._rows.hold((tab, row))
+
+_sheet_lanes = SheetLanes()
+
+def _session_row_lane(chat_id, *args, **kwargs):
+    """Lane for functions whose first argument is a chat with an assigned row."""
+    row = user_sessions.get(chat_id, {}).get('row')
+    if row is None:
+        return contextlib.nullcontext()
+    return _sheet_lanes.row(session_tab(user_sessions[chat_id]), row)
+
+def _allocation_lane(*args, **kwargs):
+    return _sheet_lanes.allocation
+
+# ─── CELL WRITES ──────────────────────────────────────────────────────────────
+# A value and its highlight used to cost two API calls (update_cell or
+# batch_update, then format). CellWrites collects both as updateCells requests
+# and sends them in one spreadsheets.batchUpdate. Values are stored as typed,
+# like valueInputOption=RAW: str, bool or number; "" or None clears the cell.
+EDITED_BACKGROUND = {"red": 0.8, "green": 1.0, "blue": 0.8}  # light green: edited by the IC
+REMARK_BACKGROUND = {"red": 1, "green": 0.8, "blue": 0.8}    # light red: pax mismatch
+
+def _extended_value(value):
+    if value is None or value == "":
+        return None
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, (int, float)):
+        return {"numberValue": value}
+    return {"stringValue": str(value)}
+
+class CellWrites:
+    """Cell values and background colours for one worksheet."""
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.requests  = []
+
+    def set(self, row, col, value, background=None):
+        """Write `value` at 1-based (row, col), colouring the cell if `background` is given."""
+        cell, fields = {}, ["userEnteredValue"]
+        typed = _extended_value(value)
+        if typed is not None:
+            cell["userEnteredValue"] = typed
+        if background is not None:
+            cell["userEnteredFormat"] = {"backgroundColor": background}
+            fields.append("userEnteredFormat.backgroundColor")
+        self.requests.append({"updateCells": {
+            "range": {"sheetId": self.worksheet.id,
+                      "startRowIndex": row - 1, "endRowIndex": row,
+                      "startColumnIndex": col - 1, "endColumnIndex": col},
+            "rows": [{"values": [cell]}],
+            "fields": ",".join(fields),
+        }})
+        return self
+
+    def send(self):
+        """Send every queued write in one batchUpdate."""
+        if self.requests:
+            with sheets_call("batch_update"):
+                sheets_batch_update({"requests": self.requests})
+
+# ─── CHECKPOINT WRITE BATCHER ─────────────────────────────────────────────────
+# When a wave of buses crosses a checkpoint together, each chat's write waits
+# here for up to CHECKPOINT_BATCH_WINDOW seconds so that all of them go out as
+# a single spreadsheets.batchUpdate. Every caller still blocks
+# until its own write has landed (or failed), so handlers only advance
+# step_index once the sheet really has the checkpoint.
+CHECKPOINT_BATCH_WINDOW = float(os.getenv("CHECKPOINT_BATCH_WINDOW", "0.3"))
+
+class _PendingWrite:
+    def __init__(self, data):
+        self.data  = data
+        self.done  = threading.Event()
+        self.error = None
+        self.trace = tracing.current()  # the flush is recorded in the submitter's trace
+
+class CheckpointBatcher:
+    """Coalesces CellWrites from every chat into one batchUpdate."""
+    def __init__(self, window):
+        self.window   = window
+        self._pending = []
+        self._cond    = threading.Condition()
+        self._thread  = None
+
+    def submit(self, writes, timeout=60):
+        """Queue a CellWrites and block until it is flushed."""
+        data = list(writes.requests)
+        if self.window <= 0:
+            self._write(data)
+            return
+
+        write = _PendingWrite(data)
+        with self._cond:
+            self._pending.append(write)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="checkpoint-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+        with tracing.span("checkpoint_batch_wait"):
+            finished = write.done.wait(timeout)
+        if not finished:
+            raise TimeoutError("Timed out waiting for the checkpoint batch to flush.")
+        if write.error is not None:
+            raise write.error
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            time.sleep(self.window)  # let writes from other chats pile in
+            with self._cond:
+                batch, self._pending = self._pending, []
+            self._flush(batch)
+
+    def _flush(self, batch):
+        wall, started = time.time(), time.perf_counter()
+        try:
+            self._write([d for w in batch for d in w.data])
+            for w in batch:
+                tracing.record("sheets.batch_flush", w.trace, wall, time.perf_counter() - started,
+                               batch_size=len(batch))
+            logging.info(f"[BATCH] Flushed {len(batch)} checkpoint write(s) in one request")
+        except gspread.exceptions.APIError as e:
+            if getattr(e, "code", None) == 400 and len(batch) > 1:
+                # One malformed write shouldn't fail everyone else's checkpoint.
+                logging.error(f"[BATCH] Batch rejected ({e}); retrying writes individually.")
+                for w in batch:
+                    try:
+                        self._write(w.data)
+                    except Exception as single_exc:
+                        w.error = single_exc
+            else:
+                for w in batch:
+                    w.error = e
+        except Exception as e:
+            for w in batch:
+                w.error = e
+        finally:
+            for w in batch:
+                w.done.set()
+
+    def _write(self, data):
+        with sheets_call("batch_update"):
+            sheets_batch_update({"requests": data})
+
+checkpoint_batcher = CheckpointBatcher(CHECKPOINT_BATCH_WINDOW)
+
+# ─── CHECKPOINT OUTBOX ────────────────────────────────────────────────────────
+# A checkpoint (or its undo) is appended to a local journal and fsync'd, and
+# the IC moves on straight away. A background replayer applies the journal to
+# the sheet in order. When Sheets is slow or down, the IC waits for a disk
+# write instead of Google, and the backlog survives a restart on the same
+# disk. Replaying is idempotent: an entry writes fixed values, including the
+# time the IC tapped, to fixed cells, so re-applying one after a crash is
+# harmless.
+#
+# Each line of the journal is a compact JSON record. An entry looks like
+#     {"s":12,"o":"c","t":"D5","r":7,"k":"left_sunway","b":"A1","h":"08:41","w":1767225660}
+# where "o" is "c" for a checkpoint or "x" for a clear, and "m" holds any
+# remark. Once an entry is applied, an ack {"a":12} is appended. Acks aren't
+# fsync'd, since losing one only means a harmless re-apply. The file is
+# rewritten with just the backlog once enough acked lines pile up.
+# Entries the sheet refuses outright (e.g. a SchemaError) are moved to
+# OUTBOX_PATH + ".failed" instead of holding up everyone behind them.
+# Cloud Run's disk is in memory, so the journal outlives the process but not
+# the instance; shutdown drains it for up to OUTBOX_DRAIN_TIMEOUT seconds.
+# Set OUTBOX_PATH to "" to write checkpoints straight to the sheet.
+OUTBOX_PATH          = os.getenv("OUTBOX_PATH", "outbox.jsonl")
+OUTBOX_BATCH         = int(os.getenv("OUTBOX_BATCH", "50"))
+OUTBOX_RETRY_MAX     = float(os.getenv("OUTBOX_RETRY_MAX", "60"))
+OUTBOX_DRAIN_TIMEOUT = float(os.getenv("OUTBOX_DRAIN_TIMEOUT", "8"))
+OUTBOX_COMPACT_LINES = 1000
+
+OUTBOX_APPLIED = metrics.counter("busbot_outbox_applied_total",
+    "Outbox entries written to the sheet.")
+OUTBOX_FAILED  = metrics.counter("busbot_outbox_failed_total",
+    "Outbox entries the sheet refused, moved to the .failed file.")
+
+def _outbox_should_wait(exc):
+    """True if `exc` means Sheets is unavailable, so the entry is retried later."""
+    if isinstance(exc, SheetsUnavailable):
+        return True
+    if isinstance(exc, gspread.exceptions.WorksheetNotFound):
+        return False
+    return isinstance(exc, _RETRYABLE_ERRORS) and _is_transient(exc)
+
+class Outbox:
+    def __init__(self, path):
+        self.path     = path
+        self._cond    = threading.Condition()
+        self._pending = deque()  # entries not yet applied, in journal order
+        self._seq     = 0
+        self._lines   = 0        # records in the file
+        self._thread  = None
+        self._file    = self._open()
+        self._load()
+
+    def _open(self):
+        f = open(self.path, "a+b")
+        if fcntl is not None:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                raise RuntimeError(f"{self.path} is in use by another process")
+        return f
+
+    def _load(self):
+        self._file.seek(0)
+        raw = self._file.read()
+        entries, acked = {}, set()
+        for line in raw.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # torn tail from a crash mid-append
+            self._lines += 1
+            if "a" in record:
+                acked.add(record["a"])
+            else:
+                entries[record["s"]] = record
+            self._seq = max(self._seq, record.get("s", record.get("a", 0)))
+        if raw and not raw.endswith(b"\n"):
+            self._file.write(b"\n")  # don't glue the next record onto a torn one
+            self._file.flush()
+        self._pending.extend(entry for seq, entry in sorted(entries.items()) if seq not in acked)
+        if self._pending:
+            logging.info(f"[OUTBOX] {len(self._pending)} entr(y/ies) left to replay from {self.path}")
+
+    @staticmethod
+    def _encode(record):
+        return json.dumps(record, separators=(",", ":")).encode("utf-8") + b"\n"
+
+    def _write(self, record, sync=False):
+        # Caller holds self._cond.
+        self._file.write(self._encode(record))
+        self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+        self._lines += 1
+
+    def append(self, op, tab, row, step_key, bus_number, **fields):
+        """Durably record a write for the sheet; returns once it is on disk."""
+        with self._cond:
+            self._seq += 1
+            entry = {"s": self._seq, "o": op, "t": tab, "r": row, "k": step_key,
+                     "b": bus_number, "w": int(time.time()), **fields}
+            self._write(entry, sync=True)
+            self._pending.append(entry)
+            self._start()
+            self._cond.notify_all()
+        return entry
+
+    def start(self):
+        with self._cond:
+            self._start()
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="outbox-replayer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        delay = 1
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                batch = list(itertools.islice(self._pending, OUTBOX_BATCH))
+            try:
+                failed = self._apply(batch)
+            except Exception as e:
+                logging.warning(f"[OUTBOX] Replaying {len(batch)} entr(y/ies) failed ({e}); "
+                                f"{len(self._pending)} waiting, retrying in {delay:.0f}s")
+                time.sleep(delay)
+                delay = min(delay * 2, OUTBOX_RETRY_MAX)
+                continue
+            delay = 1
+            self._ack(batch, failed)
+
+    def _apply(self, batch):
+        """Write `batch` to the sheet; returns the (entry, error) pairs refused for good."""
+        try:
+            apply_outbox_entries(batch)
+            return []
+        except Exception as e:
+            if _outbox_should_wait(e):
+                raise
+            if len(batch) == 1:
+                return [(batch[0], e)]
+        # One bad entry shouldn't take the rest of the batch down with it.
+        failed = []
+        for entry in batch:
+            try:
+                apply_outbox_entries([entry])
+            except Exception as e:
+                if _outbox_should_wait(e):
+                    raise
+                failed.append((entry, e))
+        return failed
+
+    def _ack(self, batch, failed):
+        for entry, error in failed:
+            logging.error(f"[OUTBOX] Sheet refused entry {entry['s']} for bus {entry['b']} "
+                          f"({entry['k']}): {error}; moved to {self.path}.failed")
+            with open(self.path + ".failed", "ab") as f:
+                f.write(self._encode({**entry, "error": str(error)}))
+                f.flush()
+                os.fsync(f.fileno())
+        OUTBOX_FAILED.inc(len(failed))
+        OUTBOX_APPLIED.inc(len(batch) - len(failed))
+        with self._cond:
+            for entry in batch:
+                self._pending.popleft()
+                self._write({"a": entry["s"]})
+            if self._lines - len(self._pending) > OUTBOX_COMPACT_LINES:
+                self._compact()
+            self._cond.notify_all()
+
+    def _compact(self):
+        # Caller holds self._cond.
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            for entry in self._pending:
+                f.write(self._encode(entry))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        old, self._file = self._file, open(self.path, "a+b")
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        old.close()
+        self._lines = len(self._pending)
+        logging.info(f"[OUTBOX] Compacted {self.path} to {self._lines} entr(y/ies)")
+
+    def backlog(self):
+        with self._cond:
+            return len(self._pending)
+
+    def pending_for(self, tab, row=None):
+        """Unapplied entries for one tab (or one sheet row of it), oldest first."""
+        with self._cond:
+            return [e for e in self._pending if e["t"] == tab and row in (None, e["r"])]
+
+    def oldest_age(self):
+        with self._cond:
+            return time.time() - self._pending[0]["w"] if self._pending else 0
+
+    def drain(self, timeout):
+        """Wait up to `timeout` seconds for the backlog to reach the sheet; True if it did."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stats(self):
+        return {"backlog": self.backlog(), "oldest_s": round(self.oldest_age(), 1),
+                "applied": int(OUTBOX_APPLIED.labels().value),
+                "failed": int(OUTBOX_FAILED.labels().value)}
+
+@retry_on_error()
+def apply_outbox_entries(entries):
+    """Apply journal entries to the sheet, in order, in one batchUpdate."""
+    cell_requests = []
+    for entry in entries:
+        worksheet = get_worksheet(entry["t"])
+        if entry["o"] == "c":
+            writes = checkpoint_cells(worksheet, entry["r"], entry["k"], entry["h"], entry.get("m"))
+        else:
+            writes = clear_cells(worksheet, entry["r"], entry["k"])
+        cell_requests.extend(writes.requests)
+    with sheets_call("batch_update", entries=len(entries)):
+        sheets_batch_update({"requests": cell_requests})
+    for title in {entry["t"] for entry in entries}:
+        invalidate_sheet_snapshot(title)
+
+outbox = None
+if OUTBOX_PATH:
+    try:
+        outbox = Outbox(OUTBOX_PATH)
+    except (OSError, RuntimeError) as e:
+        logging.error(f"[OUTBOX] Disabled; checkpoints go straight to the sheet: {e}")
+
+metrics.gauge("busbot_outbox_backlog", "Outbox entries waiting to be written to the sheet.",
+              lambda: outbox.backlog() if outbox else 0)
+metrics.gauge("busbot_outbox_oldest_seconds", "Age of the oldest entry waiting in the outbox.",
+              lambda: outbox.oldest_age() if outbox else 0)
+
+def outbox_stats():
+    return outbox.stats() if outbox else None
+
+async def drain_outbox(timeout=None):
+    """Give the replayer up to OUTBOX_DRAIN_TIMEOUT seconds to empty the journal."""
+    if outbox is None:
+        return True
+    timeout = OUTBOX_DRAIN_TIMEOUT if timeout is None else timeout
+    return await asyncio.get_running_loop().run_in_executor(None, outbox.drain, timeout)
+
+# ─── SHEET SCHEMA ─────────────────────────────────────────────────────────────
+# Column positions for a tab, compiled once from its header row and shared by
+# every read and write path. A checkpoint's time column is found by its
+# step_to_column header; its Tele checkbox and Remarks columns are the next two.
+# Compiling checks that layout: if the slot after a time column is another
+# step's time column or a bus-detail column, that step is refused with a
+# SchemaError instead of being written into the wrong cells.
+# The schema is recompiled when a snapshot arrives with a different header row,
+# and row 1 is re-read at most every SCHEMA_RECHECK seconds by the write paths,
+# so a moved column is picked up without a restart.
+SCHEMA_RECHECK = float(os.getenv("SCHEMA_RECHECK", "60"))
+
+DETAIL_HEADERS = ("wave", "bus #", "bus plate", "no. of pax", "bus ic", "bus 2ic", "cgs", "username")
+
+SCHEMA_CHANGES = metrics.counter("busbot_sheet_schema_changes_total",
+    "Header-row changes detected after the first compile, by tab.", ("tab",))
+
+class SchemaError(Exception):
+    """The tab's header row doesn't fit what the bot is about to write."""
+
+class StepColumns:
+    def __init__(self, time, tele, remark):
+        self.time   = time    # 1-based, like gspread
+        self.tele   = tele
+        self.remark = remark
+
+def _normalise_header(header_row):
+    header = [h.strip().lower() for h in header_row]
+    while header and not header[-1]:
+        header.pop()  # row_values() drops trailing blanks, get_all_values() pads them
+    return tuple(header)
+
+class SheetSchema:
+    def __init__(self, title, header_row, checked_at):
+        self.title      = title
+        self.header     = _normalise_header(header_row)
+        self.checked_at = checked_at
+        self.columns    = {}  # lower-cased header -> 1-based column, first match wins
+        for idx, header in enumerate(self.header):
+            if header:
+                self.columns.setdefault(header, idx + 1)
+
+        # Time column per step, for reads: a missing header just means "no data".
+        self.step_time = {step_key: self.columns.get(step_to_column[step_key].strip().lower())
+                          for step_key in steps}
+        # Full time/tele/remark layout per step, for writes: only if it checks out.
+        self.steps    = {}
+        self.problems = {}
+        reserved = {c: h for h, c in self.columns.items() if h in DETAIL_HEADERS}
+        reserved.update((c, step_to_column[k]) for k, c in self.step_time.items() if c)
+        for step_key, time_col in self.step_time.items():
+            if time_col is None:
+                self.problems[step_key] = f"no '{step_to_column[step_key]}' column"
+                continue
+            clash = next((c for c in (time_col + 1, time_col + 2) if c in reserved), None)
+            if clash is not None:
+                self.problems[step_key] = (
+                    f"'{reserved[clash]}' sits where the Tele/Remarks column of "
+                    f"'{step_to_column[step_key]}' should be")
+                continue
+            self.steps[step_key] = StepColumns(time_col, time_col + 1, time_col + 2)
+
+    def col(self, header):
+        """1-based column for `header` (any case), or None."""
+        return self.columns.get(header.strip().lower())
+
+    def index(self, header):
+        """0-based position of `header` in a row of values, or None."""
+        col = self.col(header)
+        return col - 1 if col else None
+
+    def step(self, step_key):
+        """Validated StepColumns for `step_key`; raises SchemaError if unusable."""
+        columns = self.steps.get(step_key)
+        if columns is None:
+            raise SchemaError(f"Tab '{self.title}': {self.problems.get(step_key, 'unknown step ' + step_key)}")
+        return columns
+
+    def step_indexes(self):
+        """0-based time column for each entry of `steps` (None if missing)."""
+        return [col - 1 if col else None for col in (self.step_time[k] for k in steps)]
+
+_schemas = {}
+_schema_lock = threading.Lock()
+
+def observe_header(title, header_row):
+    """Schema for `header_row`, reusing the compiled one if the header is unchanged."""
+    header = _normalise_header(header_row)
+    with _schema_lock:
+        schema = _schemas.get(title)
+        if schema is not None and schema.header == header:
+            schema.checked_at = time.monotonic()
+            return schema
+        compiled = _schemas[title] = SheetSchema(title, header_row, time.monotonic())
+    if schema is not None:
+        SCHEMA_CHANGES.labels(title).inc()
+        logging.warning(f"[SCHEMA] Header row of '{title}' changed; recompiled.")
+    for problem in compiled.problems.values():
+        logging.error(f"[SCHEMA] '{title}': {problem}")
+    return compiled
+
+def get_schema(worksheet):
+    """Compiled schema for `worksheet`, re-reading row 1 once it's SCHEMA_RECHECK old."""
+    with _schema_lock:
+        schema = _schemas.get(worksheet.title)
+    if schema is not None and (time.monotonic() - schema.checked_at) < SCHEMA_RECHECK:
+        return schema
+    with sheets_call("row_values"):
+        header_row = worksheet.row_values(1)
+    return observe_header(worksheet.title, header_row)
+
+def forget_schemas(title=None):
+    with _schema_lock:
+        if title is None:
+            _schemas.clear()
+        else:
+            _schemas.pop(title, None)
+
+# ─── SHEET SNAPSHOT CACHE ─────────────────────────────────────────────────────
+# Admin views (/list, bus detail, fleet report) all need the whole tab. Instead
+# of each tap calling get_all_values(), they share one in-memory copy per tab
+# that is refetched after SNAPSHOT_TTL seconds or as soon as the bot itself
+# writes to the sheet.
+_snapshots = {}
+_snapshot_lock = threading.Lock()
+
+class SheetSnapshot:
+    """Immutable copy of a worksheet's values plus the time it was fetched."""
+    def __init__(self, values, fetched_at, schema):
+        self.values     = values
+        self.fetched_at = fetched_at
+        self.schema     = schema
+
+    @property
+    def data_rows(self):
+        return self.values[1:]
+
+    @functools.cached_property
+    def fleet(self):
+        """Columnar checkpoint view, compiled once per snapshot."""
+        return FleetColumns(self)
+
+    def is_fresh(self, ttl=None):
+        ttl = SNAPSHOT_TTL if ttl is None else ttl
+        return (time.monotonic() - self.fetched_at) < ttl
+
+def get_sheet_snapshot(worksheet, force=False):
+    """Return a cached snapshot of `worksheet`, refetching it if stale."""
+    title = worksheet.title
+    with _snapshot_lock:
+        snapshot = _snapshots.get(title)
+        if snapshot and not force and snapshot.is_fresh():
+            return snapshot
+        requested_at = time.monotonic()
+
+    with waited_lock(_sheet_lanes.reads, "lane:reads"):
+        # Another admin may have refreshed while we waited for the read lane.
+        with _snapshot_lock:
+            snapshot = _snapshots.get(title)
+            if snapshot and snapshot.fetched_at >= requested_at:
+                return snapshot
+
+        with sheets_call("get_all_values"):
+            values = worksheet.get_all_values()
+        return store_sheet_snapshot(title, values)
+
+def store_sheet_snapshot(title, values):
+    """Cache freshly downloaded `values` as the snapshot for `title`."""
+    # A full download is also a free header check and a fresh Bus # column.
+    schema   = observe_header(title, values[0] if values else [])
+    snapshot = SheetSnapshot(values, time.monotonic(), schema)
+    with _snapshot_lock:
+        _snapshots[title] = snapshot
+
+    bus_idx = schema.index('bus #')
+    if bus_idx is not None:
+        index_bus_rows(title, [r[bus_idx] if bus_idx < len(r) else "" for r in values])
+    logging.info(f"[SNAPSHOT] Refreshed '{title}' ({len(values)} rows)")
+    return snapshot
+
+def invalidate_sheet_snapshot(title=None):
+    """Drop the cached snapshot for `title` (or every tab) after a write."""
+    with _snapshot_lock:
+        if title is None:
+            _snapshots.clear()
+        else:
+            _snapshots.pop(title, None)
+
+# ─── FLEET AGGREGATION ────────────────────────────────────────────────────────
+# The fleet report used to look up each step's column inside a loop over every
+# row and every step. Instead, each snapshot takes the step -> column table
+# from the tab's SheetSchema and stores every checkpoint column as an int bitmask over the data rows
+# (bit i set = data row i has a time in that column). Counts per step and each
+# bus's furthest step then come from a handful of big-int operations per step,
+# however many buses there are.
+
+def _column_mask(rows, col):
+    """Bitmask of rows whose `col` cell is non-blank (row 0 = lowest bit)."""
+    if col is None:
+        return 0
+    bits = "".join("1" if col < len(r) and r[col].strip() else "0" for r in reversed(rows))
+    return int(bits, 2) if bits else 0
+
+def _mask_positions(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+class FleetColumns:
+    def __init__(self, snapshot):
+        rows           = snapshot.data_rows
+        self.bus_col   = snapshot.schema.index('bus #')
+        self.step_cols = snapshot.schema.step_indexes()
+        self.bus_names = [
+            r[self.bus_col].strip() if self.bus_col is not None and self.bus_col < len(r) else ""
+            for r in rows
+        ]
+        # Rows without a bus number are ignored throughout, as before.
+        self.registered = _column_mask(rows, self.bus_col)
+        self.step_masks = [_column_mask(rows, col) & self.registered for col in self.step_cols]
+
+    @property
+    def total_buses(self):
+        return self.registered.bit_count()
+
+    def step_counts(self):
+        """Buses that have crossed each step (cumulative)."""
+        return [mask.bit_count() for mask in self.step_masks]
+
+    def furthest_step_masks(self):
+        """Per step, the rows whose furthest completed step is exactly that one."""
+        remaining = self.registered
+        furthest  = [0] * len(self.step_masks)
+        for i in range(len(self.step_masks) - 1, -1, -1):
+            furthest[i] = self.step_masks[i] & remaining
+            remaining  &= ~furthest[i]
+        return furthest
+
+    def furthest_step_buses(self):
+        """Per step, the sorted bus names whose furthest completed step is that one."""
+        return [sorted(self.bus_names[r] for r in _mask_positions(mask))
+                for mask in self.furthest_step_masks()]
+
+# ─── LIVE FLEET PROGRESS ──────────────────────────────────────────────────────
+# In-process mirror of every bus's completed checkpoints, kept current by the
+# bot's own writes (log_checkpoint_to_sheet, clear_cell, registration and
+# session recovery) in O(1) each. The fleet report renders from here without
+# reading the sheet. A full rebuild from the sheet only happens at startup
+# (warm_up) or when an admin taps 🔄 Resync.
+class FleetProgress:
+    def __init__(self, step_total):
+        self._lock        = threading.Lock()
+        self._buses       = {}  # normalised bus number -> [display name, done-steps bitmask]
+        self._step_counts = [0] * step_total
+        self._at_step     = [set() for _ in range(step_total)]  # furthest completed step -> names
+        self.ready        = False
+        self.rebuilt_at   = None
+        self.on_change    = None  # called (outside the lock) after any update
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def _set(self, bus_number, done):
+        # Caller holds self._lock.
+        key   = normalise_bus_number(bus_number)
+        entry = self._buses.get(key)
+        if entry is None:
+            entry = self._buses[key] = [bus_number.strip(), 0]
+        name, old = entry
+        changed = old ^ done
+        for i in _mask_positions(changed):
+            self._step_counts[i] += 1 if done >> i & 1 else -1
+        if old:
+            self._at_step[old.bit_length() - 1].discard(name)
+        if done:
+            self._at_step[done.bit_length() - 1].add(name)
+        entry[1] = done
+
+    def register(self, bus_number):
+        with self._lock:
+            if normalise_bus_number(bus_number) in self._buses:
+                return
+            self._set(bus_number, 0)
+        self._changed()
+
+    def set_steps(self, bus_number, done):
+        """Replace a bus's completed steps with the bitmask `done` (bit i = steps[i])."""
+        with self._lock:
+            self._set(bus_number, done)
+        self._changed()
+
+    def mark(self, bus_number, step_index, completed=True):
+        with self._lock:
+            entry = self._buses.get(normalise_bus_number(bus_number))
+            done  = entry[1] if entry else 0
+            if completed:
+                done |= 1 << step_index
+            else:
+                done &= ~(1 << step_index)
+            self._set(bus_number, done)
+        self._changed()
+
+    def rebuild(self, fleet):
+        """Reset from a FleetColumns view of the whole sheet."""
+        done_by_row = {}
+        for i, mask in enumerate(fleet.step_masks):
+            for r in _mask_positions(mask):
+                done_by_row[r] = done_by_row.get(r, 0) | (1 << i)
+        with self._lock:
+            self._buses       = {}
+            self._step_counts = [0] * len(self._step_counts)
+            self._at_step     = [set() for _ in self._step_counts]
+            for r in _mask_positions(fleet.registered):
+                self._set(fleet.bus_names[r], done_by_row.get(r, 0))
+            self.ready      = True
+            self.rebuilt_at = time.time()
+        self._changed()
+
+    def clear(self):
+        """Reset to an empty, ready fleet (a tab that doesn't exist yet)."""
+        with self._lock:
+            self._buses       = {}
+            self._step_counts = [0] * len(self._step_counts)
+            self._at_step     = [set() for _ in self._step_counts]
+            self.ready      = True
+            self.rebuilt_at = time.time()
+        self._changed()
+
+    def summary(self):
+        """(total buses, cumulative count per step, sorted names at each furthest step)."""
+        with self._lock:
+            return (len(self._buses), list(self._step_counts),
+                    [sorted(names) for names in self._at_step])
+
+class FleetProgressByTab:
+    """One FleetProgress per sheet tab, created on first use."""
+    def __init__(self, step_total):
+        self.step_total = step_total
+        self._lock      = threading.Lock()
+        self._tabs      = {}
+        self.on_change  = None  # called after any tab's update
+
+    def for_tab(self, tab):
+        with self._lock:
+            progress = self._tabs.get(tab)
+            if progress is None:
+                progress = self._tabs[tab] = FleetProgress(self.step_total)
+                progress.on_change = self._changed
+            return progress
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def ready(self, tabs):
+        return all(self.for_tab(tab).ready for tab in tabs)
+
+    def summary(self, tabs):
+        """FleetProgress.summary() summed over `tabs`. With buses on more than
+        one tab, names are suffixed with their tab so duplicates stay apart."""
+        parts = [(tab, self.for_tab(tab).summary()) for tab in tabs]
+        parts = [(tab, part) for tab, part in parts if part[0]]
+        total   = sum(part[0] for _, part in parts)
+        counts  = [0] * self.step_total
+        current = [[] for _ in range(self.step_total)]
+        for tab, (_, tab_counts, tab_current) in parts:
+            for i in range(self.step_total):
+                counts[i] += tab_counts[i]
+                if len(parts) > 1:
+                    current[i].extend(f"{name} ({tab})" for name in tab_current[i])
+                else:
+                    current[i].extend(tab_current[i])
+        return total, counts, [sorted(names) for names in current]
+
+fleet_progress = FleetProgressByTab(len(steps))
+
+def rebuild_fleet_progress(tabs, force=False):
+    """Rebuild the live counters of `tabs` from the sheet; returns the tabs that exist.
+
+    Checkpoints still waiting in the outbox (e.g. journalled before a restart)
+    aren't in the sheet yet, so they are laid over it. Entries are taken both
+    before and after the read: one applied in between is then counted either
+    way, and re-applying it is harmless.
+    """
+    found = []
+    for tab in tabs:
+        progress = fleet_progress.for_tab(tab)
+        pending  = outbox.pending_for(tab) if outbox is not None else []
+        try:
+            worksheet = get_worksheet(tab)
+        except gspread.exceptions.WorksheetNotFound:
+            logging.info(f"[TABS] Tab '{tab}' doesn't exist yet; counting it as empty.")
+            progress.clear()
+            continue
+        progress.rebuild(get_sheet_snapshot(worksheet, force=force).fleet)
+        if outbox is not None:
+            pending = {e["s"]: e for e in pending + outbox.pending_for(tab)}
+            for seq in sorted(pending):
+                entry = pending[seq]
+                progress.mark(entry["b"], steps.index(entry["k"]), completed=entry["o"] == "c")
+        found.append(tab)
+    return found
+
+# ─── BUS ROW INDEX ────────────────────────────────────────────────────────────
+# Normalised bus number -> sheet row, per tab. Built from one read of the Bus #
+# column and updated in place when a row is reserved, so registration and
+# session recovery don't have to download and scan the column every time.
+_bus_row_index = {}
+_bus_row_lock  = threading.Lock()
+
+def normalise_bus_number(bus_number):
+    return bus_number.strip().lower()
+
+class BusRowIndex:
+    def __init__(self, rows, size, built_at):
+        self.rows     = rows        # normalised bus number -> 1-based row
+        self.size     = size        # rows occupied in the Bus # column
+        self.built_at = built_at
+
+    def is_fresh(self, max_age):
+        return (time.monotonic() - self.built_at) < max_age
+
+def index_bus_rows(title, bus_numbers):
+    """Rebuild the index for `title` from the Bus # column values (row 1 first)."""
+    rows = {}
+    for i, existing in enumerate(bus_numbers):
+        key = normalise_bus_number(existing)
+        if key and key not in rows:  # first match wins, like the old linear scan
+            rows[key] = i + 1        # gspread uses 1-based indexing
+    index = BusRowIndex(rows, len(bus_numbers), time.monotonic())
+    with _bus_row_lock:
+        _bus_row_index[title] = index
+    return index
+
+def get_bus_row_index(worksheet, bus_col_idx, refresh=False):
+    """Return the tab's index, reading the Bus # column only if needed."""
+    with _bus_row_lock:
+        index = _bus_row_index.get(worksheet.title)
+    if index is None or refresh:
+        index = index_bus_rows(worksheet.title, worksheet.col_values(bus_col_idx))
+    return index
+
+def reserve_bus_row(title, bus_number, row):
+    with _bus_row_lock:
+        index = _bus_row_index.get(title)
+        if index is not None:
+            index.rows[normalise_bus_number(bus_number)] = row
+            index.size = max(index.size, row)
+
+def forget_bus_rows(title=None):
+    with _bus_row_lock:
+        if title is None:
+            _bus_row_index.clear()
+        else:
+            _bus_row_index.pop(title, None)
+
+# ─── SESSION STORE ────────────────────────────────────────────────────────────
+# user_sessions (including where each chat is in the conversation) is written
+# through to a local SQLite file after every update and reloaded on import, so
+# a cold start or a new instance picks up every bus mid-registration or
+# mid-journey without asking the user again or reading the sheet.
+# Set SESSION_DB_PATH to "" to keep sessions in memory only.
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+
+class SessionStore:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._last = {}  # chat_id -> last JSON written, to skip no-op writes
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " chat_id INTEGER PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS dashboards ("
+            " chat_id INTEGER PRIMARY KEY, message_id INTEGER NOT NULL)")
+
+    def load_all(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT chat_id, data FROM sessions").fetchall()
+            self._last = {chat_id: data for chat_id, data in rows}
+        return {chat_id: json.loads(data) for chat_id, data in rows}
+
+    def save(self, chat_id, session):
+        data = json.dumps(session, separators=(",", ":"))
+        with self._lock:
+            if self._last.get(chat_id) == data:
+                return
+            self._conn.execute(
+                "INSERT INTO sessions (chat_id, data, updated_at) VALUES (?, ?, ?)"
+                " ON CONFLICT(chat_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (chat_id, data, time.time()))
+            self._last[chat_id] = data
+
+    def delete(self, chat_id):
+        with self._lock:
+            if chat_id not in self._last:
+                return
+            self._conn.execute("DELETE FROM sessions WHERE chat_id = ?", (chat_id,))
+            del self._last[chat_id]
+
+    def load_dashboards(self):
+        with self._lock:
+            return dict(self._conn.execute("SELECT chat_id, message_id FROM dashboards").fetchall())
+
+    def save_dashboard(self, chat_id, message_id):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO dashboards (chat_id, message_id) VALUES (?, ?)",
+                (chat_id, message_id))
+
+    def delete_dashboard(self, chat_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM dashboards WHERE chat_id = ?", (chat_id,))
+
+session_store = SessionStore(SESSION_DB_PATH) if SESSION_DB_PATH else None
+
+def persist_session(chat_id):
+    """Write the chat's current session (or its absence) through to the store."""
+    if session_store is None:
+        return
+    session = user_sessions.get(chat_id)
+    try:
+        if session is None:
+            session_store.delete(chat_id)
+        else:
+            session_store.save(chat_id, session)
+    except Exception as e:
+        logging.error(f"[STORE] Failed to persist session for {chat_id}: {e}")
+
+# ─── CONVERSATION STATE ───────────────────────────────────────────────────────
+# Where a chat is in the conversation is kept as the *name* of the handler for
+# its next message (session['state']), not as a lambda in telebot's in-memory
+# next-step table, so it can be stored and re-armed after a restart.
+CONVERSATION_STATES = {}
+
+def conversation_state(func):
+    """Register `func` as a handler expect_reply() can route a reply to."""
+    CONVERSATION_STATES[func.__name__] = func
+    return func
+
+def expect_reply(chat_id, handler):
+    """Route the chat's next message to `handler` (through intercept_end_command)."""
+    user_sessions.setdefault(chat_id, {})['state'] = handler.__name__
+    # Replace, don't stack: telebot would otherwise call every registered handler.
+    bot.clear_step_handler_by_chat_id(chat_id)
+    bot.register_next_step_handler_by_chat_id(chat_id, resume_conversation)
+    persist_session(chat_id)
+
+@traced_handler
+def resume_conversation(message):
+    session = user_sessions.get(message.chat.id) or {}
+    handler = CONVERSATION_STATES.get(session.pop('state', None))
+    if handler is None:
+        logging.warning(f"[STATE] No pending state for {message.chat.id}; ignoring reply.")
+        return
+    tracing.set_attrs(state=handler.__name__)
+    return intercept_end_command(message, handler)
+
+def restore_sessions():
+    """Reload persisted sessions and re-arm any pending replies."""
+    if session_store is None:
+        return 0
+    restored = session_store.load_all()
+    user_sessions.update(restored)
+    for chat_id, session in restored.items():
+        if session.get('state'):
+            bot.register_next_step_handler_by_chat_id(chat_id, resume_conversation)
+    logging.info(f"[STORE] Restored {len(restored)} session(s) from {SESSION_DB_PATH}")
+    return len(restored)
+
+with startup_phase("session_restore"):
+    restore_sessions()
+
+# ─── OUTBOUND SEND QUEUE ──────────────────────────────────────────────────────
+# Handlers enqueue messages instead of blocking on each send_message call.
+# Worker threads deliver them under two token buckets: a global one for the
+# bot's overall budget (Telegram allows roughly 30 msg/s) and one per chat.
+# A chat's bucket decides when its queue is next scheduled, so a chat over
+# budget waits in the schedule rather than in a worker thread. Messages for a
+# chat go out in FIFO order, because only one worker serves a chat at a time.
+# A 429 is retried after the retry_after that Telegram returns.
+# Set SEND_QUEUE_ENABLED=0 to send inline (429s are still retried).
+SEND_QUEUE_ENABLED  = os.getenv("SEND_QUEUE_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+TELEGRAM_GLOBAL_RATE  = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))  # messages/s, all chats
+TELEGRAM_GLOBAL_BURST = int(os.getenv("TELEGRAM_GLOBAL_BURST", "5"))
+TELEGRAM_CHAT_RATE    = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))     # messages/s, one chat
+TELEGRAM_CHAT_BURST   = int(os.getenv("TELEGRAM_CHAT_BURST", "4"))
+SEND_WORKERS         = int(os.getenv("SEND_WORKERS", "4"))
+SEND_MAX_ATTEMPTS    = 5
+
+class TokenBucket:
+    """Not thread-safe on its own; callers hold their own lock."""
+    def __init__(self, rate, burst):
+        self.rate     = rate
+        self.capacity = burst
+        self.tokens   = float(burst)
+        self.updated  = time.monotonic()
+
+    def reserve(self, now=None):
+        """Take one token and return how many seconds until it may be used."""
+        now = time.monotonic() if now is None else now
+        self.tokens  = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_full(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+def _telegram_retry_after(exc):
+    """Seconds Telegram asked us to wait, if `exc` is a 429."""
+    if not isinstance(exc, telebot.apihelper.ApiTelegramException) or exc.error_code != 429:
+        return None
+    params = (exc.result_json or {}).get("parameters") or {}
+    return float(params.get("retry_after", 1))
+
+class _Outbound:
+    def __init__(self, method, args, kwargs):
+        self.method   = method
+        self.args     = args
+        self.kwargs   = kwargs
+        self.attempts = 0
+        self.trace    = tracing.current()
+        self.queued   = time.monotonic()
+        self.future   = Future()  # the API result, for callers that need e.g. message_id
+
+class OutboundDispatcher:
+    def __init__(self, workers, global_rate, global_burst, chat_rate, chat_burst):
+        self._workers      = workers
+        self._chat_rate    = chat_rate
+        self._chat_burst   = chat_burst
+        self._global       = TokenBucket(global_rate, global_burst)
+        self._global_lock  = threading.Lock()
+        self._cond         = threading.Condition()
+        self._queues       = {}  # chat_id -> deque; present while scheduled or being sent
+        self._chat_buckets = {}
+        self._schedule     = []  # heap of (not_before, seq, chat_id)
+        self._seq          = itertools.count()
+        self._threads      = []
+
+    def submit(self, chat_id, method, *args, **kwargs):
+        """Queue method(*args, **kwargs) behind this chat's earlier sends; returns a Future."""
+        item = _Outbound(method, args, kwargs)
+        with self._cond:
+            if not self._threads:
+                for i in range(self._workers):
+                    t = threading.Thread(target=self._run, name=f"outbound-{i}", daemon=True)
+                    t.start()
+                    self._threads.append(t)
+            queue = self._queues.get(chat_id)
+            if queue is None:
+                queue = self._queues[chat_id] = deque()
+                self._schedule_chat(chat_id)
+            queue.append(item)
+        return item.future
+
+    def pending(self):
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def wait_idle(self, chat_id, timeout):
+        """Block until everything queued for `chat_id` has been sent (or dropped)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while chat_id in self._queues:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _push(self, chat_id, not_before):
+        heapq.heappush(self._schedule, (not_before, next(self._seq), chat_id))
+        self._cond.notify_all()
+
+    def _schedule_chat(self, chat_id):
+        # Caller holds self._cond. The chat's next send waits for a token here.
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._chat_rate, self._chat_burst)
+        now = time.monotonic()
+        self._push(chat_id, now + bucket.reserve(now))
+
+    def _next_chat(self):
+        with self._cond:
+            while True:
+                if self._schedule:
+                    wait = self._schedule[0][0] - time.monotonic()
+                    if wait <= 0:
+                        return heapq.heappop(self._schedule)[2]
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+
+    def _run(self):
+        while True:
+            chat_id = self._next_chat()
+            try:
+                self._send_next(chat_id)
+            except Exception as e:
+                logging.error(f"[OUTBOUND] Worker error for {chat_id}: {e}")
+
+    def _send_next(self, chat_id):
+        with self._cond:
+            queue = self._queues[chat_id]
+            item  = queue[0]
+
+        with self._global_lock:
+            global_wait = self._global.reserve()
+        if global_wait > 0:
+            time.sleep(global_wait)
+
+        retry_after = None
+        item.attempts += 1
+        try:
+            with tracing.span(f"telegram.{item.method.__name__}", parent=item.trace, attempt=item.attempts,
+                              queued_ms=round((time.monotonic() - item.queued) * 1000, 1)):
+                result = item.method(*item.args, **item.kwargs)
+            item.future.set_result(result)
+        except Exception as e:
+            retry_after = _telegram_retry_after(e)
+            if retry_after is None or item.attempts >= SEND_MAX_ATTEMPTS:
+                logging.error(f"[OUTBOUND] Dropping message to {chat_id} after {item.attempts} attempt(s): {e}")
+                retry_after = None
+                item.future.set_exception(e)
+            else:
+                logging.warning(f"[OUTBOUND] 429 for {chat_id}; retrying in {retry_after}s")
+
+        with self._cond:
+            if retry_after is not None:
+                self._push(chat_id, time.monotonic() + retry_after)
+                return
+            queue.popleft()
+            if queue:
+                self._schedule_chat(chat_id)
+            else:
+                del self._queues[chat_id]
+                if self._chat_buckets[chat_id].is_full():
+                    del self._chat_buckets[chat_id]
+                self._cond.notify_all()  # wake wait_idle()
+
+outbound = OutboundDispatcher(SEND_WORKERS, TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_BURST,
+                              TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+
+def _send_inline(method, *args, **kwargs):
+    for attempt in range(1, SEND_MAX_ATTEMPTS + 1):
+        try:
+            with tracing.span(f"telegram.{method.__name__}", attempt=attempt):
+                return method(*args, **kwargs)
+        except Exception as e:
+            retry_after = _telegram_retry_after(e)
+            if retry_after is None or attempt == SEND_MAX_ATTEMPTS:
+                raise
+            logging.warning(f"[OUTBOUND] 429; retrying in {retry_after}s")
+            time.sleep(retry_after)
+
+def enqueue_message(chat_id, text, **kwargs):
+    """Queue bot.send_message(chat_id, text, **kwargs) for ordered, rate-limited delivery."""
+    if SEND_QUEUE_ENABLED:
+        outbound.submit(chat_id, bot.send_message, chat_id, text, **kwargs)
+    else:
+        _send_inline(bot.send_message, chat_id, text, **kwargs)
+
 # ─── COMMAND INTERCEPTOR ─────────────────────────────────────────────────────
 def intercept_end_command(message, next_handler):
     text = message.text.strip().lower() if message.text else ""
@@ -208,7 +2284,7 @@ def intercept_end_command(message, next_handler):
     
     if text in ['/edit_pax', '/edit_plate']:
         if not user_sessions.get(chat_id, {}).get('details_confirmed', False):
-            bot.send_message(chat_id,
+            enqueue_message(chat_id,
                 "⚠️ Please complete and *confirm* your bus details by filling the form first before "
                 "using commands like /edit_plate or /edit_pax. Use /end and /start again to restart",
                 parse_mode="Markdown")
@@ -228,7 +2304,7 @@ def handle_start(message):
     if user_id in get_admin_ids():
         markup = InlineKeyboardMarkup()
         markup.add(InlineKeyboardButton("📋 View All Buses", callback_data="admin_list_refresh"))
-        bot.send_message(
+        enqueue_message(
             message.chat.id,
             "👮‍♂️ *Welcome, Admin!*\n\nYou are in Administrator Mode. You do not need to register.\n"
             "Click below to monitor the fleet.",
@@ -236,11 +2312,10 @@ def handle_start(message):
             parse_mode="Markdown"
         )
     else:
-        bot.send_message(message.chat.id,
+        enqueue_message(message.chat.id,
             "🚌 Welcome! Please enter the *bus number* to begin or resume tracking:",
             parse_mode="Markdown")
-        bot.register_next_step_handler(message,
-            lambda msg: intercept_end_command(msg, ask_and_validate_bus_number))
+        expect_reply(message.chat.id, ask_and_validate_bus_number)
 
 # ─── REGISTRATION FLOW ────────────────────────────────────────────────────────
 
@@ -252,23 +2327,22 @@ def edit_details(message):
     chat_id = message.chat.id
     # user_sessions[chat_id] = {"step_index": 0}  # Reset session
 
-    msg = bot.send_message(
+    enqueue_message(
         chat_id,
         "🔁 You’ve chosen to edit details.\nPlease re-enter the *bus number:*",
         parse_mode="Markdown"
     )
-    bot.register_next_step_handler(msg, 
-        lambda msg1: intercept_end_command(msg1, ask_and_validate_bus_number))
+    expect_reply(chat_id, ask_and_validate_bus_number)
 
 
+@conversation_state
 def ask_and_validate_bus_number(message):
     chat_id = message.chat.id
     bus_number = message.text.strip()
 
     if not is_valid_bus_number(bus_number):
-        bot.send_message(chat_id, "❌ Please enter a valid bus number (e.g., A1, B2).")
-        return bot.register_next_step_handler(message, 
-            lambda msg: intercept_end_command(msg, ask_and_validate_bus_number))
+        enqueue_message(chat_id, "❌ Please enter a valid bus number (e.g., A1, B2).")
+        return expect_reply(chat_id, ask_and_validate_bus_number)
     
     if chat_id not in user_sessions:
         user_sessions[chat_id] = {}
@@ -277,28 +2351,28 @@ def ask_and_validate_bus_number(message):
 
     # Try to recover session from sheet. A raised error here means the lookup
     # failed (not that the bus is new) — don't fall through to "new bus".
-    bot.send_chat_action(chat_id, 'typing')
+    with tracing.span("telegram.send_chat_action"):
+        bot.send_chat_action(chat_id, 'typing')
     try:
         session = recover_session_from_sheet(chat_id, bus_number)
     except Exception as e:
         logging.error(f"[RECOVERY] Sheet lookup failed for {bus_number}: {e}")
-        bot.send_message(chat_id,
+        enqueue_message(chat_id,
             "⚠️ Couldn't reach the tracking sheet just now. Please re-enter the bus number to try again.")
-        return bot.register_next_step_handler(message,
-            lambda msg: intercept_end_command(msg, ask_and_validate_bus_number))
+        return expect_reply(chat_id, ask_and_validate_bus_number)
 
     if session:
         user_sessions[chat_id] = session
-        bot.send_message(chat_id, 
+        enqueue_message(chat_id, 
             f"🔄 Resuming tracking for *Bus {bus_number}* from checkpoint {session['step_index'] + 1}.",
             parse_mode="Markdown")
         send_step_prompt(chat_id)
     else:
         user_sessions[chat_id] = {"step_index": 0, "bus_number": bus_number, "username": message.from_user.username or ""}
-        bot.send_message(chat_id, 
+        enqueue_message(chat_id, 
             "🆕 New bus detected. Please enter the *Wave number* (1–5):",
             parse_mode="Markdown")
-        bot.register_next_step_handler(message, handle_wave_number)
+        expect_reply(chat_id, handle_wave_number)
 
 def handle_bus_recovery_check(message):
     chat_id = message.chat.id
@@ -308,12 +2382,12 @@ def handle_bus_recovery_check(message):
 
     if session:
         user_sessions[chat_id] = session
-        bot.send_message(chat_id, f"🔄 Resuming tracking for *Bus {bus_number}* from checkpoint {session['step_index'] + 1}.", parse_mode="Markdown")
+        enqueue_message(chat_id, f"🔄 Resuming tracking for *Bus {bus_number}* from checkpoint {session['step_index'] + 1}.", parse_mode="Markdown")
         send_step_prompt(chat_id)
     else:
         user_sessions[chat_id] = {"step_index": 0, "bus_number": bus_number}
-        bot.send_message(chat_id, "🆕 New bus detected. Please enter the *Wave number* (1–5):", parse_mode="Markdown")
-        bot.register_next_step_handler(message, lambda msg: intercept_end_command(msg,handle_wave_number))
+        enqueue_message(chat_id, "🆕 New bus detected. Please enter the *Wave number* (1–5):", parse_mode="Markdown")
+        expect_reply(chat_id, handle_wave_number)
 
 # seems to be redundant methods ! ----------------------------------------------------
 
@@ -328,6 +2402,7 @@ def handle_bus_recovery_check(message):
 #     #input data handling to sheets here
 #     bot.register_next_step_handler(message, lambda msg: intercept_end_command(msg, ask_and_validate_bus_plate))
 
+@conversation_state
 def handle_wave_number(message):
     chat_id = message.chat.id
     wave = message.text.strip()
@@ -337,90 +2412,87 @@ def handle_wave_number(message):
         return end_bot(message)
 
     if not wave.isdigit() or not (0 <= int(wave) <= 6):
-        bot.send_message(chat_id, "❌ Please enter a valid Wave number (0–6).")
-        return bot.register_next_step_handler(message,lambda msg: intercept_end_command(msg, handle_wave_number))
+        enqueue_message(chat_id, "❌ Please enter a valid Wave number (0–6).")
+        return expect_reply(chat_id, handle_wave_number)
 
     user_sessions[chat_id]['wave'] = wave
-    bot.send_message(chat_id, 
+    enqueue_message(chat_id, 
         "Please enter the *CGs' names* (comma-separated if more than one) Eg. NP1 NPD, NP1 NPG:", 
         parse_mode="Markdown")
-    bot.register_next_step_handler(message,
-        lambda msg: intercept_end_command(msg, handle_cgs_input))
+    expect_reply(chat_id, handle_cgs_input)
 
 
+@conversation_state
 def handle_cgs_input(message):
     chat_id = message.chat.id
     cgs = message.text.strip()
 
     if not cgs:
-        bot.send_message(chat_id, "❌ Please enter valid CGs' names.")
-        return bot.register_next_step_handler(message, 
-            lambda msg: intercept_end_command(msg,handle_cgs_input))
+        enqueue_message(chat_id, "❌ Please enter valid CGs' names.")
+        return expect_reply(chat_id, handle_cgs_input)
 
     user_sessions[chat_id]['cgs'] = cgs
-    bot.send_message(chat_id, "Please enter the *bus plate number*:", parse_mode="Markdown")
-    bot.register_next_step_handler(message, 
-        lambda msg: intercept_end_command(msg, ask_and_validate_bus_plate))
+    enqueue_message(chat_id, "Please enter the *bus plate number*:", parse_mode="Markdown")
+    expect_reply(chat_id, ask_and_validate_bus_plate)
 
 
 
+@conversation_state
 def ask_and_validate_bus_plate(message):
     chat_id = message.chat.id
     plate = message.text.strip().upper()
 
     if not re.fullmatch(r"(?=.*[A-Z])[A-Z0-9\- ]{3,15}", plate):
-        bot.send_message(chat_id, 
+        enqueue_message(chat_id, 
             "❌ Please enter a valid bus plate number (e.g. 'ABC1234' or 'SGX-1234').")
-        return bot.register_next_step_handler(message, 
-            lambda msg: intercept_end_command(msg,ask_and_validate_bus_plate))
+        return expect_reply(chat_id, ask_and_validate_bus_plate)
 
     user_sessions[chat_id]['bus_plate'] = plate
-    bot.send_message(chat_id, "Please enter the Bus IC's name:")
-    bot.register_next_step_handler(message, 
-        lambda msg: intercept_end_command(msg,ask_bus_ic_name))
+    enqueue_message(chat_id, "Please enter the Bus IC's name:")
+    expect_reply(chat_id, ask_bus_ic_name)
 
+@conversation_state
 def ask_bus_plate_number(message):
     chat_id = message.chat.id
     plate = message.text.strip().upper()
 
     # Basic validation: alphanumeric + hyphens
     if not re.fullmatch(r"[A-Z0-9\- ]{3,15}", plate):
-        bot.send_message(chat_id, "❌ Please enter a valid bus plate number (e.g. 'ABC1234' or 'SGX1234').")
-        return bot.register_next_step_handler(message, lambda msg: intercept_end_command(msg,ask_bus_plate_number))
+        enqueue_message(chat_id, "❌ Please enter a valid bus plate number (e.g. 'ABC1234' or 'SGX1234').")
+        return expect_reply(chat_id, ask_bus_plate_number)
 
     user_sessions[chat_id]['bus_plate'] = plate
-    bot.send_message(chat_id, "Please enter the Bus IC's name:")
-    bot.register_next_step_handler(message, lambda msg: intercept_end_command(msg,ask_bus_ic_name))
+    enqueue_message(chat_id, "Please enter the Bus IC's name:")
+    expect_reply(chat_id, ask_bus_ic_name)
 
 
+@conversation_state
 def ask_bus_ic_name(message):
     chat_id = message.chat.id
     name = message.text.strip()
 
     if not is_valid_name(name):
-        bot.send_message(chat_id, "❌ Please enter a valid name for the Bus IC (letters only).")
-        return bot.register_next_step_handler(message, 
-            lambda msg: intercept_end_command(msg, ask_bus_ic_name))
+        enqueue_message(chat_id, "❌ Please enter a valid name for the Bus IC (letters only).")
+        return expect_reply(chat_id, ask_bus_ic_name)
 
     user_sessions[chat_id]['bus_ic'] = name
-    bot.send_message(chat_id, "Please enter the Bus 2IC's name:")
-    bot.register_next_step_handler(message, 
-        lambda msg: intercept_end_command(msg, ask_2ic))
+    enqueue_message(chat_id, "Please enter the Bus 2IC's name:")
+    expect_reply(chat_id, ask_2ic)
 
 
+@conversation_state
 def ask_2ic(message):
     chat_id = message.chat.id
     if not is_valid_name(message.text):
-        bot.send_message(chat_id, "❌ Please enter a valid name for the Bus 2IC (letters only).")
-        return bot.register_next_step_handler(message, 
-            lambda msg: intercept_end_command(msg,ask_2ic))
+        enqueue_message(chat_id, "❌ Please enter a valid name for the Bus 2IC (letters only).")
+        return expect_reply(chat_id, ask_2ic)
 
     user_sessions[chat_id]['bus_2ic'] = message.text
-    bot.send_message(chat_id, "Please enter the total number of people on board:")
-    bot.register_next_step_handler(message, 
-        lambda msg: intercept_end_command(msg,ask_passenger_count))
+    enqueue_message(chat_id, "Please enter the total number of people on board:")
+    expect_reply(chat_id, ask_passenger_count)
 
 
+@conversation_state
 def ask_passenger_count(message):
     chat_id = message.chat.id
     passenger_count = message.text.strip()
@@ -430,9 +2502,8 @@ def ask_passenger_count(message):
 
     # Then validate
     if not passenger_count.isdigit() or not (1 <= int(passenger_count) <= 100):
-        bot.send_message(chat_id, "❌ Please enter a valid number for passenger count. E.g. 40")
-        return bot.register_next_step_handler(message, 
-            lambda msg: intercept_end_command(msg,ask_passenger_count))
+        enqueue_message(chat_id, "❌ Please enter a valid number for passenger count. E.g. 40")
+        return expect_reply(chat_id, ask_passenger_count)
 
     # If valid, proceed
     confirm_user_details(message)
@@ -447,14 +2518,14 @@ def confirm_user_details(message):
 
     # Assign row dynamically. If the sheet is unreachable, bail out cleanly
     # rather than storing row=None and silently writing to a bad row later.
+    session['tab'] = tab_for_registration(session)
     try:
-        row = get_or_create_user_row(session['bus_number'])
+        row = get_or_create_user_row(session['bus_number'], session['tab'])
     except Exception as e:
         logging.error(f"[ROW] Failed to get/create row for {session['bus_number']}: {e}")
-        bot.send_message(chat_id,
+        enqueue_message(chat_id,
             "⚠️ Couldn't reach the sheet to reserve your row. Please send the passenger count once more to retry.")
-        return bot.register_next_step_handler(message,
-            lambda msg: intercept_end_command(msg, ask_passenger_count))
+        return expect_reply(chat_id, ask_passenger_count)
     session['row'] = row  # Store for future logging
 
     session = user_sessions[chat_id]
@@ -478,7 +2549,7 @@ def confirm_user_details(message):
         InlineKeyboardButton("🔁 Edit", callback_data="edit_details")
     )
 
-    bot.send_message(chat_id, summary, reply_markup=markup, parse_mode="Markdown")
+    enqueue_message(chat_id, summary, reply_markup=markup, parse_mode="Markdown")
 
 def start_checkpoint_flow(message):
     # user_sessions[message.chat.id]['passenger_count'] = message.text
@@ -487,7 +2558,7 @@ def start_checkpoint_flow(message):
 def send_step_prompt(chat_id):
     step_index = user_sessions[chat_id]["step_index"]
     if step_index >= len(steps):
-        bot.send_message(chat_id,
+        enqueue_message(chat_id,
             "🎉 Congratulations! You've successfully reached Star safely! "
             "Thank you for your labour of love 🙌\n\n"
             "↑↑ Please refer to the reminders as stated in the above messages and take instructions from Welcome Team at Star as well!\n\n"
@@ -504,26 +2575,30 @@ def send_step_prompt(chat_id):
     extra = step_extra_info.get(step_key)
     if extra:
         prompt_text += f"\n{extra}"
-    bot.send_message(chat_id, prompt_text, reply_markup=markup, parse_mode="Markdown")
+    enqueue_message(chat_id, prompt_text, reply_markup=markup, parse_mode="Markdown")
 
 @bot.callback_query_handler(func=lambda call: True)
 def handle_step_callback(call):
     # Acknowledge immediately so the button stops showing a loading spinner.
     try:
-        bot.answer_callback_query(call.id)
+        with tracing.span("telegram.answer_callback_query"):
+            bot.answer_callback_query(call.id)
     except Exception:
         pass
     chat_id = call.message.chat.id
-    bot.send_chat_action(chat_id, 'typing')
+    with tracing.span("telegram.send_chat_action"):
+        bot.send_chat_action(chat_id, 'typing')
     data    = call.data
 
     # ── Admin callbacks (no session required) ─────────────────────────────────
-    if data in ("admin_list_refresh", "admin_back"):
-        _send_admin_list(chat_id, message_id=call.message.message_id)
+    admin_data, _, tab = data.partition("@")
+    if admin_data in ("admin_list_refresh", "admin_back"):
+        _send_admin_list(chat_id, message_id=call.message.message_id, tab=tab or None)
         return
 
-    if data == "admin_report":
-        _generate_fleet_report(chat_id, message_id=call.message.message_id)
+    if admin_data in ("admin_report", "admin_report_resync"):
+        _generate_fleet_report(chat_id, message_id=call.message.message_id,
+                               resync=(admin_data == "admin_report_resync"), tab=tab or None)
         return
 
     if data.startswith("cb_"):
@@ -532,7 +2607,7 @@ def handle_step_callback(call):
     session = user_sessions.get(chat_id)
 
     if not session:
-        bot.send_message(chat_id, "Session not found. Please /start again.")
+        enqueue_message(chat_id, "Session not found. Please /start again.")
         return
 
 
@@ -543,9 +2618,16 @@ def handle_step_callback(call):
             step_to_undo = steps[session["step_index"] - 1]
             try:
                 clear_cell(chat_id, step_to_undo)
+            except SchemaError as e:
+                logging.error(f"[go_back] clear_cell refused for {chat_id}: {e}")
+                enqueue_message(chat_id,
+                    f"❌ Couldn't undo that checkpoint: {e}\n"
+                    "Please ask an admin to check the sheet's headers; "
+                    "you're still on the current checkpoint.")
+                return  # leave step_index untouched
             except Exception as e:
                 logging.error(f"[go_back] clear_cell failed for {chat_id}: {e}")
-                bot.send_message(chat_id,
+                enqueue_message(chat_id,
                     "⚠️ Connection hiccup while undoing that checkpoint. "
                     "Please tap ⬅️ Back again to retry.")
                 return  # leave step_index untouched; user stays on current step
@@ -553,12 +2635,12 @@ def handle_step_callback(call):
             session.pop('awaiting_passenger_count_step', None) # allow re-confirming this step
             current_step = steps[session["step_index"]]
             logging.info(f"⬅️ User {chat_id} went back to step {session['step_index']} ({current_step})")
-            bot.send_message(chat_id,
+            enqueue_message(chat_id,
                 f"⬅️ You have moved back to: *{prompts[current_step]}*",
                 parse_mode="Markdown")
         else:
             logging.info(f"[INFO] ⬅️ User {chat_id} already at first step, can't go back further")
-            bot.send_message(chat_id, "⚠️ You're already at the first checkpoint. Cannot go back further.")
+            enqueue_message(chat_id, "⚠️ You're already at the first checkpoint. Cannot go back further.")
 
         send_step_prompt(chat_id)
 
@@ -582,14 +2664,14 @@ def handle_step_callback(call):
 
             # 🎯 Custom reminder after MY Customs
             if step_key == "left_sg_custom":
-                bot.send_message(
+                enqueue_message(
                     chat_id,
                     "*[IMPORTANT]*\n\n"
                     "Please remember to do a *passport check* with everyone in the bus before leaving SG customs!\n",
                     parse_mode="Markdown"
                 )
 
-                bot.send_message(
+                enqueue_message(
                     chat_id,
                     "🥳 Woohoo ! You're almost reaching Star! This is the final stretch, see you there soon! \n\n"
                     "*One final thing*: We would require YOUR help 🫵 as Bus ICs to brief the youths in your bus on *THE NEXT STEPS* upon reaching Star \n\n"
@@ -602,7 +2684,7 @@ def handle_step_callback(call):
                 )
             
             if step_key == "left_my_custom":
-                bot.send_message(
+                enqueue_message(
                     chat_id,
                     "🔔 *Reminder for Bus IC:*\nPlease bring down at the SG customs:\n"
                     "- 😷 *N95 masks*\n"
@@ -613,7 +2695,7 @@ def handle_step_callback(call):
                 )
 
             if step_key == "reached_my_custom":
-                bot.send_message(
+                enqueue_message(
                     chat_id,
                     "🔔 *Reminder for Bus IC:*\nPlease *put up* the event signages at the:\n"
                     "- 🪧 *Front*\n"
@@ -624,7 +2706,7 @@ def handle_step_callback(call):
                 )
 
             if step_key == "reached_rest_stop":
-                bot.send_message(
+                enqueue_message(
                     chat_id,
                     "🔔 *Reminder for Bus IC:*\n"
                     "Please *PUT UP* the Bus signages at the:\n"
@@ -636,7 +2718,7 @@ def handle_step_callback(call):
                 )  
 
             if step_key == "left_rest_stop":
-                bot.send_message(
+                enqueue_message(
                     chat_id,
                     "🔔 *Reminder for Bus IC:*\n"
                     "Please *REMOVE* the Bus signages at the:\n"
@@ -658,24 +2740,24 @@ def handle_step_callback(call):
         if session.get('details_confirmed'):
             logging.info(f"[DEDUP] Duplicate confirm_details from {chat_id}; ignoring.")
             return
-        bot.send_message(chat_id, "⏳ Saving your details to Google Sheet...")
+        enqueue_message(chat_id, "⏳ Saving your details to Google Sheet...")
 
         try:
             log_initial_details_to_sheet(chat_id)
         except Exception as e:
-            bot.send_message(chat_id, f"❌ Failed to save details: {e}")
+            enqueue_message(chat_id, f"❌ Failed to save details: {e}")
             return
         
         user_sessions[chat_id]['details_confirmed'] = True
 
         markup = InlineKeyboardMarkup()
         markup.add(InlineKeyboardButton("🟢 Okay", callback_data="begin_checklist"))
-        bot.send_message(
+        enqueue_message(
                     chat_id,
                     "🔔 *Reminder for Bus IC:*\nYou *DO NOT need to* put up the bus signages in the bus.",
                     parse_mode="Markdown"
                 )
-        bot.send_message(chat_id, "Great! Please click the button below to begin the journey checklist.", reply_markup=markup)
+        enqueue_message(chat_id, "Great! Please click the button below to begin the journey checklist.", reply_markup=markup)
 
     elif data == "begin_checklist":
         if session.get('checklist_started'):
@@ -691,15 +2773,16 @@ def handle_step_callback(call):
 
 def prompt_passenger_count(chat_id, step_key):
     user_sessions[chat_id]['awaiting_passenger_count_step'] = step_key
-    msg = bot.send_message(
+    enqueue_message(
         chat_id,
         f"👥 Please enter the *current passenger count* after '{prompts[step_key]}':",
         parse_mode="Markdown"
     )
-    bot.register_next_step_handler(msg, lambda msg1: intercept_end_command(msg1,handle_passenger_count_after_step))
+    expect_reply(chat_id, handle_passenger_count_after_step)
 
     
 
+@conversation_state
 def handle_passenger_count_after_step(message):
     chat_id = message.chat.id
     text = message.text.strip()
@@ -717,13 +2800,13 @@ def handle_passenger_count_after_step(message):
 
     if not passenger_count.isdigit():
         logging.error("[ERROR] ❌ Invalid passenger count input")
-        bot.send_message(chat_id, "❌ Please enter a valid number for passenger count.")
-        return bot.register_next_step_handler(message, lambda msg: intercept_end_command(msg,handle_passenger_count_after_step))
+        enqueue_message(chat_id, "❌ Please enter a valid number for passenger count.")
+        return expect_reply(chat_id, handle_passenger_count_after_step)
 
     step_key = user_sessions[chat_id].get('awaiting_passenger_count_step')
     if not step_key:
         logging.error("[ERROR] ❌ Missing step key during count logging")
-        bot.send_message(chat_id, "⚠️ No step context found. Please try again.")
+        enqueue_message(chat_id, "⚠️ No step context found. Please try again.")
         return
 
     #handle if the passenger count does not match the original number
@@ -741,28 +2824,29 @@ def handle_passenger_count_after_step(message):
             'actual_count': current_pax,
             'expected_count': expected_pax
         }
-        msg = bot.send_message(
+        enqueue_message(
             chat_id,
             f"⚠️ Passenger count mismatch (Expected: {expected_pax}, Now: {current_pax}).\n"
             f"Please enter a reason to include in the Remarks column:"
         )
-        return bot.register_next_step_handler(msg, lambda msg1: intercept_end_command(msg1,handle_mismatch_reason))
+        return expect_reply(chat_id, handle_mismatch_reason)
 
     logging.info(f"[LOG] ✅ Saved count: {passenger_count} for step: {step_key} (User: {chat_id})")
     logging.debug(f"[STATE] Full log for user {chat_id}: {user_sessions[chat_id]['passenger_log']}")
 
     # ✅ NEW: Log time + checkbox to Google Sheet
     # log_checkpoint_to_sheet(chat_id, step_key)
-    bot.send_message(chat_id, "⏳ Uploading checkpoint to sheet...")
+    if outbox is None:
+        enqueue_message(chat_id, "⏳ Uploading checkpoint to sheet...")
 
     try:
         log_checkpoint_to_sheet(chat_id, step_key)
     except Exception as e:
-        m = bot.send_message(chat_id, f"❌ Failed to save checkpoint: {e}\n"
+        enqueue_message(chat_id, f"❌ Failed to save checkpoint: {e}\n"
             "Please enter the passenger count again to retry; "
             "you haven't moved past this checkpoint.")
         # re-register so the next message routes back here, and DON'T advance
-        return bot.register_next_step_handler(m, lambda msg1: intercept_end_command(msg1, handle_passenger_count_after_step))
+        return expect_reply(chat_id, handle_passenger_count_after_step)
 
     # threading.Thread(
     #   target=log_checkpoint_to_sheet,
@@ -775,11 +2859,16 @@ def handle_passenger_count_after_step(message):
         'count': current_pax
     })
     
-    bot.send_message(chat_id, "✅ Checkpoint successfully saved.")
+    if outbox is None:
+        enqueue_message(chat_id, "✅ Checkpoint successfully saved.")
+    else:
+        # Only journalled so far; the replayer gets it into the sheet.
+        enqueue_message(chat_id, "✅ Checkpoint recorded. It will sync to the sheet shortly.")
     user_sessions[chat_id]['step_index'] += 1
     user_sessions[chat_id].pop('awaiting_passenger_count_step', None)  # step done, allow next/re-confirm
     send_step_prompt(chat_id)
 
+@conversation_state
 def handle_mismatch_reason(message):
     chat_id = message.chat.id
     reason = message.text.strip()
@@ -795,7 +2884,7 @@ def handle_mismatch_reason(message):
 
     mismatch = user_sessions[chat_id].get('pending_pax_mismatch')
     if not mismatch:
-        bot.send_message(chat_id, "⚠️ No mismatch context found. Please retry the step.")
+        enqueue_message(chat_id, "⚠️ No mismatch context found. Please retry the step.")
         return
 
     # ✅ Now log to sheet, with red remark
@@ -807,7 +2896,8 @@ def handle_mismatch_reason(message):
     #    remark=reason
     # )
 
-    bot.send_message(chat_id, "⏳ Uploading checkpoint and remarks to sheet...")
+    if outbox is None:
+        enqueue_message(chat_id, "⏳ Uploading checkpoint and remarks to sheet...")
 
     try:
         log_checkpoint_to_sheet(
@@ -818,10 +2908,9 @@ def handle_mismatch_reason(message):
             remark=reason
         )
     except Exception as e:
-        m = bot.send_message(chat_id, f"❌ Failed to save checkpoint: {e}\n"
+        enqueue_message(chat_id, f"❌ Failed to save checkpoint: {e}\n"
             "Please type the reason again to retry; you haven't moved past this checkpoint.")
-        return bot.register_next_step_handler(
-            m, lambda msg1: intercept_end_command(msg1, handle_mismatch_reason)) # stay on this step, do NOT increment step_index
+        return expect_reply(chat_id, handle_mismatch_reason) # stay on this step, do NOT increment step_index
     
     # write succeeded — now it's safe to consume the context and record
     user_sessions[chat_id].pop('pending_pax_mismatch', None)
@@ -849,7 +2938,10 @@ def handle_mismatch_reason(message):
 
     # Update the expected pax count to the new actual count so future checkpoints
     # compare against the latest confirmed headcount, not the original registration number.
-    bot.send_message(chat_id, "✅ Checkpoint and remarks successfully saved.")
+    if outbox is None:
+        enqueue_message(chat_id, "✅ Checkpoint and remarks successfully saved.")
+    else:
+        enqueue_message(chat_id, "✅ Checkpoint and remarks recorded. They will sync to the sheet shortly.")
     user_sessions[chat_id]['passenger_count'] = str(mismatch['actual_count'])
     logging.info(f"[PAX] Updated expected pax for user {chat_id} to {mismatch['actual_count']}")
     user_sessions[chat_id]['step_index'] += 1
@@ -872,81 +2964,102 @@ def end_bot(message):
     # Drop any pending next-step handler so a stale prompt can't fire after /end.
     bot.clear_step_handler_by_chat_id(chat_id)
     user_sessions.pop(chat_id, None)
-    bot.send_message(chat_id, "✅ Your session has been terminated. You can restart anytime with /start.")
+    enqueue_message(chat_id, "✅ Your session has been terminated. You can restart anytime with /start.")
 
 
 # it will check by bus number and see if the user has an existing code
-@retry_on_error()
-def get_column_mapping(worksheet):
-    title = worksheet.title  # e.g. 'D1'
-
-    if title in HEADER_CACHE:
-        return HEADER_CACHE[title]
-
-    header_row = worksheet.row_values(1)
-    column_map = {header.strip().lower(): idx + 1 for idx, header in enumerate(header_row)}
-
-    HEADER_CACHE[title] = column_map
-    return column_map
-
-@retry_on_error()
-def get_or_create_user_row(bus_number):
+@retry_on_error(lane=_allocation_lane)
+def get_or_create_user_row(bus_number, tab=None):
     """IMPROVEMENT 3: Find row by looking up the Bus # column header, not hardcoded col A."""
-    worksheet   = sh.worksheet(GSHEET_TAB)
-    columns     = get_column_mapping(worksheet)
-    bus_col_idx = columns.get("bus #", 2)          # default to col 2 if header missing
-    bus_numbers = worksheet.col_values(bus_col_idx)
-    # worksheet = sh.worksheet(GSHEET_TAB)
-    # bus_numbers = worksheet.col_values(1)  # Assuming column A has bus numbers
+    worksheet   = get_worksheet(tab)
+    bus_col_idx = get_schema(worksheet).col("bus #") or 2  # default to col 2 if header missing
+    key         = normalise_bus_number(bus_number)
 
-    for i, existing in enumerate(bus_numbers):
-        if existing.strip().lower() == bus_number.strip().lower():
-            return i + 1  # gspread uses 1-based indexing
+    row = get_bus_row_index(worksheet, bus_col_idx).rows.get(key)
+    if row:
+        return row
+
+    # Not indexed: re-read the column before reserving, in case another
+    # instance (or someone editing the sheet) added the bus since we indexed.
+    index = get_bus_row_index(worksheet, bus_col_idx, refresh=True)
+    row   = index.rows.get(key)
+    if row:
+        return row
 
     # If not found, append a new row AND immediately write the bus number to
     # reserve it. Without this, two buses registering in the same window both
     # compute the same index and one overwrites the other.
-    new_row_index = len(bus_numbers) + 1
+    new_row_index = index.size + 1
     worksheet.update_cell(new_row_index, bus_col_idx, bus_number)
+    reserve_bus_row(worksheet.title, bus_number, new_row_index)
+    invalidate_sheet_snapshot(worksheet.title)
     return new_row_index
 
-@retry_on_error()
+def clear_cells(worksheet, row, step_key):
+    """CellWrites emptying a checkpoint's time and Tele cells."""
+    cols = get_schema(worksheet).step(step_key)
+    return CellWrites(worksheet).set(row, cols.time, '').set(row, cols.tele, '')
+
+def _check_journal_step(tab, step_key):
+    """Raise SchemaError now if `tab`'s header can't take `step_key`.
+
+    A header the bot can't map has to reach the IC, not turn up later in the
+    dead-letter file. The compiled schema is used as it is, so the IC still
+    only waits for a disk write; the replayer re-reads the header when it
+    applies the entry. Row 1 is only fetched when no schema exists yet and
+    the breaker is closed. If that fails, the replayer is left to check.
+    """
+    with _schema_lock:
+        schema = _schemas.get(tab)
+    if schema is None and not sheets_breaker.is_open():
+        try:
+            schema = get_schema(get_worksheet(tab))
+        except _RETRYABLE_ERRORS as e:
+            if not _is_transient(e):
+                raise
+            logging.warning(f"[OUTBOX] Couldn't read the header of '{tab}' ({e}); journalling unchecked.")
+    if schema is not None:
+        schema.step(step_key)
+
 def clear_cell(chat_id, step_key):
+    """Undo a checkpoint: through the outbox if enabled, else straight to the sheet."""
+    session = user_sessions[chat_id]
+    if outbox is None:
+        return _clear_cell_in_sheet(chat_id, step_key)
+    tab = session_tab(session)
+    _check_journal_step(tab, step_key)
+    outbox.append("x", tab, session.get("row", 2), step_key, session['bus_number'])
+    fleet_progress.for_tab(tab).mark(session['bus_number'], steps.index(step_key), completed=False)
+    logging.info(f"[OUTBOX] {chat_id} cleared step '{step_key}' (journalled)")
+
+@retry_on_error(lane=_session_row_lane)
+def _clear_cell_in_sheet(chat_id, step_key):
     session = user_sessions[chat_id]
     # step_index = session["step_index"]
     # row = session.get("row", 2)
 
     # col_time = 8 + (3 * step_index)
     # col_true = 9 + (3 * step_index)
-    # worksheet = sh.worksheet(GSHEET_TAB)
+    # worksheet = get_worksheet()
     # worksheet.update_cell(row, col_time, '')
     # worksheet.update_cell(row, col_true, '')
     row       = session.get("row", 2)
-    worksheet = sh.worksheet(GSHEET_TAB)
-    columns   = get_column_mapping(worksheet)
-
-    col_name  = step_to_column.get(step_key, "").strip().lower()
-    if not col_name or col_name not in columns:
-        logging.warning(f"[clear_cell] Column for step '{step_key}' not found, skipping.")
-        return
-
-    time_col = columns[col_name]
-    tele_col = time_col + 1
+    worksheet = get_worksheet(session_tab(session))
 
-    # IMPROVEMENT 2: batch_update instead of two individual update_cell calls
-    worksheet.batch_update([
-        {'range': gspread.utils.rowcol_to_a1(row, time_col), 'values': [['']]},
-        {'range': gspread.utils.rowcol_to_a1(row, tele_col), 'values': [['']]},
-    ])
+    # IMPROVEMENT 2: one request instead of two individual update_cell calls
+    # (a SchemaError propagates: the caller must not move the step back)
+    clear_cells(worksheet, row, step_key).send()
+    invalidate_sheet_snapshot(worksheet.title)
+    fleet_progress.for_tab(worksheet.title).mark(session['bus_number'], steps.index(step_key), completed=False)
     logging.info(f"[LOG] {chat_id} cleared step '{step_key}' at row {row}")
 
 # this logs the bus number, bus plate, no. of pax, bus ic and bus 2ic down into the sheet.
-@retry_on_error()
+@retry_on_error(lane=_session_row_lane)
 def log_initial_details_to_sheet(chat_id):
     session = user_sessions[chat_id]
     row = session['row']
-    worksheet = sh.worksheet(GSHEET_TAB)
-    col_map   = get_column_mapping(worksheet)
+    worksheet = get_worksheet(session_tab(session))
+    schema    = get_schema(worksheet)
 
     try:
         # IMPROVEMENT 2: batch_update with column header lookup
@@ -961,152 +3074,194 @@ def log_initial_details_to_sheet(chat_id):
             'username':   session.get('username', ''),
         }
         updates = [
-            {'range': gspread.utils.rowcol_to_a1(row, col_map[h]), 'values': [[v]]}
-            for h, v in field_map.items() if h in col_map
+            {'range': gspread.utils.rowcol_to_a1(row, schema.col(h)), 'values': [[v]]}
+            for h, v in field_map.items() if schema.col(h)
         ]
         if updates:
             worksheet.batch_update(updates)
+            invalidate_sheet_snapshot(worksheet.title)
 
     except KeyError as e:
-        bot.send_message(chat_id, f"❌ Column header not found in sheet: {e}")
+        enqueue_message(chat_id, f"❌ Column header not found in sheet: {e}")
         logging.error(f"[ERROR] Column not found: {e}")
         return
     except Exception as e:
-        bot.send_message(chat_id, f"❌ Failed to update Google Sheet: {e}")
+        enqueue_message(chat_id, f"❌ Failed to update Google Sheet: {e}")
         logging.error(f"[ERROR] Google Sheet update failed: {e}")
         return
 
+    fleet_progress.for_tab(worksheet.title).register(session['bus_number'])
     logging.info(f"[LOG] Initial bus info saved dynamically for user {chat_id} at row {row}")
 
+def checkpoint_cells(worksheet, row, step_key, current_time, remark=None):
+    """CellWrites for a checkpoint: time, Tele tick and remark (highlighted if any)."""
+    cols   = get_schema(worksheet).step(step_key)
+    writes = CellWrites(worksheet)
+    writes.set(row, cols.time, current_time)
+    writes.set(row, cols.tele, True)
+    if remark:
+        writes.set(row, cols.remark, remark, background=REMARK_BACKGROUND)
+    else:
+        writes.set(row, cols.remark, '')
+        # writes.set(row, cols.remark, '', background={"red": 1, "green": 1, "blue": 1})
+    return writes
+
 # this is code to log each checkpoint.
-@retry_on_error()
 def log_checkpoint_to_sheet(chat_id, step_key, actual_pax=None, expected_pax=None, remark=None):
+    """Record a checkpoint: through the outbox if enabled, else straight to the sheet."""
+    session = user_sessions[chat_id]
+    if outbox is None or step_key not in step_to_column:
+        return _log_checkpoint_in_sheet(chat_id, step_key, actual_pax, expected_pax, remark)
+    tab = session_tab(session)
+    _check_journal_step(tab, step_key)
+    current_time = datetime.now(ZoneInfo("Asia/Singapore")).strftime("%H:%M")
+    entry = outbox.append("c", tab, session['row'], step_key, session['bus_number'],
+                          h=current_time, **({"m": remark} if remark else {}))
+    fleet_progress.for_tab(tab).mark(session['bus_number'], steps.index(step_key))
+    logging.info(f"[OUTBOX] Journalled step '{step_key}' at {current_time} for user {chat_id} (entry {entry['s']})")
+
+@retry_on_error(lane=_session_row_lane)
+def _log_checkpoint_in_sheet(chat_id, step_key, actual_pax=None, expected_pax=None, remark=None):
     session = user_sessions[chat_id]
     row = session['row']
-    worksheet = sh.worksheet(GSHEET_TAB)
-    columns = get_column_mapping(worksheet)
+    worksheet = get_worksheet(session_tab(session))
 
     # step_to_column is a global var
     if step_key not in step_to_column:
         logging.info(f"[INFO] No sheet mapping for step '{step_key}', skipping log.")
         return
 
-    time_col_name = step_to_column[step_key].strip().lower()
-    try:
-        time_col_index = columns[time_col_name]
-        tele_col_index = time_col_index + 1  # "Tele" column is always next
-        remarks_col_index = tele_col_index + 1
-        current_time = datetime.now(ZoneInfo("Asia/Singapore")).strftime("%H:%M")
-
-        # IMPROVEMENT 2: batch_update for time + checkbox
-        updates = [
-            {'range': gspread.utils.rowcol_to_a1(row, time_col_index), 'values': [[current_time]]},
-            {'range': gspread.utils.rowcol_to_a1(row, tele_col_index), 'values': [[True]]},
-        ]
-
-        if remark:
-            updates.append({'range': gspread.utils.rowcol_to_a1(row, remarks_col_index),
-                            'values': [[remark]]})
-            worksheet.batch_update(updates)
-            worksheet.format(gspread.utils.rowcol_to_a1(row, remarks_col_index),
-                             {"backgroundColor": {"red": 1, "green": 0.8, "blue": 0.8}})
-        else:
-            updates.append({'range': gspread.utils.rowcol_to_a1(row, remarks_col_index),
-                            'values': [['']]})
-            worksheet.batch_update(updates)
-            # worksheet.format(gspread.utils.rowcol_to_a1(row, remarks_col_index),
-            #                  {"backgroundColor": {"red": 1, "green": 1, "blue": 1}})
+    current_time = datetime.now(ZoneInfo("Asia/Singapore")).strftime("%H:%M")
 
+    # IMPROVEMENT 2: one request for time + checkbox + remark (and its highlight).
+    # A SchemaError propagates so the handler reports it and doesn't advance.
+    checkpoint_batcher.submit(checkpoint_cells(worksheet, row, step_key, current_time, remark))
+    invalidate_sheet_snapshot(worksheet.title)
 
-    except KeyError as e:
-        print(f"[ERROR] Column header not found: {e}")
-        return
-    
+    fleet_progress.for_tab(worksheet.title).mark(session['bus_number'], steps.index(step_key))
     logging.info(f"[LOG] Logged step '{step_key}' at {current_time} for user {chat_id} in row {row}")
 
 # if user filling halfway we recover the session.
 @retry_on_error()
 def recover_session_from_sheet(chat_id, bus_number):
-    worksheet = sh.worksheet(GSHEET_TAB)
+    """Find the bus on any event tab (today's first) and rebuild its session."""
+    for tab in event_tabs():
+        try:
+            worksheet = get_worksheet(tab)
+        except gspread.exceptions.WorksheetNotFound:
+            continue
+        session = _recover_session_from_tab(worksheet, bus_number)
+        if session:
+            return session
+    return None
 
-    columns = get_column_mapping(worksheet)
-    bus_col_index = columns.get("bus #")  # Get index from header
+def _recover_session_from_tab(worksheet, bus_number):
+    schema = get_schema(worksheet)
+    bus_col_index = schema.col("bus #")  # Get index from header
 
     if not bus_col_index:
         logging.error("[ERROR] 'Bus #' column not found in header.")
         return None
 
-    bus_numbers = worksheet.col_values(bus_col_index)
-    # bus_numbers = worksheet.col_values(2)  # Column 2 = "Bus #" (1-indexed)
-
-    for i, b in enumerate(bus_numbers):
-        if b.strip().lower() == bus_number.strip().lower():
-            row = i + 1
-            values = worksheet.row_values(row)
-            col_map = get_column_mapping(worksheet)
-
-            # Helper to safely extract a value by header name
-            def safe_get(col_name):
-                idx = col_map.get(col_name.strip().lower())
-                return values[idx - 1].strip() if idx and len(values) >= idx else ""
-
-            # Extract fields
-            wave = safe_get("wave")
-            cgs = safe_get("cgs")
-            bus_plate = safe_get("bus plate")
-            pax = safe_get("no. of pax")
-            bus_ic = safe_get("bus ic")
-            bus_2ic = safe_get("bus 2ic")
-            username = safe_get("username")
-
-            # Step recovery
-            step_index = 0
-            for step in steps:
-                col_name = step_to_column.get(step)
-                col_idx = col_map.get(col_name.strip().lower())
-                if col_idx and len(values) >= col_idx and values[col_idx - 1].strip():
-                    step_index += 1
-                else:
-                    break
-
-            return {
-                "step_index": step_index,
-                "bus_number": bus_number,
-                "row": row,
-                "wave": wave,
-                "cgs": cgs,
-                "bus_plate": bus_plate,
-                "passenger_count": pax,
-                "bus_ic": bus_ic,
-                "bus_2ic": bus_2ic,
-                "username": username,
-                "details_confirmed": True
-            }
+    key   = normalise_bus_number(bus_number)
+    index = get_bus_row_index(worksheet, bus_col_index)
+    row   = index.rows.get(key)
+    if not row and not index.is_fresh(BUS_INDEX_MAX_AGE):
+        index = get_bus_row_index(worksheet, bus_col_index, refresh=True)
+        row   = index.rows.get(key)
+    if not row:
+        return None
 
-    return None
+    values = worksheet.row_values(row)
+    stored = values[bus_col_index - 1] if len(values) >= bus_col_index else ""
+    if normalise_bus_number(stored) != key:
+        # Rows were moved or deleted under us; re-index and try once more.
+        logging.warning(f"[RECOVERY] Index pointed {bus_number} at row {row} but found '{stored}'; re-indexing.")
+        row = get_bus_row_index(worksheet, bus_col_index, refresh=True).rows.get(key)
+        if not row:
+            return None
+        values = worksheet.row_values(row)
+
+    # Helper to safely extract a value by header name
+    def safe_get(col_name):
+        idx = schema.col(col_name)
+        return values[idx - 1].strip() if idx and len(values) >= idx else ""
+
+    # Extract fields
+    wave = safe_get("wave")
+    cgs = safe_get("cgs")
+    bus_plate = safe_get("bus plate")
+    pax = safe_get("no. of pax")
+    bus_ic = safe_get("bus ic")
+    bus_2ic = safe_get("bus 2ic")
+    username = safe_get("username")
+
+    done = set()
+    for step in steps:
+        col_idx = schema.step_time[step]
+        if col_idx and len(values) >= col_idx and values[col_idx - 1].strip():
+            done.add(step)
+    # Checkpoints still waiting in the outbox aren't in the sheet yet.
+    if outbox is not None:
+        for entry in outbox.pending_for(worksheet.title, row):
+            if entry["o"] == "c":
+                done.add(entry["k"])
+            else:
+                done.discard(entry["k"])
+
+    # Step recovery
+    step_index = 0
+    for step in steps:
+        if step in done:
+            step_index += 1
+        else:
+            break
+
+    # We have the whole row anyway; bring the live fleet counters in line with it.
+    done_steps = 0
+    for i, step in enumerate(steps):
+        if step in done:
+            done_steps |= 1 << i
+    fleet_progress.for_tab(worksheet.title).set_steps(bus_number, done_steps)
+
+    return {
+        "step_index": step_index,
+        "bus_number": bus_number,
+        "tab": worksheet.title,
+        "row": row,
+        "wave": wave,
+        "cgs": cgs,
+        "bus_plate": bus_plate,
+        "passenger_count": pax,
+        "bus_ic": bus_ic,
+        "bus_2ic": bus_2ic,
+        "username": username,
+        "details_confirmed": True
+    }
 
 @bot.message_handler(commands=['edit_plate'])
 def handle_edit_plate(message):
     chat_id = message.chat.id
 
     if chat_id not in user_sessions:
-        bot.send_message(chat_id, "⚠️ No active session found. Please register all details first. Use /end and /start again to restart the bot.")
+        enqueue_message(chat_id, "⚠️ No active session found. Please register all details first. Use /end and /start again to restart the bot.")
         return
     
     if not user_sessions[chat_id].get('details_confirmed', False):
-        bot.send_message(chat_id, "❌ You must confirm your bus details before editing. Please complete the setup first.")
+        enqueue_message(chat_id, "❌ You must confirm your bus details before editing. Please complete the setup first.")
         return
     
-    bot.send_message(chat_id, "✏️ Please enter the *new bus plate number*:", parse_mode="Markdown")
-    bot.register_next_step_handler(message, lambda msg: intercept_end_command(msg, update_plate_number))
+    enqueue_message(chat_id, "✏️ Please enter the *new bus plate number*:", parse_mode="Markdown")
+    expect_reply(chat_id, update_plate_number)
 
+@conversation_state
 def update_plate_number(message):
     chat_id = message.chat.id
     plate = message.text.strip().upper()
 
     if not re.fullmatch(r"(?=.*[A-Z])[A-Z0-9\- ]{3,15}", plate):
-        bot.send_message(chat_id, "❌ Invalid format. Please enter a valid bus plate number (e.g. 'ABC1234').")
-        return bot.register_next_step_handler(message, update_plate_number)
+        enqueue_message(chat_id, "❌ Invalid format. Please enter a valid bus plate number (e.g. 'ABC1234').")
+        return expect_reply(chat_id, update_plate_number)
 
     # do NOT Update in-memory session before confirmation of sheet write
     # user_sessions[chat_id]['bus_plate'] = plate
@@ -1117,10 +3272,10 @@ def update_plate_number(message):
     #     args=(chat_id, plate)
     # ).start()
 
-    bot.send_message(chat_id, f"🔄 Updating Google Sheet with new plate *{plate}*...", parse_mode="Markdown")
+    enqueue_message(chat_id, f"🔄 Updating Google Sheet with new plate *{plate}*...", parse_mode="Markdown")
     _update_plate_number_sync(chat_id, plate)
 
-@retry_on_error()
+@retry_on_error(lane=_session_row_lane)
 def _update_plate_number_sync(chat_id, plate):
     if 'row' not in user_sessions[chat_id]:
         print(f"[INFO] No row assigned yet for chat_id {chat_id}")
@@ -1128,22 +3283,18 @@ def _update_plate_number_sync(chat_id, plate):
 
     try:
         row = user_sessions[chat_id]['row']
-        worksheet = sh.worksheet(GSHEET_TAB)
-        columns = get_column_mapping(worksheet)
-
-        col_index = columns.get("bus plate")
+        worksheet = get_worksheet(session_tab(user_sessions[chat_id]))
+        col_index = get_schema(worksheet).col("bus plate")
         if col_index:
-            worksheet.update_cell(row, col_index, plate)
-            worksheet.format(gspread.utils.rowcol_to_a1(row, col_index), {
-            "backgroundColor": {"red": 0.8, "green": 1.0, "blue": 0.8}  # Light yellow
-            })
+            CellWrites(worksheet).set(row, col_index, plate, background=EDITED_BACKGROUND).send()
+            invalidate_sheet_snapshot(worksheet.title)
             user_sessions[chat_id]['bus_plate'] = plate
-            bot.send_message(chat_id, f"✅ Bus plate updated to *{plate}* in Google Sheet.", parse_mode="Markdown")
+            enqueue_message(chat_id, f"✅ Bus plate updated to *{plate}* in Google Sheet.", parse_mode="Markdown")
             send_step_prompt(chat_id)
         else:
-            bot.send_message(chat_id, "⚠️ 'Bus Plate' column not found in sheet.")
+            enqueue_message(chat_id, "⚠️ 'Bus Plate' column not found in sheet.")
     except Exception as e:
-        bot.send_message(chat_id, f"❌ Failed to update Google Sheet: {e}")
+        enqueue_message(chat_id, f"❌ Failed to update Google Sheet: {e}")
         logging.error(f"[ERROR] Updating plate failed for {chat_id}: {e}")
 
 @bot.message_handler(commands=['edit_pax'])
@@ -1151,24 +3302,25 @@ def handle_edit_pax(message):
     chat_id = message.chat.id
 
     if chat_id not in user_sessions:
-        bot.send_message(chat_id, "⚠️ No active session found. Please register all details first. Use /end and /start again to restart the bot.")
+        enqueue_message(chat_id, "⚠️ No active session found. Please register all details first. Use /end and /start again to restart the bot.")
         return
 
     if not user_sessions[chat_id].get('details_confirmed'):
-        bot.send_message(chat_id, "❌ You must confirm your bus details before editing. Please complete the setup first.")
+        enqueue_message(chat_id, "❌ You must confirm your bus details before editing. Please complete the setup first.")
         return
 
-    bot.send_message(chat_id, "✏️ Please enter the *new passenger count*:", parse_mode="Markdown")
-    bot.register_next_step_handler(message, lambda msg: intercept_end_command(msg, update_pax))
+    enqueue_message(chat_id, "✏️ Please enter the *new passenger count*:", parse_mode="Markdown")
+    expect_reply(chat_id, update_pax)
 
+@conversation_state
 def update_pax(message):
     chat_id = message.chat.id
     try:
         pax = int(message.text.strip())
 
         if pax < 1 or pax > 100:  # Adjust based on your limit
-            bot.send_message(chat_id, "❌ Invalid input. Please enter a valid number of passengers (1-100).")
-            return bot.register_next_step_handler(message, update_pax)
+            enqueue_message(chat_id, "❌ Invalid input. Please enter a valid number of passengers (1-100).")
+            return expect_reply(chat_id, update_pax)
 
         # do NOT Update in-memory session before confirmation of sheet write
         # user_sessions[chat_id]['passenger_count'] = str(pax)
@@ -1179,14 +3331,14 @@ def update_pax(message):
         #     args=(chat_id, pax)
         # ).start()
 
-        bot.send_message(chat_id, f"🔄 Updating Google Sheet with new passenger count *{pax}*...", parse_mode="Markdown")
+        enqueue_message(chat_id, f"🔄 Updating Google Sheet with new passenger count *{pax}*...", parse_mode="Markdown")
         _update_pax_sync(chat_id, pax)
     
     except ValueError:
-        bot.send_message(chat_id, "❌ Invalid input. Please enter a valid number for passengers.")
-        return bot.register_next_step_handler(message, update_pax)
+        enqueue_message(chat_id, "❌ Invalid input. Please enter a valid number for passengers.")
+        return expect_reply(chat_id, update_pax)
 
-@retry_on_error()
+@retry_on_error(lane=_session_row_lane)
 def _update_pax_sync(chat_id, pax):
     if 'row' not in user_sessions[chat_id]:
         logging.info(f"[INFO] No row assigned yet for chat_id {chat_id}")
@@ -1194,24 +3346,19 @@ def _update_pax_sync(chat_id, pax):
 
     try:
         row = user_sessions[chat_id]['row']
-        worksheet = sh.worksheet(GSHEET_TAB)
-        columns = get_column_mapping(worksheet)
-
-        col_index = columns.get("no. of pax")
+        worksheet = get_worksheet(session_tab(user_sessions[chat_id]))
+        col_index = get_schema(worksheet).col("no. of pax")
         if col_index:
-            worksheet.update_cell(row, col_index, pax)
-
-            worksheet.format(gspread.utils.rowcol_to_a1(row, col_index), {
-            "backgroundColor": {"red": 0.8, "green": 1.0, "blue": 0.8}  # Light yellow
-            })
+            CellWrites(worksheet).set(row, col_index, pax, background=EDITED_BACKGROUND).send()
+            invalidate_sheet_snapshot(worksheet.title)
             user_sessions[chat_id]['passenger_count'] = str(pax)
 
-            bot.send_message(chat_id, f"✅ Passenger count updated to *{pax}* in Google Sheet.", parse_mode="Markdown")
+            enqueue_message(chat_id, f"✅ Passenger count updated to *{pax}* in Google Sheet.", parse_mode="Markdown")
             send_step_prompt(chat_id)
         else:
-            bot.send_message(chat_id, "⚠️ 'Passenger Count' column not found in sheet.")
+            enqueue_message(chat_id, "⚠️ 'Passenger Count' column not found in sheet.")
     except Exception as e:
-        bot.send_message(chat_id, f"❌ Failed to update Google Sheet: {e}")
+        enqueue_message(chat_id, f"❌ Failed to update Google Sheet: {e}")
         logging.error(f"[ERROR] Updating pax failed for {chat_id}: {e}")
 
 # ─── ADMIN: HELPERS ───────────────────────────────────────────────────────────
@@ -1234,34 +3381,43 @@ def create_progress_bar(steps_done, total_steps):
 def admin_list_buses(message):
     if message.from_user.id not in get_admin_ids():
         return  # silently ignore non-admins
-    _send_admin_list(message.chat.id)
+    args = message.text.split()[1:]
+    _send_admin_list(message.chat.id, tab=args[0] if args else None)
 
 def _safe_edit(chat_id, message_id, text, reply_markup=None, parse_mode="Markdown"):
     try:
-        bot.edit_message_text(
-            chat_id=chat_id, message_id=message_id,
-            text=text, reply_markup=reply_markup, parse_mode=parse_mode)
+        with tracing.span("telegram.edit_message_text"):
+            bot.edit_message_text(
+                chat_id=chat_id, message_id=message_id,
+                text=text, reply_markup=reply_markup, parse_mode=parse_mode)
     except telebot.apihelper.ApiTelegramException as e:
         if "message is not modified" in str(e).lower():
             return  # identical content already shown — nothing to do
         raise
 
+# Admin callbacks carry their tab after an "@" (cb_4@D6, admin_report@D6).
+# A report without one covers every event tab; a bus detail without one is a
+# button sent before tab routing and points into GSHEET_TAB.
+def _with_tab(data, tab):
+    return f"{data}@{tab}" if tab else data
+
 @retry_on_error()
-def _send_admin_list(chat_id, message_id=None):
+def _send_admin_list(chat_id, message_id=None, tab=None):
     """Send (or edit) the admin bus-list panel with a 📊 Generate Report button."""
+    tab  = tab or default_admin_tab()
+    tabs = event_tabs()
     try:
-        worksheet = sh.worksheet(GSHEET_TAB)
-        raw_data  = worksheet.get_all_values()
+        worksheet = get_worksheet(tab)
+        snapshot  = get_sheet_snapshot(worksheet)
+        raw_data  = snapshot.values
 
         if not raw_data or len(raw_data) < 2:
-            bot.send_message(chat_id, "No data found in sheet.")
+            enqueue_message(chat_id, "No data found in sheet.")
             return
 
-        headers_lower = [h.strip().lower() for h in raw_data[0]]
-        try:
-            bus_col_idx = headers_lower.index('bus #')
-        except ValueError:
-            bot.send_message(chat_id, "⚠️ Error: 'Bus #' column not found in headers.")
+        bus_col_idx = snapshot.schema.index('bus #')
+        if bus_col_idx is None:
+            enqueue_message(chat_id, "⚠️ Error: 'Bus #' column not found in headers.")
             return
 
         markup  = InlineKeyboardMarkup(row_width=3)
@@ -1269,50 +3425,56 @@ def _send_admin_list(chat_id, message_id=None):
         for i, row in enumerate(raw_data[1:]):
             bus_no = row[bus_col_idx].strip() if bus_col_idx < len(row) else ""
             if bus_no:
-                buttons.append(InlineKeyboardButton(f"🚍 {bus_no}", callback_data=f"cb_{i}"))
+                buttons.append(InlineKeyboardButton(f"🚍 {bus_no}", callback_data=_with_tab(f"cb_{i}", tab)))
 
         if buttons:
             markup.add(*buttons)
-        markup.row(InlineKeyboardButton("📊 Generate Report", callback_data="admin_report"))
-
         panel_text = "📋 *Admin Panel: Select a Bus*"
+        if len(tabs) > 1:
+            markup.row(*(InlineKeyboardButton(f"{'✅' if t == tab else '📅'} {t}",
+                                              callback_data=_with_tab("admin_list_refresh", t))
+                         for t in tabs))
+            markup.row(InlineKeyboardButton(f"📊 Report {tab}", callback_data=_with_tab("admin_report", tab)),
+                       InlineKeyboardButton("📊 All tabs", callback_data="admin_report"))
+            panel_text += f"\n📅 Tab: *{tab}*"
+        else:
+            markup.row(InlineKeyboardButton("📊 Generate Report", callback_data="admin_report"))
         if message_id:
             _safe_edit(
                 chat_id=chat_id, message_id=message_id,
                 text=panel_text, reply_markup=markup, parse_mode="Markdown")
         else:
-            bot.send_message(chat_id, panel_text, reply_markup=markup, parse_mode="Markdown")
+            enqueue_message(chat_id, panel_text, reply_markup=markup, parse_mode="Markdown")
 
     except Exception as e:
         logging.error(f"Error fetching admin bus list: {e}")
-        bot.send_message(chat_id, f"⚠️ Error: {str(e)}")
+        enqueue_message(chat_id, f"⚠️ Error: {str(e)}")
 
 @retry_on_error()
 def _show_bus_detail(call):
     """Show individual bus checkpoint status for admin."""
     chat_id = call.message.chat.id
     try:
-        data_row_index = int(call.data.split("_")[1])
-        worksheet      = sh.worksheet(GSHEET_TAB)
-        raw_data       = worksheet.get_all_values()
-        headers_lower  = [h.strip().lower() for h in raw_data[0]]
+        data, _, tab   = call.data.partition("@")
+        data_row_index = int(data.split("_")[1])
+        worksheet      = get_worksheet(tab or None)
+        snapshot       = get_sheet_snapshot(worksheet)
+        raw_data       = snapshot.values
+        schema         = snapshot.schema
         actual_row     = raw_data[data_row_index + 1]
         header_len = len(raw_data[0])
         if len(actual_row) < header_len:
             actual_row = actual_row + [''] * (header_len - len(actual_row))
 
-        try:
-            bus_col_idx = headers_lower.index('bus #')
-            bus_num     = actual_row[bus_col_idx].strip()
-        except (ValueError, IndexError):
+        bus_col_idx = schema.index('bus #')
+        if bus_col_idx is not None and bus_col_idx < len(actual_row):
+            bus_num = actual_row[bus_col_idx].strip()
+        else:
             bus_num = "??"
 
         def safe_col(header):
-            try:
-                idx = headers_lower.index(header)
-                return actual_row[idx].strip() if idx < len(actual_row) else ""
-            except ValueError:
-                return ""
+            idx = schema.index(header)
+            return actual_row[idx].strip() if idx is not None and idx < len(actual_row) else ""
 
         bus_ic      = safe_col('bus ic')
         bus_2ic     = safe_col('bus 2ic')
@@ -1327,13 +3489,8 @@ def _show_bus_detail(call):
 
         steps_done   = 0
         status_lines = []
-        for step_key in steps:
-            col_name = step_to_column[step_key].strip().lower()
-            try:
-                col_idx  = headers_lower.index(col_name)
-                time_val = actual_row[col_idx].strip() if col_idx < len(actual_row) else ""
-            except ValueError:
-                time_val = ""
+        for step_key, col_idx in zip(steps, snapshot.fleet.step_cols):
+            time_val = actual_row[col_idx].strip() if col_idx is not None and col_idx < len(actual_row) else ""
 
             if time_val:
                 steps_done += 1
@@ -1354,7 +3511,7 @@ def _show_bus_detail(call):
         )
 
         back_markup = InlineKeyboardMarkup()
-        back_markup.add(InlineKeyboardButton("🔙 Back", callback_data="admin_back"))
+        back_markup.add(InlineKeyboardButton("🔙 Back", callback_data=_with_tab("admin_back", tab)))
         _safe_edit(
             chat_id=chat_id, message_id=call.message.message_id,
             text=msg, parse_mode="Markdown", reply_markup=back_markup)
@@ -1363,85 +3520,302 @@ def _show_bus_detail(call):
         logging.error(f"Error showing bus detail: {e}")
         bot.answer_callback_query(call.id, "Error loading details.")
 
+def render_fleet_report(tabs=None):
+    """Fleet report text from the live fleet_progress counters (no Sheets read).
+    Covers `tabs`, or every event tab by default."""
+    now = datetime.now(ZoneInfo("Asia/Singapore")).strftime("%H:%M:%S")
+    tabs = tabs or event_tabs()
+
+    # step_counts[i] = total buses that have crossed step i (cumulative)
+    # step_current_buses[i] = buses whose FURTHEST completed step is exactly i (shown as names)
+    total_buses, counts, current = fleet_progress.summary(tabs)
+    step_counts        = dict(enumerate(counts))
+    step_current_buses = dict(enumerate(current))
+
+    title = "🚌 *ARROW BUS REPORT*"
+    if len(event_tabs()) > 1:
+        title += f" ({', '.join(tabs)})"
+    lines = [
+        title,
+        f"*Total number of buses registered: {total_buses}*\n"
+    ]
+
+    for i, step_key in enumerate(steps):
+        count = step_counts.get(i, 0)
+        current_buses = step_current_buses.get(i, [])
+        if count == 0:
+            line = f"*{prompts[step_key]}*:"
+        elif current_buses:
+            buses_str = ", ".join(current_buses)
+            line = f"*{prompts[step_key]}*: {buses_str} ({count}/{total_buses})"
+        else:
+            line = f"*{prompts[step_key]}*: ({count}/{total_buses})"
+        lines.append(line)
+
+    lines.append(f"\n_as of {now}_")
+    return "\n".join(lines)
+
 @retry_on_error()
-def _generate_fleet_report(chat_id, message_id):
-    """Generate and display the fleet-wide journey-based report showing bus names per checkpoint."""
+def _generate_fleet_report(chat_id, message_id, resync=False, tab=None):
+    """Generate and display the journey-based report for `tab`, or for every event tab."""
+    tabs = [tab] if tab else event_tabs()
     try:
-        worksheet = sh.worksheet(GSHEET_TAB)
-        raw_data  = worksheet.get_all_values()
- 
-        if not raw_data or len(raw_data) < 2:
-            bot.send_message(chat_id, "No data found in sheet.")
-            return
- 
-        headers_lower = [h.strip().lower() for h in raw_data[0]]
-        data_rows     = raw_data[1:]
-        now           = datetime.now(ZoneInfo("Asia/Singapore")).strftime("%H:%M:%S")
- 
-        # Get bus # column index
-        try:
-            bus_col_idx = headers_lower.index('bus #')
-        except ValueError:
-            bot.send_message(chat_id, "⚠️ 'Bus #' column not found in sheet.")
-            return
- 
-        # Total buses registered (any row with a bus number)
-        total_buses = sum(
-            1 for row in data_rows
-            if bus_col_idx < len(row) and row[bus_col_idx].strip()
-        )
- 
-        # step_counts[i] = total buses that have crossed step i (cumulative)
-        # step_current_buses[i] = buses whose FURTHEST completed step is exactly i (shown as names)
-        step_counts = {i: 0 for i in range(len(steps))}
-        step_current_buses = {i: [] for i in range(len(steps))}
- 
-        for row_vals in data_rows:
-            bus_name = row_vals[bus_col_idx].strip() if bus_col_idx < len(row_vals) else ""
-            if not bus_name:
-                continue
-            furthest = -1
-            for i, step_key in enumerate(steps):
-                col_name = step_to_column[step_key].strip().lower()
-                col_idx  = next((j for j, h in enumerate(headers_lower) if h == col_name), None)
-                if col_idx is not None and col_idx < len(row_vals) and row_vals[col_idx].strip():
-                    step_counts[i] += 1
-                    furthest = i
-            if furthest >= 0:
-                step_current_buses[furthest].append(bus_name)
- 
-        for i in step_current_buses:
-            step_current_buses[i].sort()
- 
-        lines = [
-            "🚌 *ARROW BUS REPORT*",
-            f"*Total number of buses registered: {total_buses}*\n"
-        ]
- 
-        for i, step_key in enumerate(steps):
-            count = step_counts.get(i, 0)
-            current_buses = step_current_buses.get(i, [])
-            if count == 0:
-                line = f"*{prompts[step_key]}*:"
-            elif current_buses:
-                buses_str = ", ".join(current_buses)
-                line = f"*{prompts[step_key]}*: {buses_str} ({count}/{total_buses})"
-            else:
-                line = f"*{prompts[step_key]}*: ({count}/{total_buses})"
-            lines.append(line)
- 
-        lines.append(f"\n_as of {now}_")
-        report_text = "\n".join(lines)
+        if resync or not fleet_progress.ready(tabs):
+            # Rebuild the live counters from the sheet; otherwise no read at all.
+            if not rebuild_fleet_progress(tabs, force=resync):
+                enqueue_message(chat_id, "No data found in sheet.")
+                return
+
+        report_text = render_fleet_report(tabs)
  
         back_markup = InlineKeyboardMarkup()
-        back_markup.add(InlineKeyboardButton("🔙 Back", callback_data="admin_list_refresh"))
+        back_markup.add(
+            InlineKeyboardButton("🔙 Back", callback_data=_with_tab("admin_list_refresh", tab)),
+            InlineKeyboardButton("🔄 Resync", callback_data=_with_tab("admin_report_resync", tab)))
         _safe_edit(
             chat_id=chat_id, message_id=message_id,
             text=report_text, parse_mode="Markdown", reply_markup=back_markup)
  
     except Exception as e:
         logging.error(f"Error generating fleet report: {e}")
-        bot.send_message(chat_id, f"❌ Failed to generate report: {e}")
+        enqueue_message(chat_id, f"❌ Failed to generate report: {e}")
+
+# ─── ADMIN: LIVE DASHBOARD ────────────────────────────────────────────────────
+# /dashboard posts the fleet report into the admin's chat, pins it and keeps
+# editing it as checkpoints change, so admins don't need to keep tapping
+# refresh. Changes are debounced: the first change starts a
+# DASHBOARD_DEBOUNCE-second timer and every change until it fires is folded
+# into the same edit, so a burst of checkpoints costs one edit_message_text
+# per dashboard. Dashboards are kept in the session store so they survive
+# restarts. /dashboard off stops it.
+DASHBOARD_DEBOUNCE = float(os.getenv("DASHBOARD_DEBOUNCE", "5"))
+DASHBOARD_FOOTER   = "\n📌 _Live dashboard: updates automatically_"
+
+class DashboardRefresher:
+    def __init__(self, debounce):
+        self.debounce    = debounce
+        self._lock       = threading.Lock()
+        self._dashboards = {}  # admin chat_id -> pinned message_id
+        self._timer      = None
+
+    def load(self, dashboards):
+        with self._lock:
+            self._dashboards.update(dashboards)
+
+    def add(self, chat_id, message_id):
+        with self._lock:
+            self._dashboards[chat_id] = message_id
+        if session_store is not None:
+            session_store.save_dashboard(chat_id, message_id)
+
+    def remove(self, chat_id):
+        with self._lock:
+            message_id = self._dashboards.pop(chat_id, None)
+        if session_store is not None:
+            session_store.delete_dashboard(chat_id)
+        return message_id
+
+    def notify(self):
+        """Schedule a refresh unless one is already pending."""
+        with self._lock:
+            if not self._dashboards or self._timer is not None:
+                return
+            self._timer = threading.Timer(self.debounce, self._refresh)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _refresh(self):
+        with self._lock:
+            self._timer = None
+            targets = list(self._dashboards.items())
+        if not targets:
+            return
+        # A tab whose counters were never loaded would show up as all zeros.
+        unready = [tab for tab in event_tabs() if not fleet_progress.for_tab(tab).ready]
+        if unready:
+            try:
+                rebuild_fleet_progress(unready)
+            except Exception as e:
+                logging.error(f"[DASHBOARD] Fleet data for {unready} not loaded ({e}); skipping refresh.")
+                return
+        text = render_fleet_report() + DASHBOARD_FOOTER
+        for chat_id, message_id in targets:
+            # Through the send queue, so a 429 is retried instead of dropping the edit.
+            if SEND_QUEUE_ENABLED:
+                outbound.submit(chat_id, edit_dashboard, chat_id, message_id, text)
+                continue
+            try:
+                _send_inline(edit_dashboard, chat_id, message_id, text)
+            except Exception as e:
+                logging.error(f"[DASHBOARD] Failed to update {chat_id}: {e}")
+        logging.info(f"[DASHBOARD] Refreshed {len(targets)} dashboard(s)")
+
+def edit_dashboard(chat_id, message_id, text):
+    """Edit a pinned dashboard; other errors (a 429 included) go back to the caller."""
+    try:
+        bot.edit_message_text(chat_id=chat_id, message_id=message_id, text=text, parse_mode="Markdown")
+    except telebot.apihelper.ApiTelegramException as e:
+        error = str(e).lower()
+        if "message is not modified" in error:
+            return  # identical content already shown
+        if "message to edit not found" in error:
+            logging.info(f"[DASHBOARD] Message gone in {chat_id}; dropping dashboard.")
+            dashboards.remove(chat_id)
+            return
+        raise
+
+dashboards = DashboardRefresher(DASHBOARD_DEBOUNCE)
+if session_store is not None:
+    dashboards.load(session_store.load_dashboards())
+fleet_progress.on_change = dashboards.notify
+
+@bot.message_handler(commands=['dashboard'])
+def admin_dashboard(message):
+    if message.from_user.id not in get_admin_ids():
+        return  # silently ignore non-admins
+    chat_id = message.chat.id
+    args = message.text.split()[1:]
+
+    if args and args[0].lower() == "off":
+        message_id = dashboards.remove(chat_id)
+        if message_id:
+            try:
+                bot.unpin_chat_message(chat_id, message_id)
+            except Exception as e:
+                logging.warning(f"[DASHBOARD] Unpin failed in {chat_id}: {e}")
+        enqueue_message(chat_id, "🛑 Live dashboard stopped.")
+        return
+
+    if not fleet_progress.ready(event_tabs()):
+        try:
+            rebuild_fleet_progress(event_tabs())
+        except Exception as e:
+            enqueue_message(chat_id, f"❌ Failed to load fleet data: {e}")
+            return
+
+    text = render_fleet_report() + DASHBOARD_FOOTER
+    if not SEND_QUEUE_ENABLED:
+        sent = _send_inline(bot.send_message, chat_id, text, parse_mode="Markdown")
+        try:
+            bot.pin_chat_message(chat_id, sent.message_id, disable_notification=True)
+        except Exception as e:
+            logging.warning(f"[DASHBOARD] Pin failed in {chat_id}: {e}")
+        dashboards.add(chat_id, sent.message_id)
+        return
+    # Queued behind this chat's earlier replies; pinned once Telegram returns its message_id.
+    sent = outbound.submit(chat_id, bot.send_message, chat_id, text, parse_mode="Markdown")
+    sent.add_done_callback(lambda future: _pin_dashboard(chat_id, future))
+
+def _pin_dashboard(chat_id, future):
+    if future.exception() is not None:
+        return
+    message_id = future.result().message_id
+    outbound.submit(chat_id, bot.pin_chat_message, chat_id, message_id, disable_notification=True)
+    dashboards.add(chat_id, message_id)
+
+# ─── ADMIN: /export ───────────────────────────────────────────────────────────
+# /export [wave=N] [step=<step key>] [tab=<tab>] sends the fleet as a CSV
+# document. Rows come from each tab's cached snapshot (at most one
+# get_all_values per tab) and the FleetColumns masks the report already
+# builds, so filtering by step is a mask lookup instead of a scan of every
+# checkpoint column. Rows are written straight into a single bytes buffer.
+EXPORT_DETAILS = ("wave", "cgs", "bus plate", "no. of pax", "bus ic", "bus 2ic")
+EXPORT_USAGE   = "Usage: /export [wave=N] [step=<step>] [tab=<tab>]"
+
+def _parse_export_args(args):
+    filters = {}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        key, value = key.strip().lower(), value.strip()
+        if not sep or not value or key not in ("wave", "step", "tab"):
+            raise ValueError(f"Unknown filter '{arg}'.")
+        filters[key] = value
+    if "step" in filters and filters["step"] not in steps:
+        raise ValueError(f"Unknown step '{filters['step']}'. Steps: {', '.join(steps)}")
+    return filters
+
+def _export_rows(snapshot, tab, wave=None, step=None):
+    """CSV rows for one tab, in sheet order. With `step`, only buses whose
+    furthest completed checkpoint is that step."""
+    fleet, schema, rows = snapshot.fleet, snapshot.schema, snapshot.data_rows
+    furthest = fleet.furthest_step_masks()
+    at_step  = {r: i for i, mask in enumerate(furthest) for r in _mask_positions(mask)}
+    selected = furthest[steps.index(step)] if step else fleet.registered
+    details  = [schema.index(h) for h in EXPORT_DETAILS]
+    wave_idx = schema.index("wave")
+
+    def cell(row, idx):
+        return row[idx].strip() if idx is not None and idx < len(row) else ""
+
+    for r in _mask_positions(selected):
+        row = rows[r]
+        if wave is not None and cell(row, wave_idx) != wave:
+            continue
+        current = at_step.get(r)
+        yield ([tab, fleet.bus_names[r]] + [cell(row, idx) for idx in details]
+               + [steps[current] if current is not None else ""]
+               + [cell(row, col) for col in fleet.step_cols])
+
+@retry_on_error()
+def build_fleet_csv(tabs, wave=None, step=None):
+    """(UTF-8 CSV bytes, number of buses) for `tabs`, filtered by wave and/or step."""
+    raw    = io.BytesIO()
+    text   = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")  # BOM so Excel reads UTF-8
+    writer = csv.writer(text)
+    writer.writerow(["tab", "bus #", *EXPORT_DETAILS, "current step",
+                     *(step_to_column[k] for k in steps)])
+    count = 0
+    for tab in tabs:
+        try:
+            worksheet = get_worksheet(tab)
+        except gspread.exceptions.WorksheetNotFound:
+            continue
+        snapshot = get_sheet_snapshot(worksheet)
+        if snapshot.fleet.bus_col is None:
+            continue
+        for row in _export_rows(snapshot, tab, wave, step):
+            writer.writerow(row)
+            count += 1
+    text.flush()
+    return text.detach().getvalue(), count
+
+@bot.message_handler(commands=['export'])
+def admin_export(message):
+    if message.from_user.id not in get_admin_ids():
+        return  # silently ignore non-admins
+    chat_id = message.chat.id
+    try:
+        filters = _parse_export_args(message.text.split()[1:])
+    except ValueError as e:
+        enqueue_message(chat_id, f"⚠️ {e}\n{EXPORT_USAGE}")
+        return
+
+    tabs = [filters["tab"]] if "tab" in filters else event_tabs()
+    try:
+        data, count = build_fleet_csv(tabs, filters.get("wave"), filters.get("step"))
+    except Exception as e:
+        logging.error(f"[EXPORT] Failed for {chat_id}: {e}")
+        enqueue_message(chat_id, f"❌ Failed to export: {e}")
+        return
+
+    stamp   = datetime.now(ZoneInfo("Asia/Singapore")).strftime("%Y%m%d-%H%M")
+    suffix  = "".join(f"_{k}-{v}" for k, v in sorted(filters.items()))
+    caption = f"📄 {count} bus(es) from {', '.join(tabs)}"
+    if "wave" in filters or "step" in filters:
+        caption += " | " + ", ".join(f"{k}={filters[k]}" for k in ("wave", "step") if k in filters)
+    # Bytes rather than a file object, so a rate-limited send can be retried.
+    kwargs = {"visible_file_name": f"fleet_{stamp}{suffix}.csv", "caption": caption}
+    if SEND_QUEUE_ENABLED:
+        outbound.submit(chat_id, bot.send_document, chat_id, data, **kwargs)
+    else:
+        _send_inline(bot.send_document, chat_id, data, **kwargs)
+    logging.info(f"[EXPORT] Sent {count} row(s) ({len(data)} bytes) to {chat_id}")
+
+# Every handler registered above gets a span of its own when tracing is on.
+for _handlers in (bot.message_handlers, bot.callback_query_handlers):
+    for _entry in _handlers:
+        _entry['function'] = traced_handler(_entry['function'])
+
 # testing !!
 # ─── POLLING MODE (for local testing) ────────────────────────────────────────
 # Run this file directly to test with polling.
@@ -1450,4 +3824,6 @@ def _generate_fleet_report(chat_id, message_id):
 if __name__ == "__main__":
     logging.info("🚌 Bot is running in POLLING mode (local testing)...")
     logging.info("   → For webhook/Cloud Run mode, run main.py instead.")
+    if outbox is not None:
+        outbox.start()
     bot.infinity_polling(timeout=10, long_polling_timeout=5)
\ No newline at end of file
@@ -1,7 +1,15 @@
 from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, JSONResponse
 import os
 from dotenv import load_dotenv
-from bus_botback import process_update_from_webhook
+from bus_botback import (
+    process_update_from_webhook, process_update_async, shutdown_async_mode,
+    enqueue_update, drain_update_queue, update_queue, drain_outbox, outbox_stats,
+    warm_up, startup_phase, STARTUP_TIMINGS, get_admin_ids, lock_stats,
+)
+from traffic_log import recorder_from_env
+import metrics
+import tracing
 import uvicorn
 import base64
 import httpx
@@ -16,6 +24,16 @@ CLOUD_RUN_BASE_URL = os.getenv("WEBHOOK_URL")
 WEBHOOK_URL = f"{CLOUD_RUN_BASE_URL}/{BOT_TOKEN}"
 
 TELEGRAM_API_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/setWebhook"
+# Process updates with asyncio-native ordering instead of one executor thread
+# per in-flight update (see ASYNC WEBHOOK MODE in bus_botback.py).
+ASYNC_WEBHOOK = os.getenv("ASYNC_WEBHOOK", "").strip().lower() in ("1", "true", "yes")
+# Answer Telegram as soon as the update is queued and handle it in the
+# background (see QUEUED WEBHOOK MODE in bus_botback.py). Takes precedence
+# over ASYNC_WEBHOOK.
+WEBHOOK_QUEUE = os.getenv("WEBHOOK_QUEUE", "").strip().lower() in ("1", "true", "yes")
+# Opt-in, pseudonymized capture of incoming updates for tools/replay.py
+# (set WEBHOOK_RECORD_PATH; see traffic_log.py).
+recorder = recorder_from_env(get_admin_ids())
 print("📢 Loaded BOT_TOKEN:", BOT_TOKEN[:10] + "..." if BOT_TOKEN else "None")
 
 # Setup Google Sheets credentials for Cloud Run
@@ -55,37 +73,102 @@ def root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy", "bot_token_set": bool(BOT_TOKEN)}
+    health = {"status": "healthy", "bot_token_set": bool(BOT_TOKEN), "startup_ms": STARTUP_TIMINGS,
+              "locks": lock_stats()}
+    if WEBHOOK_QUEUE:
+        health["update_queue"] = {"depth": update_queue.depth, "chats": update_queue.chats(),
+                                  "limit": update_queue.limit}
+    outbox = outbox_stats()
+    if outbox is not None:
+        health["outbox"] = outbox
+    return health
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+# Webhook requests received and not yet answered. Anything above
+# busbot_updates_in_flight is still waiting for a threadpool worker.
+_webhooks_in_flight = 0
+metrics.gauge("busbot_webhook_requests_in_flight",
+    "Webhook requests received and not yet answered.", lambda: _webhooks_in_flight)
 
 @app.post(f"/{BOT_TOKEN}")
 async def telegram_webhook(request: Request):
     # print("🚨 Incoming Telegram webhook hit!")
+    global _webhooks_in_flight
+    _webhooks_in_flight += 1
     try:
         body = await request.body()
         update_str = body.decode("utf-8")
-        # process_update_from_webhook does blocking telebot + gspread I/O.
-        # Run it in the default threadpool so the event loop can keep
-        # serving other concurrent webhooks while Sheets writes happen.
-        # print("📦 Processing webhook...")
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, process_update_from_webhook, update_str)
-        # process_update_from_webhook(body.decode("utf-8"))
-        return {"ok": True}
+        if recorder:
+            recorder.record(update_str)
+        # One trace per update when TRACE_PATH is set (see tracing.py).
+        mode = "queue" if WEBHOOK_QUEUE else "async" if ASYNC_WEBHOOK else "threadpool"
+        with tracing.start_trace("webhook", mode=mode):
+            if WEBHOOK_QUEUE:
+                if not await enqueue_update(update_str):
+                    # Full: let Telegram hold on to the update and redeliver it.
+                    return JSONResponse({"ok": False, "error": "busy"}, status_code=503)
+                return {"ok": True}
+            if ASYNC_WEBHOOK:
+                await process_update_async(update_str)
+                return {"ok": True}
+            # process_update_from_webhook does blocking telebot + gspread I/O.
+            # Run it in the default threadpool so the event loop can keep
+            # serving other concurrent webhooks while Sheets writes happen.
+            # print("📦 Processing webhook...")
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(None, tracing.bind(process_update_from_webhook), update_str)
+            # process_update_from_webhook(body.decode("utf-8"))
+            return {"ok": True}
     except Exception as e:
         print("❌ Error processing webhook:", str(e))
         # Still return 200/ok so Telegram does NOT retry and re-deliver
         # the same update (which would double-log a checkpoint).
         return {"ok": True}
+    finally:
+        _webhooks_in_flight -= 1
+
+async def set_webhook():
+    with startup_phase("set_webhook"):
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                TELEGRAM_API_URL,
+                json={"url": WEBHOOK_URL},
+                headers={"Content-Type": "application/json"}
+            )
+            print("Webhook set response:", response.status_code, response.json())
+
+async def warm_up_sheets():
+    # Blocking gspread calls; run them off the loop alongside setWebhook.
+    loop = asyncio.get_event_loop()
+    try:
+        await loop.run_in_executor(None, warm_up)
+    except Exception as e:
+        # Not fatal: the first sheet call will open the spreadsheet itself.
+        print("⚠️ Sheets warm-up failed:", str(e))
 
 @app.on_event("startup")
 async def startup_event():
-   async with httpx.AsyncClient() as client:
-        response = await client.post(
-            TELEGRAM_API_URL,
-            json={"url": WEBHOOK_URL},
-            headers={"Content-Type": "application/json"}
-        )
-        print("Webhook set response:", response.status_code, response.json())
+    # Opening the spreadsheet, loading headers and registering the webhook
+    # don't depend on each other, so run them concurrently.
+    with startup_phase("startup_total"):
+        await asyncio.gather(set_webhook(), warm_up_sheets())
+    print("⏱️ Startup phases (ms):", STARTUP_TIMINGS)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if WEBHOOK_QUEUE:
+        await drain_update_queue()
+    # Journalled checkpoints only outlive this instance if they reach the sheet.
+    # Drained before the async pools close, since replays are sent through them.
+    if not await drain_outbox():
+        print("⚠️ Outbox not empty at shutdown:", outbox_stats())
+    if ASYNC_WEBHOOK or WEBHOOK_QUEUE:
+        await shutdown_async_mode()
+    if recorder:
+        recorder.close()
 
 # @app.on_event("startup")
 # def set_webhook():
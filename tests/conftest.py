@@ -0,0 +1,33 @@
+import pytest
+
+for _name in ("telebot", "gspread", "requests", "fastapi", "httpx"):
+    pytest.importorskip(_name)
+
+from tools.fakes import UpdateFactory, install_offline_bot  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def offline():
+    """(main, bus_botback, FakeSheets, FakeTelegram), installed once per run."""
+    return install_offline_bot()
+
+
+@pytest.fixture
+def updates():
+    return UpdateFactory()
+
+
+@pytest.fixture
+def bus_session(offline):
+    """A registered bus on the default tab, waiting to confirm its first step."""
+    _, bot, _, telegram = offline
+    chat_id = 5001
+    telegram.sent.pop(chat_id, None)
+    bot.user_sessions[chat_id] = {
+        "tab": bot.GSHEET_TAB, "row": 2, "wave": "1", "bus_number": "A1",
+        "bus_plate": "SGX1234", "passenger_count": "40", "bus_ic": "IC",
+        "bus_2ic": "2IC", "cgs": "CG", "step_index": 0,
+    }
+    yield chat_id
+    bot.user_sessions.pop(chat_id, None)
+    bot.forget_schemas()
@@ -0,0 +1,49 @@
+"""Async mode sends batchUpdate flushes on the event loop's httpx pool."""
+import asyncio
+import threading
+
+import gspread
+import pytest
+
+
+@pytest.fixture
+def dispatch_loop(offline, monkeypatch):
+    _, bot, _, _ = offline
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(bot, "_async_loop", loop)
+    yield loop, thread
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(5)
+    loop.close()
+
+
+def test_cell_writes_go_through_the_loop(offline, dispatch_loop, monkeypatch):
+    _, bot, sheets, _ = offline
+    _, loop_thread = dispatch_loop
+    client, sent_on = bot._async_sheets, []
+    batch_update = client.batch_update
+
+    async def spy(spreadsheet_id, body):
+        sent_on.append(threading.current_thread())
+        return await batch_update(spreadsheet_id, body)
+
+    monkeypatch.setattr(client, "batch_update", spy)
+    worksheet = bot.get_worksheet(bot.GSHEET_TAB)
+
+    bot.CellWrites(worksheet).set(80, 1, "Z8").send()
+
+    assert sent_on == [loop_thread]
+    assert worksheet.cell(80, 1).value == "Z8"
+
+
+def test_http_errors_surface_as_gspread_errors(offline, dispatch_loop):
+    _, bot, _, _ = offline
+    body = {"requests": [{"updateCells": {"range": {"sheetId": 999}, "rows": [], "fields": "*"}}]}
+
+    with pytest.raises(gspread.exceptions.APIError) as raised:
+        bot.sheets_batch_update(body)
+
+    assert raised.value.response.status_code == 400
+    assert not bot._is_transient(raised.value)
@@ -0,0 +1,63 @@
+"""Live dashboard edits go through the send queue and never render unloaded tabs."""
+import telebot
+import pytest
+
+ADMIN_CHAT = 7001
+
+
+@pytest.fixture
+def dashboard(offline):
+    _, bot, _, telegram = offline
+    message_id = bot.bot.send_message(ADMIN_CHAT, "dashboard").message_id
+    bot.dashboards.add(ADMIN_CHAT, message_id)
+    yield message_id
+    bot.dashboards.remove(ADMIN_CHAT)
+    telegram.sent.pop(ADMIN_CHAT, None)
+
+
+def _flood(retry_after=0.1):
+    return telebot.apihelper.ApiTelegramException("editMessageText", None, {
+        "error_code": 429, "description": "Too Many Requests",
+        "parameters": {"retry_after": retry_after}})
+
+
+def test_refresh_retries_an_edit_after_a_429(offline, dashboard, monkeypatch):
+    _, bot, _, telegram = offline
+    edit, calls = bot.bot.edit_message_text, []
+
+    def flaky_edit(*args, **kwargs):
+        calls.append(kwargs["message_id"])
+        if len(calls) == 1:
+            raise _flood()
+        return edit(*args, **kwargs)
+
+    monkeypatch.setattr(bot.bot, "edit_message_text", flaky_edit)
+    bot.dashboards._refresh()
+
+    assert bot.outbound.wait_idle(ADMIN_CHAT, 5)
+    assert calls == [dashboard, dashboard]
+    assert telegram.sent[ADMIN_CHAT][-1].startswith("🚌")
+
+
+def test_refresh_loads_tabs_that_are_not_ready(offline, dashboard):
+    _, bot, _, _ = offline
+    progress = bot.fleet_progress.for_tab(bot.GSHEET_TAB)
+    progress.ready = False
+
+    bot.dashboards._refresh()
+
+    assert progress.ready
+    assert bot.outbound.wait_idle(ADMIN_CHAT, 5)
+
+
+def test_edit_of_a_deleted_dashboard_drops_it(offline, dashboard, monkeypatch):
+    _, bot, _, _ = offline
+
+    def gone(*args, **kwargs):
+        raise telebot.apihelper.ApiTelegramException("editMessageText", None, {
+            "error_code": 400, "description": "Bad Request: message to edit not found"})
+
+    monkeypatch.setattr(bot.bot, "edit_message_text", gone)
+    bot.edit_dashboard(ADMIN_CHAT, dashboard, "text")
+
+    assert bot.dashboards.remove(ADMIN_CHAT) is None
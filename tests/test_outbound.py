@@ -0,0 +1,28 @@
+"""Outbound send queue: per-chat order and budgets without parking workers."""
+import threading
+import time
+
+
+def test_chat_over_budget_does_not_hold_the_only_worker(offline):
+    _, bot, _, _ = offline
+    dispatcher = bot.OutboundDispatcher(workers=1, global_rate=100, global_burst=100,
+                                        chat_rate=2, chat_burst=2)
+    sent, lock = [], threading.Lock()
+
+    def send(label):
+        with lock:
+            sent.append((label, time.monotonic()))
+        return label
+
+    for i in range(4):
+        dispatcher.submit("busy", send, f"busy{i}")
+    quiet = dispatcher.submit("quiet", send, "quiet")
+
+    assert quiet.result(timeout=5) == "quiet"
+    assert dispatcher.wait_idle("busy", 5)
+    labels = [label for label, _ in sent]
+    assert [label for label in labels if label.startswith("busy")] == ["busy0", "busy1", "busy2", "busy3"]
+    # The quiet chat went out while the busy one waited for its tokens.
+    assert labels.index("quiet") < labels.index("busy3")
+    times = dict(sent)
+    assert times["busy3"] - times["busy0"] >= 0.8  # burst of 2, then 2/s
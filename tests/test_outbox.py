@@ -0,0 +1,168 @@
+"""Checkpoint outbox: journalling stays local, replay is ordered and durable."""
+import json
+import threading
+import time
+
+import gspread
+import telebot
+
+
+def _journal(path, *records):
+    """Write a journal as a previous process would have left it."""
+    path.write_text("".join(json.dumps(r) + "\n" for r in records))
+
+
+def _entry(seq, bus, step_key, op="c", row=50, tab="D5"):
+    return {"s": seq, "o": op, "t": tab, "r": row, "k": step_key, "b": bus, "h": "08:00", "w": 0}
+
+
+def _message(updates, chat_id, text):
+    return telebot.types.Message.de_json(json.loads(updates.message(chat_id, text))["message"])
+
+
+def test_checkpoint_journals_without_waiting_for_a_slow_header(offline, bus_session, updates, monkeypatch):
+    _, bot, _, telegram = offline
+    worksheet = bot.get_worksheet(bot.GSHEET_TAB)
+    bot.get_schema(worksheet).checked_at = 0  # due for a recheck
+    release = threading.Event()
+    row_values = gspread.Worksheet.row_values
+
+    def slow_row_values(self, *args, **kwargs):
+        release.wait(5)
+        return row_values(self, *args, **kwargs)
+
+    monkeypatch.setattr(gspread.Worksheet, "row_values", slow_row_values)
+    step_key = bot.steps[0]
+    bot.user_sessions[bus_session]["awaiting_passenger_count_step"] = step_key
+    backlog = bot.outbox.backlog()
+    try:
+        started = time.monotonic()
+        bot.handle_passenger_count_after_step(_message(updates, bus_session, "40"))
+        elapsed = time.monotonic() - started
+        assert elapsed < 1
+        assert bot.outbox.backlog() == backlog + 1
+        assert bot.user_sessions[bus_session]["step_index"] == 1
+        bot.outbound.wait_idle(bus_session, 5)
+        replies = telegram.sent[bus_session]
+        assert "✅ Checkpoint recorded. It will sync to the sheet shortly." in replies
+        assert not any(r.startswith("⏳ Uploading") for r in replies)
+    finally:
+        release.set()
+        assert bot.outbox.drain(10)
+
+
+def test_rebuild_lays_pending_entries_over_the_sheet(offline, tmp_path, monkeypatch):
+    _, bot, _, _ = offline
+    first, second = bot.steps[:2]
+    _journal(tmp_path / "outbox.jsonl",
+             _entry(1, "Z9", first), _entry(2, "Z9", second), _entry(3, "Z9", second, op="x"))
+    outbox = bot.Outbox(str(tmp_path / "outbox.jsonl"))  # not started: nothing replays
+    monkeypatch.setattr(bot, "outbox", outbox)
+    try:
+        bot.rebuild_fleet_progress([bot.GSHEET_TAB], force=True)
+        _, _, at_step = bot.fleet_progress.for_tab(bot.GSHEET_TAB).summary()
+        assert "Z9" in at_step[0]
+        assert "Z9" not in at_step[1]
+    finally:
+        outbox._file.close()
+        monkeypatch.undo()
+        bot.rebuild_fleet_progress([bot.GSHEET_TAB], force=True)
+
+
+def _reopen(bot, path, opened):
+    """Open the journal the way a restarted process would (closing any earlier handle)."""
+    _close(opened)
+    outbox = bot.Outbox(str(path))
+    opened.append(outbox)
+    return outbox
+
+
+def _close(outboxes):
+    while outboxes:
+        outboxes.pop()._file.close()
+
+
+def _pending(outbox):
+    return [e["s"] for e in outbox.pending_for("D5")]
+
+
+def test_reload_skips_a_torn_last_line(offline, tmp_path):
+    _, bot, _, _ = offline
+    path, opened = tmp_path / "outbox.jsonl", []
+    _journal(path, _entry(1, "Z1", bot.steps[0]), _entry(2, "Z1", bot.steps[1]))
+    with open(path, "a") as f:
+        f.write('{"s":3,"o":"c","t":"D5","r":5')  # crash mid-append
+    try:
+        assert _pending(_reopen(bot, path, opened)) == [1, 2]
+        assert path.read_bytes().endswith(b"\n")
+        assert _pending(_reopen(bot, path, opened)) == [1, 2]
+    finally:
+        _close(opened)
+
+
+def test_acked_entries_are_not_replayed_after_a_restart(offline, tmp_path):
+    _, bot, _, _ = offline
+    path, opened = tmp_path / "outbox.jsonl", []
+    _journal(path, _entry(1, "Z1", bot.steps[0]), _entry(2, "Z1", bot.steps[1]), {"a": 1})
+    try:
+        outbox = _reopen(bot, path, opened)
+        assert _pending(outbox) == [2]
+        assert outbox._seq == 2  # new entries keep counting up
+    finally:
+        _close(opened)
+
+
+def test_compaction_keeps_only_pending_entries(offline, tmp_path):
+    _, bot, _, _ = offline
+    path, opened = tmp_path / "outbox.jsonl", []
+    _journal(path, *(_entry(s, "Z1", bot.steps[s - 1]) for s in (1, 2, 3)), {"a": 1}, {"a": 2})
+    try:
+        outbox = _reopen(bot, path, opened)
+        with outbox._cond:
+            outbox._compact()
+        assert [json.loads(line)["s"] for line in path.read_text().splitlines()] == [3]
+        assert _pending(_reopen(bot, path, opened)) == [3]
+    finally:
+        _close(opened)
+
+
+def _cells(bot, row, step_key):
+    worksheet = bot.get_worksheet(bot.GSHEET_TAB)
+    cols = bot.get_schema(worksheet).step(step_key)
+    values = worksheet.row_values(row) + [""] * cols.remark
+    return values[cols.time - 1], values[cols.tele - 1]
+
+
+def test_entries_are_applied_in_order(offline, tmp_path):
+    _, bot, _, _ = offline
+    path, opened = tmp_path / "outbox.jsonl", []
+    first, second = bot.steps[:2]
+    # Checkpoint, undo and redo the first step; checkpoint then undo the second.
+    _journal(path, _entry(1, "Z2", first, row=60), _entry(2, "Z2", first, op="x", row=60),
+             {**_entry(3, "Z2", first, row=60), "h": "09:15"},
+             _entry(4, "Z2", second, row=60), _entry(5, "Z2", second, op="x", row=60))
+    try:
+        outbox = _reopen(bot, path, opened)
+        outbox.start()
+        assert outbox.drain(10)
+        assert _cells(bot, 60, first) == ("09:15", "TRUE")
+        assert _cells(bot, 60, second) == ("", "")
+    finally:
+        _close(opened)
+
+
+def test_refused_entry_is_dead_lettered_and_the_rest_applied(offline, tmp_path):
+    _, bot, _, _ = offline
+    path, opened = tmp_path / "outbox.jsonl", []
+    step_key = bot.steps[0]
+    _journal(path, _entry(1, "Z3", "no_such_step", row=70), {**_entry(2, "Z3", step_key, row=70), "h": "10:30"})
+    try:
+        outbox = _reopen(bot, path, opened)
+        outbox.start()
+        assert outbox.drain(10)
+        failed = [json.loads(line) for line in (tmp_path / "outbox.jsonl.failed").read_text().splitlines()]
+        assert [e["s"] for e in failed] == [1]
+        assert "error" in failed[0]
+        assert _cells(bot, 70, step_key)[0] == "10:30"
+    finally:
+        _close(opened)
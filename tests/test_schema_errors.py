@@ -0,0 +1,68 @@
+"""A header the bot can't map must stop the step, not be reported as saved."""
+import json
+
+import telebot
+
+STEP = 0
+
+
+def _break_header(bot, step_key):
+    # Drop the step's Tele column so SheetSchema.step() refuses it.
+    header = bot.get_worksheet(bot.GSHEET_TAB).row_values(1)
+    time_col = header.index(bot.step_to_column[step_key])
+    del header[time_col + 1]
+    bot.observe_header(bot.GSHEET_TAB, header)
+
+
+def _message(updates, chat_id, text):
+    return telebot.types.Message.de_json(json.loads(updates.message(chat_id, text))["message"])
+
+
+def _replies(bot, telegram, chat_id):
+    bot.outbound.wait_idle(chat_id, 5)
+    return telegram.sent[chat_id]
+
+
+def test_checkpoint_does_not_advance_on_schema_error(offline, bus_session, updates, monkeypatch):
+    _, bot, _, telegram = offline
+    monkeypatch.setattr(bot, "outbox", None)
+    step_key = bot.steps[STEP]
+    _break_header(bot, step_key)
+    bot.user_sessions[bus_session]["awaiting_passenger_count_step"] = step_key
+
+    bot.handle_passenger_count_after_step(_message(updates, bus_session, "40"))
+
+    session = bot.user_sessions[bus_session]
+    assert session["step_index"] == STEP
+    assert session["awaiting_passenger_count_step"] == step_key
+    replies = _replies(bot, telegram, bus_session)
+    assert any(r.startswith("❌ Failed to save checkpoint") for r in replies)
+    assert "✅ Checkpoint successfully saved." not in replies
+
+
+def test_go_back_does_not_move_back_on_schema_error(offline, bus_session, updates, monkeypatch):
+    _, bot, _, telegram = offline
+    monkeypatch.setattr(bot, "outbox", None)
+    _break_header(bot, bot.steps[STEP])
+    bot.user_sessions[bus_session]["step_index"] = STEP + 1
+
+    bot.process_update_from_webhook(updates.callback(bus_session, "go_back"))
+
+    assert bot.user_sessions[bus_session]["step_index"] == STEP + 1
+    assert any(r.startswith("❌ Couldn't undo") for r in _replies(bot, telegram, bus_session))
+
+
+def test_outbox_refuses_to_journal_on_schema_error(offline, bus_session, updates):
+    _, bot, _, telegram = offline
+    step_key = bot.steps[STEP]
+    _break_header(bot, step_key)
+    bot.user_sessions[bus_session]["awaiting_passenger_count_step"] = step_key
+    backlog = bot.outbox.backlog()
+    progress = bot.fleet_progress.for_tab(bot.GSHEET_TAB).summary()
+
+    bot.handle_passenger_count_after_step(_message(updates, bus_session, "40"))
+
+    assert bot.outbox.backlog() == backlog
+    assert bot.user_sessions[bus_session]["step_index"] == STEP
+    assert bot.fleet_progress.for_tab(bot.GSHEET_TAB).summary() == progress
+    assert any(r.startswith("❌ Failed to save checkpoint") for r in _replies(bot, telegram, bus_session))
@@ -0,0 +1,33 @@
+"""Which Sheets failures count against the circuit breaker, and how often."""
+import gspread
+import requests
+
+
+def _api_error(status):
+    response = requests.Response()
+    response.status_code = status
+    response._content = b'{"error": {"code": %d, "message": "x", "status": "x"}}' % status
+    return gspread.exceptions.APIError(response)
+
+
+def test_only_network_and_server_errors_are_transient(offline):
+    _, bot, _, _ = offline
+    assert bot._is_transient(requests.exceptions.ConnectionError())
+    for status in (408, 429, 500, 503):
+        assert bot._is_transient(_api_error(status))
+    assert not bot._is_transient(_api_error(400))
+    assert not bot._is_transient(gspread.exceptions.WorksheetNotFound("D6"))
+    assert not bot._is_transient(gspread.exceptions.GSpreadException("bad range"))
+
+
+def test_shared_batch_error_counts_once(offline):
+    _, bot, _, _ = offline
+    breaker = bot.CircuitBreaker(threshold=2, cooldown=30)
+    error = _api_error(503)
+    for _ in range(3):  # three writers waiting on the same failed flush
+        breaker.record_failure(error)
+    assert breaker.failures == 1
+    assert not breaker.is_open()
+
+    breaker.record_failure(_api_error(503))
+    assert breaker.is_open()
@@ -0,0 +1,39 @@
+"""Recordings survive restarts: no appending, offsets on one clock."""
+import json
+
+from traffic_log import TrafficRecorder, read_log
+
+
+def _update(update_id):
+    return json.dumps({"update_id": update_id, "message": {
+        "message_id": update_id, "chat": {"id": 42, "type": "private"}, "text": "A1"}})
+
+
+def test_restart_rotates_to_a_new_file(tmp_path):
+    path = tmp_path / "traffic.jsonl.gz"
+    for run in range(2):
+        recorder = TrafficRecorder(str(path))
+        recorder.record(_update(run))
+        recorder.close()
+
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["traffic.1.jsonl.gz", "traffic.jsonl.gz"]
+    for name, update_id in (("traffic.jsonl.gz", 0), ("traffic.1.jsonl.gz", 1)):
+        header, events = read_log(str(tmp_path / name))
+        assert header["v"] == 1
+        assert [u["update_id"] for _, u in events] == [update_id]
+
+
+def test_read_log_puts_appended_sessions_on_one_clock(tmp_path):
+    path = tmp_path / "old.jsonl"
+    path.write_text("\n".join(json.dumps(e) for e in (
+        {"v": 1, "started": 1000, "admins": [7]},
+        {"t": 2.0, "u": {"update_id": 1}},
+        {"t": 9.0, "u": {"update_id": 2}},
+        {"v": 1, "started": 1005, "admins": [8]},
+        {"t": 1.0, "u": {"update_id": 3}},
+    )) + "\n")
+
+    header, events = read_log(str(path))
+
+    assert header["admins"] == [7, 8]
+    assert events == [(2.0, {"update_id": 1}), (6.0, {"update_id": 3}), (9.0, {"update_id": 2})]
@@ -0,0 +1 @@
+"""Offline tooling: local Sheets/Telegram stand-ins, benchmarks and replay."""
@@ -0,0 +1,210 @@
+"""End-to-end latency benchmark against local Sheets/Telegram stand-ins.
+
+Drives main.app in-process over ASGI with simulated bus ICs and admins,
+so every request goes through the real webhook, dedup, chat locks,
+handlers, sheet writes and outbound sends. Only the network is fake.
+
+    python -m tools.benchmark --buses 40 --admins 3 --sheets-latency 120
+    python -m tools.benchmark --save baseline.json
+    python -m tools.benchmark --baseline baseline.json
+
+Latency is measured per webhook POST and grouped by flow; it includes
+the time the handler waits for its replies to drain (SEND_DRAIN_TIMEOUT).
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+from tools.fakes import Latency, UpdateFactory, install_offline_bot
+from tools.stats import percentile
+
+FLOWS = ("register", "checkpoint", "mismatch", "go_back", "admin_report")
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = defaultdict(list)  # flow -> [ms per webhook POST]
+        self.errors  = defaultdict(int)
+
+    def summary(self):
+        out = {}
+        for flow in FLOWS:
+            s = self.samples.get(flow)
+            if not s:
+                continue
+            out[flow] = {
+                "n":    len(s),
+                "mean": round(statistics.fmean(s), 2),
+                "p50":  round(percentile(s, 50), 2),
+                "p95":  round(percentile(s, 95), 2),
+                "p99":  round(percentile(s, 99), 2),
+                "max":  round(max(s), 2),
+            }
+        return out
+
+
+class Driver:
+    def __init__(self, client, path, recorder, updates, think_ms, rng):
+        self.client   = client
+        self.path     = path
+        self.recorder = recorder
+        self.updates  = updates  # shared, so update_ids stay unique across drivers
+        self.think_ms = think_ms
+        self.rng      = rng
+
+    async def post(self, flow, body):
+        started = time.perf_counter()
+        response = await self.client.post(self.path, content=body,
+                                          headers={"Content-Type": "application/json"})
+        self.recorder.samples[flow].append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            self.recorder.errors[flow] += 1
+
+    async def think(self):
+        if self.think_ms:
+            await asyncio.sleep(self.rng.uniform(0, self.think_ms) / 1000)
+
+    async def say(self, flow, chat_id, text):
+        await self.post(flow, self.updates.message(chat_id, text))
+        await self.think()
+
+    async def tap(self, flow, chat_id, data):
+        await self.post(flow, self.updates.callback(chat_id, data))
+        await self.think()
+
+
+async def run_bus(driver, bot, chat_id, bus_number, checkpoints, mismatch_rate):
+    pax = driver.rng.randint(20, 45)
+    for text in ("/start", bus_number, str(driver.rng.randint(1, 5)), "NP1 NPD",
+                 f"SBS{chat_id % 10000}X", "Alex Tan", "Sam Lee", str(pax)):
+        await driver.say("register", chat_id, text)
+    await driver.tap("register", chat_id, "confirm_details")
+    await driver.tap("register", chat_id, "begin_checklist")
+
+    for i, step_key in enumerate(bot.steps[:checkpoints]):
+        await driver.tap("checkpoint", chat_id, f"yes_{step_key}")
+        if driver.rng.random() < mismatch_rate:
+            pax -= 1
+            await driver.say("mismatch", chat_id, str(pax))
+            await driver.say("mismatch", chat_id, "One youth left with parents")
+        else:
+            await driver.say("checkpoint", chat_id, str(pax))
+        # Occasionally undo and redo the checkpoint just logged.
+        if i and driver.rng.random() < 0.1:
+            await driver.tap("go_back", chat_id, "go_back")
+            await driver.tap("go_back", chat_id, f"yes_{step_key}")
+            await driver.say("go_back", chat_id, str(pax))
+
+
+async def run_admin(driver, chat_id, rounds):
+    await driver.say("admin_report", chat_id, "/start")
+    for _ in range(rounds):
+        await driver.tap("admin_report", chat_id, "admin_list_refresh")
+        await driver.tap("admin_report", chat_id, "admin_report")
+
+
+async def run(args):
+    import httpx
+
+    admin_ids = [900000 + i for i in range(args.admins)]
+    main, bot, sheets, telegram = install_offline_bot(
+        sheets_latency=Latency(args.sheets_latency, args.sheets_latency / 4, args.error_rate, seed=args.seed),
+        telegram_latency=Latency(args.telegram_latency, args.telegram_latency / 4, seed=args.seed),
+        flood_rate=args.flood_rate,
+        admin_ids=admin_ids,
+    )
+    recorder = Recorder()
+    updates  = UpdateFactory()
+    rng      = random.Random(args.seed)
+    path     = f"/{main.BOT_TOKEN}"
+    duplicates = bot.DUPLICATE_UPDATES.labels().value
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        started = time.perf_counter()
+        tasks = []
+        for i in range(args.buses):
+            driver = Driver(client, path, recorder, updates, args.think_ms, random.Random(rng.random()))
+            bus_number = f"{'ABCDEFGH'[i % 8]}{i // 8 + 1}"
+            tasks.append(run_bus(driver, bot, 100000 + i, bus_number,
+                                 args.checkpoints, args.mismatch_rate))
+        for chat_id in admin_ids:
+            driver = Driver(client, path, recorder, updates, args.think_ms * 4, random.Random(rng.random()))
+            tasks.append(run_admin(driver, chat_id, args.admin_rounds))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+    if main.WEBHOOK_QUEUE:
+        # The webhook answered before handling; wait for the real work.
+        await main.drain_update_queue()
+        elapsed = time.perf_counter() - started
+    # Checkpoints answered from the outbox still have to reach the sheet.
+    await main.drain_outbox(timeout=60)
+    if main.ASYNC_WEBHOOK or main.WEBHOOK_QUEUE:
+        await main.shutdown_async_mode()
+
+    return {
+        "config":   {k: v for k, v in vars(args).items() if k not in ("save", "baseline")},
+        "elapsed_s": round(elapsed, 2),
+        "flows":    recorder.summary(),
+        "errors":   dict(recorder.errors),
+        # Every update is sent once, so any drop means the run skipped real work.
+        "dedup_drops": int(bot.DUPLICATE_UPDATES.labels().value - duplicates),
+        "sheets_calls":   dict(sheets.calls),
+        "telegram_calls": dict(telegram.calls),
+    }
+
+
+def print_report(result, baseline=None):
+    print(f"\nElapsed: {result['elapsed_s']}s")
+    print(f"{'flow':<14}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for flow, s in result["flows"].items():
+        line = f"{flow:<14}{s['n']:>6}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}{s['max']:>10.1f}"
+        base = (baseline or {}).get("flows", {}).get(flow)
+        if base and base["p95"]:
+            line += f"   p95 {(s['p95'] - base['p95']) / base['p95'] * 100:+.1f}% vs baseline"
+        print(line)
+    if result["errors"]:
+        print("Non-200 responses:", result["errors"])
+    if result["dedup_drops"]:
+        print(f"INVALID RUN: {result['dedup_drops']} update(s) dropped as duplicates")
+    print("Sheets calls:  ", result["sheets_calls"])
+    print("Telegram calls:", result["telegram_calls"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--buses", type=int, default=20)
+    parser.add_argument("--admins", type=int, default=2)
+    parser.add_argument("--admin-rounds", type=int, default=5)
+    parser.add_argument("--checkpoints", type=int, default=9, help="steps each bus walks through")
+    parser.add_argument("--mismatch-rate", type=float, default=0.1)
+    parser.add_argument("--sheets-latency", type=float, default=80, help="ms per Sheets call")
+    parser.add_argument("--telegram-latency", type=float, default=40, help="ms per Bot API call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Sheets calls failing with 429")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of Bot API calls failing with 429")
+    parser.add_argument("--think-ms", type=float, default=50, help="max pause between a user's actions")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="write the result as JSON to this path")
+    parser.add_argument("--baseline", help="compare p95 against a result saved with --save")
+    args = parser.parse_args(argv)
+
+    result = asyncio.run(run(args))
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+    return 1 if result["dedup_drops"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
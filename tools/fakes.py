@@ -0,0 +1,502 @@
+"""In-process stand-ins for the Google Sheets API and the Telegram Bot API.
+
+FakeSheets is a requests transport adapter that answers the Sheets v4 (and
+the bits of Drive v3) calls gspread makes, so a real gspread.Client can run
+against it. FakeTelegram plugs into telebot.apihelper.CUSTOM_REQUEST_SENDER.
+Both can add latency and fail a share of calls on purpose.
+
+install_offline_bot() wires both into bus_botback and returns main.app, so
+tools can drive the real webhook without touching Google or Telegram.
+"""
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import requests
+from requests.adapters import BaseAdapter
+
+
+class Latency:
+    """Sleeps for latency_ms ± jitter_ms and fails `error_rate` of calls."""
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms  = jitter_ms
+        self.error_rate = error_rate
+        self._random    = random.Random(seed)
+        self._lock      = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            delay = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+    def should_fail(self):
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+
+def _json_response(request, status, payload, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response._content = json.dumps(payload).encode("utf-8")
+    response.headers["Content-Type"] = "application/json; charset=UTF-8"
+    response.headers.update(headers or {})
+    response.encoding = "utf-8"
+    response.url = request.url if request is not None else ""
+    response.request = request
+    return response
+
+
+def _google_error(request, status, message, reason):
+    return _json_response(request, status, {
+        "error": {"code": status, "message": message, "status": reason}})
+
+
+# ─── SHEETS ───────────────────────────────────────────────────────────────────
+
+def _column_number(letters):
+    number = 0
+    for ch in letters.upper():
+        number = number * 26 + (ord(ch) - 64)
+    return number
+
+
+_CELL = re.compile(r"^([A-Za-z]*)(\d*)$")
+
+
+class FakeWorksheet:
+    def __init__(self, title, sheet_id, index, rows=None):
+        self.title    = title
+        self.sheet_id = sheet_id
+        self.index    = index
+        self.grid     = [list(r) for r in (rows or [])]
+        self.formats  = {}  # (row, col), 1-based -> userEnteredFormat
+
+    @property
+    def row_count(self):
+        return max(1000, len(self.grid))
+
+    @property
+    def col_count(self):
+        return max([26] + [len(r) for r in self.grid])
+
+    def properties(self):
+        return {
+            "sheetId": self.sheet_id, "title": self.title, "index": self.index,
+            "sheetType": "GRID",
+            "gridProperties": {"rowCount": self.row_count, "columnCount": self.col_count},
+        }
+
+    def bounds(self, cells):
+        """1-based inclusive (r1, c1, r2, c2) for the part of an A1 range after '!'."""
+        if not cells:
+            return 1, 1, self.row_count, self.col_count
+        start, _, end = cells.partition(":")
+        m1 = _CELL.match(start)
+        c1 = _column_number(m1.group(1)) if m1.group(1) else 1
+        r1 = int(m1.group(2)) if m1.group(2) else 1
+        if not end:
+            if not m1.group(1):          # "3" -> whole row
+                return r1, 1, r1, self.col_count
+            if not m1.group(2):          # "B" -> whole column
+                return 1, c1, self.row_count, c1
+            return r1, c1, r1, c1
+        m2 = _CELL.match(end)
+        c2 = _column_number(m2.group(1)) if m2.group(1) else self.col_count
+        r2 = int(m2.group(2)) if m2.group(2) else self.row_count
+        return r1, c1, r2, c2
+
+    def read(self, r1, c1, r2, c2, by_columns=False):
+        rows = []
+        for r in range(r1, min(r2, len(self.grid)) + 1):
+            row = self.grid[r - 1]
+            rows.append([row[c - 1] if c - 1 < len(row) else "" for c in range(c1, c2 + 1)])
+        if by_columns:
+            width = c2 - c1 + 1 if rows else 0
+            rows = [[row[i] for row in rows] for i in range(width)]
+        # The real API drops trailing blank cells and trailing blank rows.
+        trimmed = []
+        for row in rows:
+            while row and row[-1] == "":
+                row.pop()
+            trimmed.append(row)
+        while trimmed and not trimmed[-1]:
+            trimmed.pop()
+        return trimmed
+
+    def write(self, r1, c1, values):
+        for dr, row_values in enumerate(values):
+            r = r1 + dr
+            while len(self.grid) < r:
+                self.grid.append([])
+            row = self.grid[r - 1]
+            for dc, value in enumerate(row_values):
+                c = c1 + dc
+                while len(row) < c:
+                    row.append("")
+                row[c - 1] = self.display(value)
+        return len(values), max((len(v) for v in values), default=0)
+
+    @staticmethod
+    def display(value):
+        if value is None:
+            return ""
+        if isinstance(value, bool):
+            return "TRUE" if value else "FALSE"
+        return str(value)
+
+
+class FakeSheets(BaseAdapter):
+    """requests adapter serving one spreadsheet's Sheets v4 and Drive v3 calls."""
+    def __init__(self, spreadsheet_id="fake-spreadsheet", title="Fake Spreadsheet",
+                 latency=None):
+        super().__init__()
+        self.spreadsheet_id = spreadsheet_id
+        self.title   = title
+        self.latency = latency or Latency()
+        self.sheets  = {}
+        self.calls   = Counter()
+        self._lock   = threading.Lock()
+        self._ids    = itertools.count(1)
+
+    def add_worksheet(self, title, rows=None):
+        with self._lock:
+            sheet = FakeWorksheet(title, next(self._ids), len(self.sheets), rows)
+            self.sheets[title] = sheet
+            return sheet
+
+    def session(self):
+        """A requests.Session routed to this fake; pass it to gspread.Client."""
+        session = requests.Session()
+        session.mount("https://sheets.googleapis.com", self)
+        session.mount("https://www.googleapis.com", self)
+        return session
+
+    def async_transport(self):
+        """An httpx transport routed to this fake, for bus_botback's AsyncSheetsClient."""
+        import httpx
+
+        async def handle(request):
+            prepared = requests.Request(request.method, str(request.url), headers=dict(request.headers),
+                                        data=request.content or None).prepare()
+            # send() sleeps to simulate latency; keep that off the event loop.
+            response = await asyncio.to_thread(self.send, prepared)
+            return httpx.Response(response.status_code, headers=dict(response.headers),
+                                  content=response.content)
+
+        return httpx.MockTransport(handle)
+
+    def close(self):
+        pass
+
+    # -- dispatch ------------------------------------------------------------
+
+    def send(self, request, **kwargs):
+        self.latency.wait()
+        url    = urlsplit(request.url)
+        query  = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        body   = json.loads(request.body) if request.body else {}
+        path   = url.path
+        if self.latency.should_fail():
+            self.calls["injected_error"] += 1
+            return _google_error(request, 429, "Quota exceeded (injected)", "RESOURCE_EXHAUSTED")
+        try:
+            with self._lock:
+                return self._route(request, request.method, path, query, body)
+        except KeyError as e:
+            return _google_error(request, 400, f"Unable to parse range: {e}", "INVALID_ARGUMENT")
+
+    def _route(self, request, method, path, query, body):
+        if path.startswith("/drive/"):
+            return self._drive(request, path)
+        prefix = f"/v4/spreadsheets/{self.spreadsheet_id}"
+        if not path.startswith(prefix):
+            return _google_error(request, 404, "Requested entity was not found.", "NOT_FOUND")
+        rest = path[len(prefix):]
+
+        if rest == "" and method == "GET":
+            self.calls["metadata"] += 1
+            return _json_response(request, 200, self._metadata())
+        if rest == ":batchUpdate" and method == "POST":
+            self.calls["batchUpdate"] += 1
+            return _json_response(request, 200, self._batch_update(body))
+        if rest == "/values:batchUpdate" and method == "POST":
+            self.calls["values.batchUpdate"] += 1
+            responses = [self._write_range(d["range"], d["values"]) for d in body.get("data", [])]
+            return _json_response(request, 200, {
+                "spreadsheetId": self.spreadsheet_id,
+                "totalUpdatedCells": sum(r["updatedCells"] for r in responses),
+                "responses": responses,
+            })
+        if rest.startswith("/values/"):
+            range_name = unquote(rest[len("/values/"):])
+            if method == "GET":
+                self.calls["values.get"] += 1
+                return _json_response(request, 200, self._read_range(range_name, query))
+            if method == "PUT":
+                self.calls["values.update"] += 1
+                return _json_response(request, 200, self._write_range(range_name, body.get("values", [])))
+        return _google_error(request, 404, f"Unsupported call {method} {path}", "NOT_FOUND")
+
+    def _drive(self, request, path):
+        self.calls["drive"] += 1
+        entry = {"id": self.spreadsheet_id, "name": self.title,
+                 "createdTime": "2026-01-01T00:00:00.000Z", "modifiedTime": "2026-01-01T00:00:00.000Z"}
+        if path.rstrip("/").endswith("/files"):
+            return _json_response(request, 200, {"files": [entry]})
+        return _json_response(request, 200, entry)
+
+    def _metadata(self):
+        return {
+            "spreadsheetId": self.spreadsheet_id,
+            "properties": {"title": self.title, "locale": "en_US", "timeZone": "Asia/Singapore"},
+            "sheets": [{"properties": s.properties()}
+                       for s in sorted(self.sheets.values(), key=lambda s: s.index)],
+        }
+
+    def _resolve(self, range_name):
+        title, bang, cells = range_name.rpartition("!")
+        if not bang:
+            title, cells = range_name, ""
+        if title.startswith("'") and title.endswith("'"):
+            title = title[1:-1].replace("''", "'")
+        return self.sheets[title], cells
+
+    def _read_range(self, range_name, query):
+        sheet, cells = self._resolve(range_name)
+        r1, c1, r2, c2 = sheet.bounds(cells)
+        by_columns = query.get("majorDimension") == "COLUMNS"
+        payload = {"range": range_name, "majorDimension": "COLUMNS" if by_columns else "ROWS"}
+        values = sheet.read(r1, c1, r2, c2, by_columns)
+        if values:
+            payload["values"] = values
+        return payload
+
+    def _write_range(self, range_name, values):
+        sheet, cells = self._resolve(range_name)
+        r1, c1, _, _ = sheet.bounds(cells)
+        rows, cols = sheet.write(r1, c1, values)
+        return {"spreadsheetId": self.spreadsheet_id, "updatedRange": range_name,
+                "updatedRows": rows, "updatedColumns": cols, "updatedCells": rows * cols}
+
+    def _sheet_by_id(self, sheet_id):
+        for sheet in self.sheets.values():
+            if sheet.sheet_id == sheet_id:
+                return sheet
+        raise KeyError(f"No grid with id: {sheet_id}")
+
+    def _batch_update(self, body):
+        replies = []
+        for req in body.get("requests", []):
+            if "repeatCell" in req:
+                spec  = req["repeatCell"]
+                grid  = spec["range"]
+                sheet = self._sheet_by_id(grid.get("sheetId", 0))
+                fmt   = spec.get("cell", {}).get("userEnteredFormat", {})
+                for r in range(grid.get("startRowIndex", 0), grid.get("endRowIndex", 0)):
+                    for c in range(grid.get("startColumnIndex", 0), grid.get("endColumnIndex", 0)):
+                        sheet.formats[(r + 1, c + 1)] = fmt
+            elif "updateCells" in req:
+                self._update_cells(req["updateCells"])
+            replies.append({})
+        return {"spreadsheetId": self.spreadsheet_id, "replies": replies}
+
+    def _update_cells(self, spec):
+        grid   = spec["range"]
+        sheet  = self._sheet_by_id(grid.get("sheetId", 0))
+        fields = {f.strip() for f in spec.get("fields", "").split(",")}
+        r0, c0 = grid.get("startRowIndex", 0), grid.get("startColumnIndex", 0)
+        for dr, row in enumerate(spec.get("rows", [])):
+            for dc, cell in enumerate(row.get("values", [])):
+                r, c = r0 + dr + 1, c0 + dc + 1
+                if "userEnteredValue" in fields:
+                    typed = cell.get("userEnteredValue", {})
+                    value = next(iter(typed.values()), "")
+                    if isinstance(value, float) and value.is_integer():
+                        value = int(value)
+                    sheet.write(r, c, [[value]])
+                if "userEnteredFormat.backgroundColor" in fields:
+                    fmt = dict(sheet.formats.get((r, c), {}))
+                    fmt["backgroundColor"] = cell.get("userEnteredFormat", {}).get("backgroundColor")
+                    sheet.formats[(r, c)] = fmt
+
+
+# ─── TELEGRAM ─────────────────────────────────────────────────────────────────
+
+class FakeTelegram:
+    """Answers Bot API calls for telebot through CUSTOM_REQUEST_SENDER."""
+    def __init__(self, latency=None, flood_rate=0.0, retry_after=1):
+        self.latency     = latency or Latency()
+        self.flood_rate  = flood_rate
+        self.retry_after = retry_after
+        self.calls       = Counter()
+        self.sent        = defaultdict(list)  # chat_id -> texts sent or edited in
+        self._texts      = {}                 # (chat_id, message_id) -> current text
+        self._ids        = itertools.count(1000)
+        self._lock       = threading.Lock()
+        self._random     = random.Random(0)
+
+    def install(self):
+        import telebot.apihelper
+        telebot.apihelper.CUSTOM_REQUEST_SENDER = self.request
+
+    def request(self, method, url, params=None, files=None, timeout=None, proxies=None, **kwargs):
+        self.latency.wait()
+        api_method = url.rsplit("/", 1)[-1]
+        params = dict(params or {})
+        with self._lock:
+            self.calls[api_method] += 1
+            flooded = self.flood_rate > 0 and self._random.random() < self.flood_rate
+        if flooded:
+            return self._reply(429, {
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after}})
+        if self.latency.should_fail():
+            return self._reply(500, {"ok": False, "error_code": 500,
+                                     "description": "Internal Server Error (injected)"})
+        handler = getattr(self, f"_{api_method}", None)
+        if handler is None:
+            return self._reply(200, {"ok": True, "result": True})
+        return handler(params)
+
+    def _reply(self, status, payload):
+        return _json_response(None, status, payload)
+
+    def _message(self, chat_id, message_id, text):
+        return {"message_id": message_id, "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": 1, "is_bot": True, "first_name": "Bus Bot"},
+                "text": text}
+
+    def _sendMessage(self, params):
+        chat_id = int(params["chat_id"])
+        text    = params.get("text", "")
+        with self._lock:
+            message_id = next(self._ids)
+            self._texts[(chat_id, message_id)] = text
+            self.sent[chat_id].append(text)
+        return self._reply(200, {"ok": True, "result": self._message(chat_id, message_id, text)})
+
+    def _sendDocument(self, params):
+        chat_id = int(params["chat_id"])
+        with self._lock:
+            message_id = next(self._ids)
+            self.sent[chat_id].append("<document>")
+        result = self._message(chat_id, message_id, "")
+        result["document"] = {"file_id": f"doc{message_id}", "file_unique_id": f"u{message_id}"}
+        return self._reply(200, {"ok": True, "result": result})
+
+    def _editMessageText(self, params):
+        chat_id    = int(params["chat_id"])
+        message_id = int(params["message_id"])
+        text       = params.get("text", "")
+        with self._lock:
+            if self._texts.get((chat_id, message_id)) == text:
+                return self._reply(400, {
+                    "ok": False, "error_code": 400,
+                    "description": "Bad Request: message is not modified"})
+            self._texts[(chat_id, message_id)] = text
+            self.sent[chat_id].append(text)
+        return self._reply(200, {"ok": True, "result": self._message(chat_id, message_id, text)})
+
+
+# ─── WIRING ───────────────────────────────────────────────────────────────────
+
+BOT_TOKEN      = "123456:OFFLINE-TOKEN"
+SPREADSHEET_ID = "offline-spreadsheet"
+TAB            = "D5"
+
+
+class OfflineCredentials:
+    """Always-valid stand-in for google-auth credentials."""
+    valid = True
+    token = "offline-token"
+
+
+def bus_sheet_header(step_columns):
+    """Header row in the layout the bot expects: details, then time/tele/remarks per step."""
+    header = ["Wave", "Bus #", "Bus Plate", "No. of Pax", "Bus IC", "Bus 2IC", "CGs", "Username"]
+    for column in step_columns:
+        header += [column, "Tele", "Remarks"]
+    return header
+
+
+def install_offline_bot(sheets_latency=None, telegram_latency=None, flood_rate=0.0,
+                        admin_ids=(), env=None):
+    """Point bus_botback and main at local stand-ins and import them.
+
+    Must run before anything imports bus_botback. Returns (main module,
+    bus_botback module, FakeSheets, FakeTelegram).
+    """
+    state_dir = tempfile.mkdtemp(prefix="busbot-offline-")
+    defaults = {
+        "TELE_TOKEN":      BOT_TOKEN,
+        "WEBHOOK_URL":     "http://offline.invalid",
+        "GSHEET_KEY":      SPREADSHEET_ID,
+        "GSHEET_TAB":      TAB,
+        "ADMIN_IDS":       ",".join(str(a) for a in admin_ids),
+        "SESSION_DB_PATH": os.path.join(state_dir, "sessions.db"),
+        "OUTBOX_PATH":     os.path.join(state_dir, "outbox.jsonl"),
+    }
+    defaults.update(env or {})
+    os.environ.update(defaults)
+
+    telegram = FakeTelegram(telegram_latency, flood_rate=flood_rate)
+    telegram.install()
+
+    import gspread
+    import bus_botback
+    import main
+
+    sheets = FakeSheets(SPREADSHEET_ID, bus_botback.GSHEET_NAME, sheets_latency)
+    sheets.add_worksheet(bus_botback.GSHEET_TAB,
+                         [bus_sheet_header(bus_botback.step_to_column[s] for s in bus_botback.steps)])
+    bus_botback.configure_sheets_client(gspread.Client(None, session=sheets.session()))
+    bus_botback.configure_async_sheets(
+        bus_botback.AsyncSheetsClient(OfflineCredentials(), transport=sheets.async_transport()))
+    bus_botback.warm_up()
+    return main, bus_botback, sheets, telegram
+
+
+class UpdateFactory:
+    """Builds Telegram update JSON bodies with increasing update_ids."""
+    def __init__(self, start=1):
+        self._ids = itertools.count(start)
+        self._message_ids = itertools.count(1)
+
+    def message(self, chat_id, text, username=None):
+        return json.dumps({
+            "update_id": next(self._ids),
+            "message": {
+                "message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Offline",
+                         "username": username or f"user{chat_id}"},
+                "text": text,
+            },
+        })
+
+    def callback(self, chat_id, data, message_id=1):
+        return json.dumps({
+            "update_id": next(self._ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)), "chat_instance": str(chat_id), "data": data,
+                "from": {"id": chat_id, "is_bot": False, "first_name": "Offline"},
+                "message": {
+                    "message_id": message_id, "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"},
+                    "from": {"id": 1, "is_bot": True, "first_name": "Bus Bot"},
+                    "text": "",
+                },
+            },
+        })
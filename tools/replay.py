@@ -0,0 +1,142 @@
+"""Replay a recorded event day into main.app against local stand-ins.
+
+Updates are posted at their recorded offsets divided by --speed, each on
+its own task, so bursts (everyone tapping "reached MY customs" within a
+minute) arrive as bursts. Record with WEBHOOK_RECORD_PATH; see traffic_log.py.
+
+    python -m tools.replay day1.jsonl.gz                 # real time
+    python -m tools.replay day1.jsonl.gz --speed 20      # 20x faster
+    python -m tools.replay day1.jsonl.gz --speed 20 --save run.json
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from collections import defaultdict
+
+from tools.fakes import Latency, install_offline_bot
+from tools.stats import percentile
+from traffic_log import read_log
+
+
+def classify(update):
+    """Group label for an update: a command, a callback prefix or plain text."""
+    if "callback_query" in update:
+        data = update["callback_query"].get("data", "")
+        if data.startswith("yes_"):
+            return "cb:yes"
+        if data.startswith("cb_"):
+            return "cb:bus_detail"
+        return f"cb:{data}"
+    text = update.get("message", {}).get("text", "")
+    if text.startswith("/"):
+        return text.split()[0].split("@")[0]
+    return "text"
+
+
+async def replay(events, main, speed, window):
+    import httpx
+
+    path      = f"/{main.BOT_TOKEN}"
+    samples   = defaultdict(list)
+    errors    = defaultdict(int)
+    in_flight = peak = 0
+    per_window = defaultdict(int)
+
+    async def post(client, label, body):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        started = time.perf_counter()
+        try:
+            response = await client.post(path, content=body,
+                                         headers={"Content-Type": "application/json"})
+            if response.status_code != 200:
+                errors[label] += 1
+        finally:
+            in_flight -= 1
+            samples[label].append((time.perf_counter() - started) * 1000)
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay") as client:
+        loop   = asyncio.get_running_loop()
+        origin = loop.time()
+        first  = events[0][0] if events else 0
+        tasks  = []
+        for offset, update in events:
+            due = (offset - first) / speed
+            delay = origin + due - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            label = classify(update)
+            per_window[int((offset - first) // window)] += 1
+            body = json.dumps(update, separators=(",", ":"))
+            tasks.append(asyncio.create_task(post(client, label, body)))
+        await asyncio.gather(*tasks)
+        if main.WEBHOOK_QUEUE:
+            await main.drain_update_queue()
+        elapsed = loop.time() - origin
+    await main.drain_outbox(timeout=60)
+    if main.ASYNC_WEBHOOK or main.WEBHOOK_QUEUE:
+        await main.shutdown_async_mode()
+
+    busiest = max(per_window.items(), key=lambda kv: kv[1]) if per_window else (0, 0)
+    return {
+        "updates":   len(events),
+        "elapsed_s": round(elapsed, 2),
+        "peak_in_flight": peak,
+        "busiest_window": {"start_s": busiest[0] * window, "updates": busiest[1], "window_s": window},
+        "latency_ms": {
+            label: {"n": len(s), "p50": round(percentile(s, 50), 2),
+                    "p95": round(percentile(s, 95), 2), "p99": round(percentile(s, 99), 2),
+                    "max": round(max(s), 2)}
+            for label, s in sorted(samples.items())
+        },
+        "errors": dict(errors),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("recording", help="file written via WEBHOOK_RECORD_PATH (.jsonl or .jsonl.gz)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay N times faster than recorded")
+    parser.add_argument("--sheets-latency", type=float, default=80, help="ms per Sheets call")
+    parser.add_argument("--telegram-latency", type=float, default=40, help="ms per Bot API call")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of Sheets calls failing with 429")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of Bot API calls failing with 429")
+    parser.add_argument("--window", type=float, default=60, help="seconds per bucket for the busiest-window stat")
+    parser.add_argument("--save", help="write the result as JSON to this path")
+    args = parser.parse_args(argv)
+
+    header, events = read_log(args.recording)
+    if not events:
+        print("No updates in", args.recording)
+        return 1
+    main_module, _, sheets, telegram = install_offline_bot(
+        sheets_latency=Latency(args.sheets_latency, args.sheets_latency / 4, args.error_rate),
+        telegram_latency=Latency(args.telegram_latency, args.telegram_latency / 4),
+        flood_rate=args.flood_rate,
+        admin_ids=header.get("admins", ()),
+    )
+    result = asyncio.run(replay(events, main_module, args.speed, args.window))
+    result["sheets_calls"]   = dict(sheets.calls)
+    result["telegram_calls"] = dict(telegram.calls)
+
+    print(f"Replayed {result['updates']} updates in {result['elapsed_s']}s "
+          f"(x{args.speed}); peak in flight {result['peak_in_flight']}")
+    w = result["busiest_window"]
+    print(f"Busiest {w['window_s']:g}s window at +{w['start_s']:g}s: {w['updates']} updates")
+    print(f"{'update':<24}{'n':>6}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for label, s in result["latency_ms"].items():
+        print(f"{label:<24}{s['n']:>6}{s['p50']:>10.1f}{s['p95']:>10.1f}{s['p99']:>10.1f}{s['max']:>10.1f}")
+    if result["errors"]:
+        print("Non-200 responses:", result["errors"])
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
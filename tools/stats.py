@@ -0,0 +1,10 @@
+"""Small helpers shared by the benchmark, replay and trace tools."""
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of `samples` (0.0 for no samples)."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    k = max(0, min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[k]
@@ -0,0 +1,143 @@
+"""Summarise a TRACE_PATH file written by tracing.py.
+
+    python -m tools.traceview traces.jsonl                 # span table + slowest traces
+    python -m tools.traceview traces.jsonl --chat 12345    # only that chat's updates
+    python -m tools.traceview traces.jsonl --trace 9f1c…   # one trace as a tree
+
+For each slow trace the breakdown splits the root's time into lock waits,
+Sheets calls, retry backoff, batch waits and Telegram sends, which answers
+"where did those 10 seconds go" without reading the tree.
+"""
+import argparse
+import json
+import sys
+from collections import defaultdict
+
+from tools.stats import percentile
+
+CATEGORIES = (
+    ("lock wait",   lambda n: n.startswith("wait.")),
+    ("sheets",      lambda n: n.startswith("sheets.")),
+    ("retry sleep", lambda n: n == "retry_backoff"),
+    ("batch wait",  lambda n: n == "checkpoint_batch_wait"),
+    ("telegram",    lambda n: n.startswith("telegram.")),
+    ("send drain",  lambda n: n == "send_drain"),
+)
+
+
+def load(path):
+    traces = defaultdict(list)
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                traces[span["trace"]].append(span)
+    return traces
+
+
+def root_of(spans):
+    return next((s for s in spans if s["parent"] is None), None)
+
+
+def chat_of(spans):
+    root = root_of(spans)
+    return (root or {}).get("attrs", {}).get("chat_id")
+
+
+def breakdown(spans):
+    """Milliseconds per category, counting only the outermost matching span."""
+    by_id = {s["span"]: s for s in spans}
+    totals = defaultdict(float)
+    for span in spans:
+        category = next((c for c, match in CATEGORIES if match(span["name"])), None)
+        if category is None:
+            continue
+        # Skip spans nested in another span of the same category (e.g. a
+        # Sheets call inside a retry-wrapped Sheets function).
+        parent, nested = by_id.get(span["parent"]), False
+        while parent is not None:
+            if next((c for c, match in CATEGORIES if match(parent["name"])), None) == category:
+                nested = True
+                break
+            parent = by_id.get(parent["parent"])
+        if not nested:
+            totals[category] += span["ms"]
+    return totals
+
+
+def print_tree(spans):
+    children = defaultdict(list)
+    for span in spans:
+        children[span["parent"]].append(span)
+    origin = min(s["start"] for s in spans)
+
+    def walk(parent_id, depth):
+        for span in sorted(children[parent_id], key=lambda s: s["start"]):
+            attrs = " ".join(f"{k}={v}" for k, v in span.get("attrs", {}).items())
+            error = f"  !! {span['error']}" if span.get("error") else ""
+            offset = (span["start"] - origin) * 1000
+            print(f"{offset:>9.1f} {span['ms']:>9.1f}  {'  ' * depth}{span['name']}  {attrs}{error}")
+            walk(span["span"], depth + 1)
+
+    print(f"{'+ms':>9} {'ms':>9}  span")
+    walk(None, 0)
+    # Spans whose parent was never written (e.g. the process stopped mid-trace).
+    known = {s["span"] for s in spans}
+    for span in spans:
+        if span["parent"] is not None and span["parent"] not in known:
+            walk(span["parent"], 0)
+            known.add(span["parent"])
+
+
+def print_summary(traces, slowest):
+    durations = defaultdict(list)
+    for spans in traces.values():
+        for span in spans:
+            durations[span["name"]].append(span["ms"])
+
+    print(f"{'span':<40}{'n':>7}{'p50':>10}{'p95':>10}{'max':>10}{'total s':>10}")
+    for name, values in sorted(durations.items(), key=lambda kv: -sum(kv[1])):
+        print(f"{name:<40}{len(values):>7}{percentile(values, 50):>10.1f}"
+              f"{percentile(values, 95):>10.1f}{max(values):>10.1f}{sum(values) / 1000:>10.2f}")
+
+    rooted = [(root_of(spans), spans) for spans in traces.values()]
+    rooted = sorted((r for r in rooted if r[0]), key=lambda r: -r[0]["ms"])[:slowest]
+    if not rooted:
+        return
+    print(f"\nSlowest {len(rooted)} updates:")
+    header = "".join(f"{c:>13}" for c, _ in CATEGORIES)
+    print(f"{'trace':<18}{'chat':>14}{'route':>24}{'total':>10}{header}")
+    for root, spans in rooted:
+        route = next((s.get("attrs", {}).get("route") for s in spans if s["name"] == "dispatch"), "") or ""
+        totals = breakdown(spans)
+        cells = "".join(f"{totals.get(c, 0):>13.1f}" for c, _ in CATEGORIES)
+        print(f"{root['trace']:<18}{str(chat_of(spans) or ''):>14}{route[:23]:>24}{root['ms']:>10.1f}{cells}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path", help="file written via TRACE_PATH")
+    parser.add_argument("--trace", help="print one trace (ID or unique prefix) as a tree")
+    parser.add_argument("--chat", type=int, help="only traces for this chat ID")
+    parser.add_argument("--slowest", type=int, default=15, help="how many slow updates to list")
+    args = parser.parse_args(argv)
+
+    traces = load(args.path)
+    if args.chat is not None:
+        traces = {t: spans for t, spans in traces.items() if chat_of(spans) == args.chat}
+    if args.trace:
+        matches = [t for t in traces if t.startswith(args.trace)]
+        if len(matches) != 1:
+            print(f"{len(matches)} traces match {args.trace!r}")
+            return 1
+        print_tree(traces[matches[0]])
+        return 0
+    if not traces:
+        print("No traces found.")
+        return 1
+    print_summary(traces, args.slowest)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
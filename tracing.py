@@ -0,0 +1,143 @@
+"""Opt-in per-update tracing with a local JSONL exporter.
+
+Set TRACE_PATH to turn it on. main.py starts one trace per webhook request;
+code underneath opens child spans with `span()`. The current span lives in a
+contextvar, so it follows the code across `await`, and across threads when
+work is submitted with `bind()` (executors) or when a worker passes an
+explicit `parent=` it captured at submit time (batcher, outbound queue).
+
+Each finished span is one line:
+
+    {"trace": "...", "span": "...", "parent": "...", "name": "sheets.log_checkpoint_to_sheet",
+     "start": 1767225600.123, "ms": 412.7, "thread": "dispatch_3", "attrs": {"attempt": 2}}
+
+Summarise a file with `python -m tools.traceview TRACE_PATH`.
+With TRACE_PATH unset every helper here is a cheap no-op.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+
+TRACE_PATH = os.getenv("TRACE_PATH", "").strip()
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start", "attrs", "error")
+
+    def __init__(self, name, trace_id, parent_id=None, attrs=None):
+        self.trace_id  = trace_id
+        self.span_id   = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name      = name
+        self.start     = time.time()
+        self.attrs     = dict(attrs or {})
+        self.error     = None
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class JsonlExporter:
+    def __init__(self, path):
+        self.path  = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def export(self, span, duration):
+        entry = {
+            "trace": span.trace_id, "span": span.span_id, "parent": span.parent_id,
+            "name": span.name, "start": round(span.start, 6), "ms": round(duration * 1000, 3),
+            "thread": threading.current_thread().name,
+        }
+        if span.attrs:
+            entry["attrs"] = span.attrs
+        if span.error:
+            entry["error"] = span.error
+        line = json.dumps(entry, separators=(",", ":"), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+
+_exporter = JsonlExporter(TRACE_PATH) if TRACE_PATH else None
+
+
+def enabled():
+    return _exporter is not None
+
+
+def configure(path):
+    """Start (or with a falsy `path`, stop) exporting spans to `path`."""
+    global _exporter
+    _exporter = JsonlExporter(path) if path else None
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def _run(span):
+    token   = _current.set(span)
+    started = time.perf_counter()
+    try:
+        yield span
+    except BaseException as e:
+        span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.reset(token)
+        exporter = _exporter
+        if exporter is not None:
+            exporter.export(span, time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def start_trace(name, **attrs):
+    """Open a root span with a fresh trace ID."""
+    if _exporter is None:
+        yield None
+        return
+    with _run(Span(name, secrets.token_hex(8), None, attrs)) as span:
+        yield span
+
+
+@contextlib.contextmanager
+def span(name, parent=None, **attrs):
+    """Open a child of `parent` (default: the current span). No-op outside a trace."""
+    parent = parent or _current.get()
+    if _exporter is None or parent is None:
+        yield None
+        return
+    with _run(Span(name, parent.trace_id, parent.span_id, attrs)) as child:
+        yield child
+
+
+def record(name, parent, started_at, duration, **attrs):
+    """Export an already-timed span under `parent` (for work shared by several traces)."""
+    exporter = _exporter
+    if exporter is None or parent is None:
+        return
+    finished = Span(name, parent.trace_id, parent.span_id, attrs)
+    finished.start = started_at
+    exporter.export(finished, duration)
+
+
+def bind(func):
+    """Wrap `func` to run in a copy of the caller's context (for executors)."""
+    if _exporter is None:
+        return func
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+
+def set_attrs(**attrs):
+    span = _current.get()
+    if span is not None:
+        span.set(**attrs)
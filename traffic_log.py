@@ -0,0 +1,201 @@
+"""Opt-in recorder for incoming webhook traffic.
+
+Each update is written as one compact JSON line with its arrival offset,
+so a real event day can be replayed later with tools/replay.py. Chat and
+user IDs are replaced with stable per-recording pseudonyms, names and
+usernames are dropped, and free text that looks like a person's name is
+swapped for a fake one of the same shape. Bus numbers, plates, pax counts
+and button presses are kept — the replay needs them to walk the same flows.
+
+Enable with WEBHOOK_RECORD_PATH (".gz" suffix for gzip). The pseudonym key
+comes from WEBHOOK_RECORD_SALT, or is random per process. Offsets and (without
+a salt) pseudonyms start over with each process, so an existing recording is
+never appended to: a restart writes to the next free name instead
+(traffic.jsonl.gz, then traffic.1.jsonl.gz, ...). Updates are sanitized and
+written on a background thread, off the webhook's event loop.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+
+FORMAT_VERSION = 1
+
+_NAME_LIKE = re.compile(r"[A-Za-z\s\-]+")
+_SYLLABLES = ("ka", "lo", "mi", "ne", "ru", "sa", "ti", "vo", "ze", "ha", "jo", "pe")
+
+
+def open_log(path, mode):
+    """Open a traffic log for text I/O, gzip-compressed when it ends in .gz."""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def fresh_path(path):
+    """`path`, or the first numbered variant of it that doesn't exist yet."""
+    root, ext = os.path.splitext(path)
+    if ext == ".gz":
+        root, inner = os.path.splitext(root)
+        ext = inner + ext
+    candidate, n = path, 0
+    while os.path.exists(candidate):
+        n += 1
+        candidate = f"{root}.{n}{ext}"
+    return candidate
+
+
+def read_log(path):
+    """Return (header, [(offset_seconds, update_dict), ...]) from a recording.
+
+    Recordings made before restarts were rotated may hold several headers,
+    each starting its offsets over. Those offsets are moved onto the first
+    header's clock using each header's wall-clock `started`, and the events
+    sorted.
+    """
+    header, events, base = {}, [], 0
+    with open_log(path, "r") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "v" in entry:
+                if not header:
+                    header = dict(entry)
+                else:
+                    base = entry.get("started", 0) - header.get("started", 0)
+                    header["admins"] = list(dict.fromkeys(header.get("admins", []) + entry.get("admins", [])))
+            else:
+                events.append((round(entry["t"] + base, 3), entry["u"]))
+    events.sort(key=lambda event: event[0])
+    return header, events
+
+
+class Pseudonymizer:
+    def __init__(self, key):
+        self._key = key
+
+    def _digest(self, value):
+        return hmac.new(self._key, str(value).encode("utf-8"), hashlib.sha256).digest()
+
+    def user_id(self, value):
+        # Keep the sign (groups are negative) and stay within Telegram's id range.
+        n = int.from_bytes(self._digest(value)[:5], "big") % 10**11 + 10**6
+        return -n if int(value) < 0 else n
+
+    def name(self, value):
+        digest = self._digest(value)
+        words = []
+        for i in range(0, 4, 2):
+            word = "".join(_SYLLABLES[b % len(_SYLLABLES)] for b in digest[i * 3:i * 3 + 3])
+            words.append(word.capitalize())
+        return " ".join(words)
+
+    def text(self, value):
+        """Hide free text that could be a person's name; keep everything else."""
+        stripped = value.strip()
+        if not stripped or stripped.startswith("/") or not _NAME_LIKE.fullmatch(stripped):
+            return value
+        return self.name(stripped)
+
+
+def _compact_user(user, pseudo):
+    return {"id": pseudo.user_id(user["id"]), "is_bot": user.get("is_bot", False),
+            "first_name": "Bot" if user.get("is_bot") else "User"}
+
+
+def _compact_chat(chat, pseudo):
+    return {"id": pseudo.user_id(chat["id"]), "type": chat.get("type", "private")}
+
+
+def _compact_message(message, pseudo, keep_text=True):
+    out = {"message_id": message["message_id"], "date": message.get("date", 0),
+           "chat": _compact_chat(message["chat"], pseudo)}
+    if "from" in message:
+        out["from"] = _compact_user(message["from"], pseudo)
+    if keep_text and "text" in message:
+        out["text"] = pseudo.text(message["text"])
+    return out
+
+
+def sanitize_update(update, pseudo):
+    """Strip an update down to what the handlers read, with identities replaced."""
+    out = {"update_id": update["update_id"]}
+    if "message" in update:
+        out["message"] = _compact_message(update["message"], pseudo)
+    elif "callback_query" in update:
+        cq = update["callback_query"]
+        out["callback_query"] = {
+            "id": cq["id"], "chat_instance": "0", "data": cq.get("data", ""),
+            "from": _compact_user(cq["from"], pseudo),
+        }
+        if "message" in cq:
+            # The bot's own message text is not needed to route the press.
+            out["callback_query"]["message"] = _compact_message(cq["message"], pseudo, keep_text=False)
+    else:
+        return None
+    return out
+
+
+class TrafficRecorder:
+    def __init__(self, path, salt=None, admin_ids=()):
+        key = salt.encode("utf-8") if salt else secrets.token_bytes(32)
+        self.path    = fresh_path(path)
+        self._pseudo = Pseudonymizer(key)
+        self._start  = time.monotonic()
+        self._queue  = queue.SimpleQueue()
+        self._file   = open_log(self.path, "x")
+        self._write({"v": FORMAT_VERSION, "started": int(time.time()),
+                     "admins": [self._pseudo.user_id(a) for a in admin_ids]})
+        self._file.flush()
+        self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+        self._thread.start()
+        logging.info(f"[RECORD] Writing webhook traffic to {self.path}")
+
+    def _write(self, entry):
+        self._file.write(json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n")
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            while item is not None:
+                self._record(*item)
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            self._file.flush()
+            if item is None:
+                return
+
+    def _record(self, offset, update_str):
+        try:
+            update = sanitize_update(json.loads(update_str), self._pseudo)
+        except (ValueError, KeyError, TypeError) as e:
+            logging.warning(f"[RECORD] Skipping unparseable update: {e}")
+            return
+        if update is not None:
+            self._write({"t": offset, "u": update})
+
+    def record(self, update_str):
+        """Queue an update for the writer thread; cheap enough for the event loop."""
+        self._queue.put((round(time.monotonic() - self._start, 3), update_str))
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+
+def recorder_from_env(admin_ids=()):
+    path = os.getenv("WEBHOOK_RECORD_PATH", "").strip()
+    if not path:
+        return None
+    return TrafficRecorder(path, os.getenv("WEBHOOK_RECORD_SALT") or None, admin_ids)